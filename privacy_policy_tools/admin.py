@@ -24,28 +24,168 @@ This module provides the admin settings of the privacy_policy_tools.
 """
 
 from django.contrib import admin
+from django.contrib.admin.views.main import ChangeList
+from django.contrib.auth import get_user_model
+from django.core.exceptions import ImproperlyConfigured
+from django.db.models import OuterRef, Subquery
 # Removed gettext_lazy import
-from .models import PrivacyPolicy, PrivacyPolicyConfirmation
+from .conf import get_app_settings
+from .forms import PrivacyPolicyForm
+from .paginators import EstimatedCountPaginator
+from .registry import policies_changed
+from .models import PolicyLineage, PolicyUptake, PrivacyPolicy, \
+    PrivacyPolicyConfirmation
 
 @admin.register(PrivacyPolicy)
 class PrivacyPolicyAdmin(admin.ModelAdmin):
-    list_display = ('title', 'version', 'published_at', 'for_group', 'active')
+    list_display = ('title', 'version', 'published_at', 'for_group', 'active',
+                    'confirmed', 'pending')
     list_filter = ['active', 'for_group', 'published_at']
-    search_fields = ['title', 'text']
+    search_fields = ['title']
+    form = PrivacyPolicyForm
+    fields = ('title', 'text', 'confirm_checkbox', 'confirm_checkbox_text',
+              'confirm_button_text', 'active', 'published_at', 'for_group',
+              'version')
     date_hierarchy = 'published_at'
     actions = ['make_active', 'make_inactive']
 
+    def get_queryset(self, request):
+        uptake = PolicyUptake.objects.filter(
+            privacy_policy=OuterRef('pk'), group=None)
+        return super().get_queryset(request).annotate(
+            uptake_confirmed=Subquery(uptake.values('confirmed')[:1]),
+            uptake_pending=Subquery(uptake.values('pending')[:1]))
+
+    @admin.display(description='confirmed', ordering='uptake_confirmed')
+    def confirmed(self, obj):
+        return obj.uptake_confirmed
+
+    @admin.display(description='pending', ordering='uptake_pending')
+    def pending(self, obj):
+        return obj.uptake_pending
+
     def make_active(self, request, queryset):
+        lineage_ids = set(queryset.values_list('lineage_id', flat=True))
         queryset.update(active=True)
+        PolicyLineage.update_current_versions(lineage_ids)
+        policies_changed()
     make_active.short_description = "Mark selected policies as active"
 
     def make_inactive(self, request, queryset):
+        lineage_ids = set(queryset.values_list('lineage_id', flat=True))
         queryset.update(active=False)
+        PolicyLineage.update_current_versions(lineage_ids)
+        policies_changed()
     make_inactive.short_description = "Mark selected policies as inactive"
 
+@admin.register(PolicyUptake)
+class PolicyUptakeAdmin(admin.ModelAdmin):
+    """
+    Dashboard of the uptake of the active policies. The numbers are
+    computed by the command compute_policy_uptake.
+    """
+    list_display = ('privacy_policy', 'group', 'applicable', 'confirmed',
+                    'pending', 'second_pending', 'computed_at')
+    list_filter = ['privacy_policy']
+    list_select_related = ('privacy_policy', 'group')
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+@admin.register(PolicyLineage)
+class PolicyLineageAdmin(admin.ModelAdmin):
+    list_display = ('title', 'for_group', 'current_version')
+    list_select_related = ('for_group', 'current_version')
+    readonly_fields = ('current_version',)
+    search_fields = ['title']
+
+class ActivePolicyListFilter(admin.SimpleListFilter):
+    """
+    Filters confirmations by the active policies only.
+    """
+    title = 'active privacy policy'
+    parameter_name = 'privacy_policy__id__exact'
+
+    def lookups(self, request, model_admin):
+        return [(policy.id, str(policy))
+                for policy in PrivacyPolicy.objects.filter(active=True)]
+
+    def queryset(self, request, queryset):
+        if self.value():
+            return queryset.filter(privacy_policy_id=self.value())
+        return queryset
+
+
+class LargeTableChangeList(ChangeList):
+    """
+    Change list which loads only the displayed fields.
+    """
+
+    def get_queryset(self, request, *args, **kwargs):
+        queryset = super().get_queryset(request, *args, **kwargs)
+        return queryset.only(*self.model_admin.get_list_only(request))
+
+
 @admin.register(PrivacyPolicyConfirmation)
 class PrivacyPolicyConfirmationAdmin(admin.ModelAdmin):
+    """
+    Admin of the confirmations. With the setting LARGE_TABLE_ADMIN the
+    change list avoids queries which get slow on large tables.
+    """
     list_display = ('user', 'privacy_policy', 'confirmed_at', 'second_confirmed_at')
     list_filter = ['privacy_policy', 'confirmed_at', 'second_confirmed_at']
+    list_select_related = ('user', 'privacy_policy')
     search_fields = ['user__username', 'privacy_policy__title']
-    date_hierarchy = 'confirmed_at'
+
+    @property
+    def large_table(self):
+        try:
+            return get_app_settings().large_table_admin
+        except ImproperlyConfigured:
+            # reported by the system check privacy_policy_tools.E003
+            return False
+
+    @property
+    def date_hierarchy(self):
+        return None if self.large_table else 'confirmed_at'
+
+    @property
+    def raw_id_fields(self):
+        return ('user', 'privacy_policy') if self.large_table else ()
+
+    @property
+    def show_full_result_count(self):
+        return not self.large_table
+
+    def get_list_filter(self, request):
+        if self.large_table:
+            return [ActivePolicyListFilter, 'second_confirmed_at']
+        return self.list_filter
+
+    def get_search_fields(self, request):
+        if self.large_table:
+            # exact lookups on unique columns use their index
+            return ['user__%s__exact' % get_user_model().USERNAME_FIELD]
+        return self.search_fields
+
+    def get_list_only(self, request):
+        username = get_user_model().USERNAME_FIELD
+        return ('confirmed_at', 'second_confirmed_at', 'user__' + username,
+                'privacy_policy__title', 'privacy_policy__version')
+
+    def get_paginator(self, request, queryset, per_page, orphans=0,
+                      allow_empty_first_page=True):
+        paginator = EstimatedCountPaginator if self.large_table \
+            else self.paginator
+        return paginator(queryset, per_page, orphans, allow_empty_first_page)
+
+    def get_changelist(self, request, **kwargs):
+        if self.large_table:
+            return LargeTableChangeList
+        return super().get_changelist(request, **kwargs)
@@ -24,6 +24,8 @@ This module provides some configuration.
 """
 
 from django.apps import AppConfig
+from django.contrib.auth import get_user_model
+from django.db.models.signals import m2m_changed
 from django.utils.translation import gettext_lazy as _
 
 
@@ -31,3 +33,17 @@ class PrivacyPolicyToolsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'privacy_policy_tools'
     verbose_name = _('Privacy Policy Tools')
+
+    def ready(self):
+        """
+        Connects the signal receivers, registers the system checks and
+        imports the configured hooks.
+        """
+        from privacy_policy_tools import checks, signals
+        from privacy_policy_tools.utils import resolve_hooks
+        groups = getattr(get_user_model(), 'groups', None)
+        if groups is not None:
+            m2m_changed.connect(signals.user_groups_changed,
+                                sender=groups.through,
+                                dispatch_uid='privacy_policy_tools_groups')
+        resolve_hooks()
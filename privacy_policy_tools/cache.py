@@ -0,0 +1,353 @@
+
+# Copyright (c) 2022 Josef Wachtler
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+This module provides the caching helpers of the privacy_policy_tools.
+
+The policy generation is a counter in the configured cache which is
+changed on every change of the policies. All processes compare it with
+the generation of their in-memory state to find out if the state is
+stale.
+"""
+import math
+import random
+import time
+
+from django.core.cache import caches
+
+from privacy_policy_tools.conf import get_app_settings
+
+GENERATION_KEY = 'privacy_policy_tools:generation'
+COMPLIANCE_KEY = 'privacy_policy_tools:compliance:%s'
+HOOK_KEY = 'privacy_policy_tools:hook:%s:%s'
+MEMOIZABLE_HOOKS = ('START_HOOK', 'SECOND_CONFIRMATION_REQUIRED_HOOK')
+
+
+class _LocalGeneration:
+    """
+    The generation last read by this process.
+    """
+    value = None
+    checked_at = None
+
+
+_local = _LocalGeneration()
+
+
+def get_cache():
+    """
+    Returns the cache configured by the setting CACHE_ALIAS.
+    """
+    return caches[get_app_settings().cache_alias]
+
+
+def _new_generation():
+    """
+    Returns a fresh generation value.
+
+    It is derived from the current time so that a generation lost by
+    eviction is never reused.
+    """
+    return time.time_ns()
+
+
+def get_generation():
+    """
+    Returns the current generation of the policy set or None if the
+    cache does not store values.
+    """
+    cache = get_cache()
+    generation = cache.get(GENERATION_KEY)
+    if generation is None:
+        cache.add(GENERATION_KEY, _new_generation(), None)
+        generation = cache.get(GENERATION_KEY)
+    return generation
+
+
+async def aget_generation():
+    """
+    Async version of get_generation.
+    """
+    cache = get_cache()
+    generation = await cache.aget(GENERATION_KEY)
+    if generation is None:
+        await cache.aadd(GENERATION_KEY, _new_generation(), None)
+        generation = await cache.aget(GENERATION_KEY)
+    return generation
+
+
+def _local_is_due():
+    """
+    Returns True if the generation has to be read from the cache again.
+    """
+    checked_at = _local.checked_at
+    interval = get_app_settings().generation_check_interval
+    return checked_at is None or time.monotonic() - checked_at >= interval
+
+
+def current_generation():
+    """
+    Returns the policy generation like get_generation, but reads the cache
+    at most once every GENERATION_CHECK_INTERVAL seconds. Between the
+    reads the value last seen by this process is returned.
+    """
+    if _local_is_due():
+        _local.value = get_generation()
+        _local.checked_at = time.monotonic()
+    return _local.value
+
+
+async def acurrent_generation():
+    """
+    Async version of current_generation.
+    """
+    if _local_is_due():
+        _local.value = await aget_generation()
+        _local.checked_at = time.monotonic()
+    return _local.value
+
+
+def reset_local_generation():
+    """
+    Forgets the generation last seen by this process.
+    """
+    _local.checked_at = None
+
+
+def bump_generation():
+    """
+    Starts a new generation of the policy set. This invalidates all
+    cached compliance entries and the in-memory state of all processes.
+    """
+    cache = get_cache()
+    try:
+        generation = cache.incr(GENERATION_KEY)
+    except ValueError:
+        generation = _new_generation()
+        cache.set(GENERATION_KEY, generation, None)
+    _local.value = generation
+    _local.checked_at = time.monotonic()
+    return generation
+
+
+def compliance_enabled():
+    """
+    Returns True if the per-user compliance cache is enabled.
+    """
+    return bool(get_app_settings().compliance_cache_timeout)
+
+
+def get_compliance(user):
+    """
+    Looks up the compliance entry of a user.
+
+    Returns a tuple of the current generation and a boolean which is
+    True if the user was compliant in this generation. If
+    COMPLIANCE_EARLY_REFRESH is set the entry is randomly treated as
+    missing shortly before it expires, so the entries of users who were
+    cached at the same time are not recomputed at once.
+
+    Keyword arguments:
+        - user -- user object
+    """
+    generation = current_generation()
+    if generation is None:
+        return None, False
+    entry = get_cache().get(COMPLIANCE_KEY % user.pk)
+    return generation, _is_compliant(entry, generation)
+
+
+async def aget_compliance(user):
+    """
+    Async version of get_compliance.
+    """
+    generation = await acurrent_generation()
+    if generation is None:
+        return None, False
+    entry = await get_cache().aget(COMPLIANCE_KEY % user.pk)
+    return generation, _is_compliant(entry, generation)
+
+
+def _is_compliant(entry, generation):
+    """
+    Returns True if a compliance entry is valid for the generation.
+
+    Keyword arguments:
+        - entry -- the cached entry or None
+        - generation -- the current generation
+    """
+    if not entry or entry[0] != generation:
+        return False
+    return not _refresh_early(entry)
+
+
+def _refresh_early(entry):
+    """
+    Returns True if a compliance entry should be recomputed before it
+    expires (probabilistic early expiration).
+
+    Keyword arguments:
+        - entry -- tuple of generation, expiry time and computation time
+    """
+    beta = get_app_settings().compliance_early_refresh
+    if not beta:
+        return False
+    _, expires_at, delta = entry
+    gap = -delta * beta * math.log(1.0 - random.random())
+    return time.time() + gap >= expires_at
+
+
+def set_compliant(user, generation, delta=0):
+    """
+    Remembers that a user is compliant in the given generation.
+
+    Keyword arguments:
+        - user -- user object
+        - generation -- generation read before the evaluation started
+        - delta -- seconds the evaluation took
+    """
+    if generation is None:
+        return
+    timeout = get_app_settings().compliance_cache_timeout
+    entry = (generation, time.time() + timeout, delta)
+    get_cache().set(COMPLIANCE_KEY % user.pk, entry, timeout)
+
+
+async def aset_compliant(user, generation, delta=0):
+    """
+    Async version of set_compliant.
+    """
+    if generation is None:
+        return
+    timeout = get_app_settings().compliance_cache_timeout
+    entry = (generation, time.time() + timeout, delta)
+    await get_cache().aset(COMPLIANCE_KEY % user.pk, entry, timeout)
+
+
+def invalidate_compliance(user_ids):
+    """
+    Removes the compliance entries of the given users.
+
+    Keyword arguments:
+        - user_ids -- iterable of user primary keys
+    """
+    keys = [COMPLIANCE_KEY % pk for pk in user_ids]
+    if keys:
+        get_cache().delete_many(keys)
+
+
+def _hook_timeout(name):
+    """
+    Returns the number of seconds the results of a hook are memoized or
+    0 if the hook is not listed in MEMOIZE_HOOKS.
+
+    Keyword arguments:
+        - name -- name of the hook setting
+    """
+    return get_app_settings().memoize_hooks.get(name, 0)
+
+
+def _memoized(results, key):
+    """
+    Returns a tuple of a boolean which is True if a result for the key is
+    memoized and not expired, and the result.
+
+    Keyword arguments:
+        - results -- dict of memoized results of a user or None
+        - key -- key of the result
+    """
+    if results and key in results:
+        result, expires_at = results[key]
+        if time.time() < expires_at:
+            return True, result
+    return False, None
+
+
+def _memoize(results, key, result, timeout):
+    """
+    Returns a copy of the results with the result for the key added.
+
+    Keyword arguments:
+        - results -- dict of memoized results of a user or None
+        - key -- key of the result
+        - result -- result of the hook
+        - timeout -- seconds the result is valid
+    """
+    results = dict(results or {})
+    results[key] = (result, time.time() + timeout)
+    return results
+
+
+def memoize_hook(name, user_id, key, call):
+    """
+    Calls a hook and memoizes its result per user and key if the hook is
+    listed in MEMOIZE_HOOKS. All results of a hook for a user are stored
+    in one cache entry.
+
+    Keyword arguments:
+        - name -- name of the hook setting
+        - user_id -- primary key of the user
+        - key -- key of the result, e.g. the confirmation id
+        - call -- function without arguments which calls the hook
+    """
+    timeout = _hook_timeout(name)
+    if not timeout:
+        return call()
+    cache = get_cache()
+    cache_key = HOOK_KEY % (name, user_id)
+    results = cache.get(cache_key)
+    found, result = _memoized(results, key)
+    if not found:
+        result = call()
+        cache.set(cache_key, _memoize(results, key, result, timeout),
+                  timeout)
+    return result
+
+
+async def amemoize_hook(name, user_id, key, call):
+    """
+    Async version of memoize_hook. The call has to return an awaitable.
+    """
+    timeout = _hook_timeout(name)
+    if not timeout:
+        return await call()
+    cache = get_cache()
+    cache_key = HOOK_KEY % (name, user_id)
+    results = await cache.aget(cache_key)
+    found, result = _memoized(results, key)
+    if not found:
+        result = await call()
+        await cache.aset(cache_key,
+                         _memoize(results, key, result, timeout), timeout)
+    return result
+
+
+def invalidate_hook_results(user_ids):
+    """
+    Removes the memoized hook results of the given users.
+
+    Keyword arguments:
+        - user_ids -- iterable of user primary keys
+    """
+    keys = [HOOK_KEY % (name, pk)
+            for pk in user_ids for name in MEMOIZABLE_HOOKS]
+    if keys:
+        get_cache().delete_many(keys)
@@ -0,0 +1,74 @@
+
+# Copyright (c) 2022 Josef Wachtler
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+This module provides the system checks of the privacy_policy_tools.
+"""
+from django.core.checks import Error, register
+from django.core.exceptions import ImproperlyConfigured
+
+from privacy_policy_tools.conf import get_app_settings
+from privacy_policy_tools.utils import HOOK_SETTINGS, get_by_py_path
+
+
+@register()
+def check_settings(app_configs, **kwargs):
+    """
+    Reports invalid values in PRIVACY_POLICY_TOOLS.
+    """
+    try:
+        get_app_settings()
+    except ImproperlyConfigured as e:
+        return [Error(str(e), id='privacy_policy_tools.E003')]
+    return []
+
+
+@register()
+def check_hooks(app_configs, **kwargs):
+    """
+    Reports hooks in PRIVACY_POLICY_TOOLS which can not be imported or
+    are not callable.
+    """
+    try:
+        app_settings = get_app_settings()
+    except ImproperlyConfigured:
+        return []
+    errors = []
+    for name in HOOK_SETTINGS:
+        py_path = getattr(app_settings, name.lower())
+        if not py_path:
+            continue
+        try:
+            hook = get_by_py_path(py_path)
+        except (ImportError, AttributeError, ValueError) as e:
+            errors.append(Error(
+                "The %s '%s' can not be imported: %s" % (name, py_path, e),
+                hint='Use the python-dotted path of a function.',
+                id='privacy_policy_tools.E001',
+            ))
+            continue
+        if not callable(hook):
+            errors.append(Error(
+                "The %s '%s' is not callable." % (name, py_path),
+                hint='Use the python-dotted path of a function.',
+                id='privacy_policy_tools.E002',
+            ))
+    return errors
@@ -0,0 +1,168 @@
+
+# Copyright (c) 2022 Josef Wachtler
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+This module provides the settings of the privacy_policy_tools.
+
+The dict PRIVACY_POLICY_TOOLS is validated once and converted into an
+immutable AppSettings object. It is rebuilt if the settings change.
+"""
+import dataclasses
+import re
+from collections.abc import Mapping
+from types import MappingProxyType
+from typing import Optional, Tuple, Union, get_args, get_origin
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+
+@dataclasses.dataclass(frozen=True)
+class AppSettings:
+    """
+    Immutable snapshot of PRIVACY_POLICY_TOOLS. Each field corresponds to
+    the upper case key of the setting.
+    """
+    enabled: bool = False
+    policy_page_url: str = 'terms/and/conditions'
+    policy_confirm_url: str = 'terms/and/conditions/confirm'
+    second_confirm_required_url: str = 'confirm/second/required'
+    second_confirm_url: str = 'confirm/second'
+    export_url: str = 'confirmations/export'
+    default_policy: bool = True
+    enforce_before_view: bool = False
+    ignore_urls: Tuple[str, ...] = ()
+    ignore_prefixes: Tuple[str, ...] = ()
+    ignore_regexes: Tuple[str, ...] = ()
+    ignore_url_names: Tuple[str, ...] = ()
+    ignore_namespaces: Tuple[str, ...] = ()
+    start_hook: Optional[str] = None
+    second_confirmation_required_hook: Optional[str] = None
+    second_confirmation_get_email_hook: Optional[str] = None
+    second_confirmation_save_email_hook: Optional[str] = None
+    second_confirm_valid_for_minutes: int = 10
+    second_confirm_from_email: str = 'no-reply@example.com'
+    cache_alias: str = 'default'
+    compliance_cache_timeout: float = 0
+    compliance_early_refresh: float = 0
+    registry_timeout: float = 60
+    generation_check_interval: float = 1
+    rebuild_lock_timeout: float = 10
+    large_table_admin: bool = False
+    show_cache_timeout: float = 300
+    sanitize_tags: Optional[Tuple[str, ...]] = None
+    sanitize_attributes: Optional[Mapping] = None
+    sanitize_styles: Optional[Tuple[str, ...]] = None
+    compress_policy_text: bool = False
+    memoize_hooks: Mapping = dataclasses.field(
+        default_factory=lambda: MappingProxyType({}))
+
+    @classmethod
+    def from_dict(cls, values):
+        """
+        Validates a dict like PRIVACY_POLICY_TOOLS and returns the
+        settings. Unknown keys are ignored.
+
+        Keyword arguments:
+            - values -- dict of settings
+        """
+        kwargs = {}
+        for field in dataclasses.fields(cls):
+            key = field.name.upper()
+            if key in values:
+                kwargs[field.name] = _convert(key, values[key], field.type)
+        _check_regexes('IGNORE_REGEXES', kwargs.get('ignore_regexes', ()))
+        return cls(**kwargs)
+
+
+def _check_regexes(key, patterns):
+    """
+    Compiles each regular expression like the ExemptionMatcher does or
+    raises ImproperlyConfigured.
+
+    Keyword arguments:
+        - key -- name of the setting
+        - patterns -- configured regular expressions
+    """
+    for pattern in patterns:
+        try:
+            re.compile('(?:%s)' % pattern)
+        except re.error as e:
+            raise ImproperlyConfigured(
+                "PRIVACY_POLICY_TOOLS['%s'] has an invalid regular "
+                "expression %r: %s" % (key, pattern, e))
+
+
+def _convert(key, value, expected):
+    """
+    Converts a value to the type of a field or raises
+    ImproperlyConfigured.
+
+    Keyword arguments:
+        - key -- name of the setting
+        - value -- configured value
+        - expected -- type annotation of the field
+    """
+    origin = get_origin(expected)
+    if expected is bool:
+        return bool(value)
+    if origin is Union:
+        if value is None:
+            return None
+        expected = get_args(expected)[0]
+        origin = get_origin(expected)
+    if origin is tuple:
+        if isinstance(value, (list, tuple)) and \
+                all(isinstance(v, str) for v in value):
+            return tuple(value)
+    elif expected is Mapping:
+        if isinstance(value, Mapping):
+            return MappingProxyType(dict(value))
+    elif expected is float:
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            return value
+    elif isinstance(value, expected):
+        return value
+    raise ImproperlyConfigured(
+        "PRIVACY_POLICY_TOOLS['%s'] has an invalid value: %r"
+        % (key, value))
+
+
+_settings = None
+
+
+def get_app_settings():
+    """
+    Returns the AppSettings and builds them on first use.
+    """
+    global _settings
+    if _settings is None:
+        _settings = AppSettings.from_dict(
+            getattr(settings, 'PRIVACY_POLICY_TOOLS', None) or {})
+    return _settings
+
+
+def reset_app_settings():
+    """
+    Drops the AppSettings. The next call of get_app_settings rebuilds them.
+    """
+    global _settings
+    _settings = None
@@ -23,7 +23,7 @@
 This module provides some context processors.
 """
 
-from privacy_policy_tools.utils import get_setting
+from privacy_policy_tools.conf import get_app_settings
 
 
 def privacy_tools(request):
@@ -37,12 +37,8 @@ def privacy_tools(request):
     Keyword arguments:
         - request -- the calling HttpRequest
     """
-    enabled = get_setting(
-        'ENABLED',
-        'terms/and/conditions'
-    )
     v = {
-        'privacy_enabled': enabled,
+        'privacy_enabled': get_app_settings().enabled,
         'privacy_view': 'privacy_policy_tools.views.show'
     }
 
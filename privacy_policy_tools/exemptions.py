@@ -0,0 +1,171 @@
+
+# Copyright (c) 2022 Josef Wachtler
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+This module provides the matcher which decides if a request is exempt
+from the PrivacyPolicyMiddleware.
+
+All configured exemptions are compiled into one regular expression and
+two sets on first use. The matcher is rebuilt if the settings change.
+"""
+import re
+
+from django.conf import settings
+from django.urls import NoReverseMatch, get_script_prefix, reverse
+
+from privacy_policy_tools.conf import get_app_settings
+
+APP_URL_NAMES = frozenset([
+    'privacy_policy_tools.views.show',
+    'privacy_policy_tools.views.confirm',
+    'privacy_policy_tools.views.second_confirm_required',
+    'privacy_policy_tools.views.second_confirm',
+])
+
+
+class ExemptionMatcher:
+    """
+    This class matches requests against the compiled exemptions.
+    """
+
+    def __init__(self, pattern, url_names, namespaces):
+        """
+        Constructor: sets the compiled exemptions
+
+        Keyword arguments:
+            - pattern -- compiled regular expression for the path or None
+            - url_names -- set of exempt URL names
+            - namespaces -- set of exempt URL namespaces
+        """
+        self.pattern = pattern
+        self.url_names = url_names
+        self.namespaces = namespaces
+
+    def matches(self, request):
+        """
+        Returns True if the request is exempt.
+
+        The URL names and namespaces are only known after the URL was
+        resolved, which is the case in process_view and after the
+        response was created.
+
+        Keyword arguments:
+            - request -- calling HttpRequest
+        """
+        if self.pattern is not None and \
+                self.pattern.search(request.path_info):
+            return True
+        match = getattr(request, 'resolver_match', None)
+        if match is None:
+            return False
+        return match.url_name in self.url_names or \
+            match.view_name in self.url_names or \
+            not self.namespaces.isdisjoint(match.namespaces)
+
+
+def _local_prefix(url):
+    """
+    Returns the path of a local URL like STATIC_URL or None if it points
+    to another host or to the root of the site.
+
+    Keyword arguments:
+        - url -- URL to convert
+    """
+    if not url or '://' in url or url.startswith('//'):
+        return None
+    path = url if url.startswith('/') else '/' + url
+    return path if path != '/' else None
+
+
+def _reverse_path(name):
+    """
+    Returns the path_info of a URL name without arguments or None if it
+    can not be reversed.
+
+    Keyword arguments:
+        - name -- URL name to reverse
+    """
+    try:
+        path = reverse(name)
+    except NoReverseMatch:
+        return None
+    prefix = get_script_prefix()
+    if path.startswith(prefix):
+        path = '/' + path[len(prefix):]
+    return path
+
+
+def build_matcher():
+    """
+    Compiles the exemptions of the settings into a new ExemptionMatcher.
+
+    Settings:
+        - POLICY_PAGE_URL, IGNORE_URLS -- paths containing these values
+        - IGNORE_PREFIXES -- paths starting with these values
+        - IGNORE_REGEXES -- paths matching these regular expressions
+        - IGNORE_URL_NAMES -- URL names, reversed to paths if possible
+        - IGNORE_NAMESPACES -- URL namespaces
+        - STATIC_URL, MEDIA_URL -- always exempt if local
+    """
+    app_settings = get_app_settings()
+    parts = []
+    contains = [app_settings.policy_page_url]
+    contains.extend(app_settings.ignore_urls)
+    parts.extend(re.escape(value) for value in contains)
+
+    prefixes = list(app_settings.ignore_prefixes)
+    prefixes.append(_local_prefix(getattr(settings, 'STATIC_URL', None)))
+    prefixes.append(_local_prefix(getattr(settings, 'MEDIA_URL', None)))
+    parts.extend('^' + re.escape(p) for p in prefixes if p)
+
+    parts.extend('(?:%s)' % r for r in app_settings.ignore_regexes)
+
+    url_names = set(APP_URL_NAMES)
+    for name in app_settings.ignore_url_names:
+        url_names.add(name)
+        path = _reverse_path(name)
+        if path is not None:
+            parts.append('^%s$' % re.escape(path))
+
+    pattern = re.compile('|'.join(parts)) if parts else None
+    return ExemptionMatcher(pattern, frozenset(url_names),
+                            frozenset(app_settings.ignore_namespaces))
+
+
+_matcher = None
+
+
+def get_matcher():
+    """
+    Returns the ExemptionMatcher and builds it on first use.
+    """
+    global _matcher
+    if _matcher is None:
+        _matcher = build_matcher()
+    return _matcher
+
+
+def reset_matcher():
+    """
+    Drops the ExemptionMatcher. The next call of get_matcher rebuilds it.
+    """
+    global _matcher
+    _matcher = None
@@ -0,0 +1,201 @@
+
+# Copyright (c) 2022 Josef Wachtler
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+This module streams the confirmations of the privacy_policy_tools for
+audits.
+
+The confirmations are read in keyset-paginated chunks ordered by id and
+written row by row as CSV or JSON Lines, optionally gzip compressed. The
+memory usage does not depend on the number of confirmations.
+"""
+import csv
+import json
+import zlib
+from datetime import datetime, time
+
+from django.contrib.auth import get_user_model
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from privacy_policy_tools.models import PrivacyPolicyConfirmation
+
+FORMATS = ('csv', 'jsonl')
+CONTENT_TYPES = {
+    'csv': 'text/csv',
+    'jsonl': 'application/x-ndjson',
+}
+FIELDS = ('id', 'user_id', 'username', 'privacy_policy_id', 'policy_title',
+          'policy_version', 'for_group', 'confirmed_at',
+          'second_confirmed_at')
+CHUNK_SIZE = 2000
+
+
+def parse_moment(value):
+    """
+    Parses an ISO 8601 date or datetime into an aware datetime or raises
+    ValueError.
+
+    Keyword arguments:
+        - value -- date or datetime string
+    """
+    moment = parse_datetime(value)
+    if moment is None:
+        date = parse_date(value)
+        if date is None:
+            raise ValueError('Invalid date: %s' % value)
+        moment = datetime.combine(date, time.min)
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment)
+    return moment
+
+
+def get_confirmations(policies=None, groups=None, since=None, until=None):
+    """
+    Returns a queryset of the confirmations to export.
+
+    Keyword arguments:
+        - policies -- ids of the confirmed policies
+        - groups -- ids of the groups of the confirmed policies
+        - since -- only confirmations at or after this datetime
+        - until -- only confirmations before this datetime
+    """
+    confirmations = PrivacyPolicyConfirmation.objects.all()
+    if policies:
+        confirmations = confirmations.filter(privacy_policy__in=policies)
+    if groups:
+        confirmations = confirmations.filter(
+            privacy_policy__for_group__in=groups)
+    if since is not None:
+        confirmations = confirmations.filter(confirmed_at__gte=since)
+    if until is not None:
+        confirmations = confirmations.filter(confirmed_at__lt=until)
+    return confirmations
+
+
+def iter_rows(confirmations, chunk_size=CHUNK_SIZE):
+    """
+    Yields a tuple of FIELDS per confirmation. The user and the policy
+    are joined in the same query, one query per chunk.
+
+    Keyword arguments:
+        - confirmations -- queryset of confirmations
+        - chunk_size -- number of confirmations per query
+    """
+    username = 'user__' + get_user_model().USERNAME_FIELD
+    confirmations = confirmations.order_by('id').values_list(
+        'id', 'user_id', username, 'privacy_policy_id',
+        'privacy_policy__title', 'privacy_policy__version',
+        'privacy_policy__for_group__name', 'confirmed_at',
+        'second_confirmed_at')
+    last_id = None
+    while True:
+        chunk = confirmations if last_id is None \
+            else confirmations.filter(id__gt=last_id)
+        count = 0
+        for row in chunk[:chunk_size].iterator(chunk_size=chunk_size):
+            count += 1
+            last_id = row[0]
+            yield row
+        if count < chunk_size:
+            return
+
+
+def _isoformat(value):
+    """
+    Returns a datetime in ISO 8601 format, other values as they are.
+    """
+    return value.isoformat() if hasattr(value, 'isoformat') else value
+
+
+class _Echo:
+    """
+    File-like object which returns the written value to the csv writer.
+    """
+
+    def write(self, value):
+        return value
+
+
+def iter_csv(rows):
+    """
+    Yields the rows as lines of CSV with a header.
+
+    Keyword arguments:
+        - rows -- iterable of tuples of FIELDS
+    """
+    writer = csv.writer(_Echo())
+    yield writer.writerow(FIELDS)
+    for row in rows:
+        yield writer.writerow([_isoformat(value) for value in row])
+
+
+def iter_jsonl(rows):
+    """
+    Yields the rows as JSON Lines.
+
+    Keyword arguments:
+        - rows -- iterable of tuples of FIELDS
+    """
+    for row in rows:
+        yield json.dumps(
+            dict(zip(FIELDS, (_isoformat(value) for value in row)))) + '\n'
+
+
+def iter_gzip(lines, min_size=64 * 1024):
+    """
+    Yields the lines gzip compressed in blocks of at least min_size
+    uncompressed bytes.
+
+    Keyword arguments:
+        - lines -- iterable of str
+        - min_size -- number of bytes to collect before compressing
+    """
+    compressor = zlib.compressobj(wbits=31)
+    buffer = []
+    size = 0
+    for line in lines:
+        data = line.encode()
+        buffer.append(data)
+        size += len(data)
+        if size >= min_size:
+            block = compressor.compress(b''.join(buffer))
+            buffer, size = [], 0
+            if block:
+                yield block
+    yield compressor.compress(b''.join(buffer)) + compressor.flush()
+
+
+def export(confirmations, file_format='csv', compress=False,
+           chunk_size=CHUNK_SIZE):
+    """
+    Returns an iterator over the exported confirmations. It yields str or
+    bytes if compress is True.
+
+    Keyword arguments:
+        - confirmations -- queryset of confirmations
+        - file_format -- csv or jsonl
+        - compress -- True to compress with gzip
+        - chunk_size -- number of confirmations per query
+    """
+    rows = iter_rows(confirmations, chunk_size)
+    lines = iter_csv(rows) if file_format == 'csv' else iter_jsonl(rows)
+    return iter_gzip(lines) if compress else lines
@@ -25,6 +25,7 @@ This module provides the forms of the privacy_policy_tools.
 
 from django import forms
 from django.utils.translation import gettext_lazy as _
+from tinymce.widgets import TinyMCE
 
 
 class SecondConfirmGetEmail(forms.Form):
@@ -53,3 +54,27 @@ class ConfirmForm(forms.Form):
         agree_label = kwrds.pop('agree_label')
         super(ConfirmForm, self).__init__(*args, **kwrds)
         self.fields['agree'].label = _(agree_label)
+
+
+class PrivacyPolicyForm(forms.ModelForm):
+    """
+    This is the admin form of a policy. The text is not a field of the
+    model, it is assigned to the policy and stored in PolicyText on save.
+
+    Fields:
+        - text -- HTML of the policy
+    """
+    text = forms.CharField(widget=TinyMCE(), label=_('Text'))
+
+    def __init__(self, *args, **kwargs):
+        """
+        constructor
+        sets the initial text of an existing policy
+        """
+        super().__init__(*args, **kwargs)
+        if self.instance.pk is not None:
+            self.fields['text'].initial = self.instance.text
+
+    def save(self, commit=True):
+        self.instance.text = self.cleaned_data['text']
+        return super().save(commit)
@@ -0,0 +1,176 @@
+
+# Copyright (c) 2022 Josef Wachtler
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+This module imports historical confirmations of the privacy_policy_tools,
+e.g. from another consent system.
+
+The records are read as a stream and processed in batches. Every batch
+looks up its users and policies with one query each and is inserted in
+one transaction. Existing confirmations are kept.
+"""
+import csv
+import json
+from itertools import islice
+
+from django.contrib.auth import get_user_model
+from django.db import transaction
+
+from privacy_policy_tools.cache import invalidate_compliance, \
+    invalidate_hook_results
+from privacy_policy_tools.exports import parse_moment
+from privacy_policy_tools.models import PrivacyPolicy, \
+    PrivacyPolicyConfirmation
+from privacy_policy_tools.states import refresh_policy_states
+
+USER_FIELDS = ('username', 'email')
+BATCH_SIZE = 1000
+
+
+def iter_records(lines, file_format='csv'):
+    """
+    Yields a dict per record of CSV with a header or JSON Lines. An empty
+    dict is yielded for a line which is no JSON object, so it is counted as
+    skipped by import_confirmations.
+
+    Keyword arguments:
+        - lines -- iterable of str
+        - file_format -- csv or jsonl
+    """
+    if file_format == 'csv':
+        yield from csv.DictReader(lines)
+        return
+    for line in lines:
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            record = None
+        yield record if isinstance(record, dict) else {}
+
+
+def _lookup_users(values, user_field):
+    """
+    Returns a dict of user ids keyed by the given field. Values matching
+    more than one user are left out. This needs one query.
+
+    Keyword arguments:
+        - values -- set of values of the field
+        - user_field -- username or email
+    """
+    field = get_user_model().USERNAME_FIELD \
+        if user_field == 'username' else user_field
+    users = {}
+    ambiguous = set()
+    for pk, value in get_user_model().objects.filter(
+            **{field + '__in': values}).values_list('pk', field):
+        if value in users:
+            ambiguous.add(value)
+        users[value] = pk
+    for value in ambiguous:
+        del users[value]
+    return users
+
+
+def _build(records, user_field, known_policies):
+    """
+    Returns the confirmations of a batch of records and the number of
+    records which were skipped because of an unknown user or policy or
+    an invalid date.
+
+    Keyword arguments:
+        - records -- list of dicts
+        - user_field -- username or email
+        - known_policies -- set of existing policy ids, updated in place
+    """
+    policy_ids = set()
+    for record in records:
+        try:
+            policy_ids.add(int(record.get('privacy_policy_id')))
+        except (TypeError, ValueError):
+            pass
+    missing = policy_ids - known_policies
+    if missing:
+        known_policies.update(PrivacyPolicy.objects.filter(
+            pk__in=missing).values_list('pk', flat=True))
+    users = _lookup_users(
+        {record.get(user_field) for record in records}, user_field)
+
+    confirmations = []
+    for record in records:
+        try:
+            user_id = users[record.get(user_field)]
+            policy_id = int(record.get('privacy_policy_id'))
+            second = record.get('second_confirmed_at')
+            confirmation = PrivacyPolicyConfirmation(
+                user_id=user_id,
+                privacy_policy_id=policy_id,
+                confirmed_at=parse_moment(record['confirmed_at']),
+                second_confirmed_at=parse_moment(second) if second else None)
+        except (KeyError, TypeError, ValueError):
+            continue
+        if policy_id in known_policies:
+            confirmations.append(confirmation)
+    return confirmations, len(records) - len(confirmations)
+
+
+def import_confirmations(records, user_field='username',
+                         batch_size=BATCH_SIZE, skip=0, progress=None):
+    """
+    Imports confirmations and returns the number of processed and of
+    skipped records. Confirmations which already exist are kept.
+
+    Every record needs the keys privacy_policy_id, confirmed_at and
+    user_field, second_confirmed_at is optional. The keys match the
+    columns of the export.
+
+    Keyword arguments:
+        - records -- iterable of dicts
+        - user_field -- username or email to find the users
+        - batch_size -- number of records per transaction
+        - skip -- number of records to skip, e.g. to resume an import
+        - progress -- called with the number of processed and skipped
+          records after every committed batch
+    """
+    if user_field not in USER_FIELDS:
+        raise ValueError(user_field)
+    records = islice(records, skip, None)
+    known_policies = set()
+    processed = skip
+    skipped = 0
+    while True:
+        batch = list(islice(records, batch_size))
+        if not batch:
+            break
+        confirmations, invalid = _build(batch, user_field, known_policies)
+        user_ids = {c.user_id for c in confirmations}
+        with transaction.atomic():
+            PrivacyPolicyConfirmation.objects.bulk_create(
+                confirmations, ignore_conflicts=True)
+            refresh_policy_states(user_ids)
+        invalidate_compliance(user_ids)
+        invalidate_hook_results(user_ids)
+        processed += len(batch)
+        skipped += invalid
+        if progress is not None:
+            progress(processed, skipped)
+    return processed, skipped
@@ -0,0 +1,59 @@
+
+# Copyright (c) 2022 Josef Wachtler
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+This module provides a command to compute the changes between the
+consecutive versions of the policies.
+"""
+from django.core.management.base import BaseCommand
+
+from privacy_policy_tools.models import PolicyLineage
+
+
+class Command(BaseCommand):
+    help = 'Computes the changes of each policy to the previous version ' \
+           'of its lineage, e.g. for policies published before the ' \
+           'changes were stored.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size', type=int, default=100,
+            help='Number of lineages per chunk (default: 100).')
+
+    def handle(self, *args, **options):
+        lineages = PolicyLineage.objects.order_by('pk')
+        chunk_size = options['chunk_size']
+        last_id = None
+        count = updated = 0
+        while True:
+            chunk = lineages if last_id is None \
+                else lineages.filter(pk__gt=last_id)
+            lineage_ids = list(chunk.values_list('pk', flat=True)[:chunk_size])
+            if not lineage_ids:
+                break
+            updated += PolicyLineage.update_diffs(lineage_ids)
+            count += len(lineage_ids)
+            last_id = lineage_ids[-1]
+            if options['verbosity'] > 1:
+                self.stdout.write('%d lineages, %d policies updated'
+                                  % (count, updated))
+        self.stdout.write(self.style.SUCCESS(
+            'Updated %d policies of %d lineages.' % (updated, count)))
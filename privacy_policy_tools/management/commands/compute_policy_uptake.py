@@ -0,0 +1,41 @@
+
+# Copyright (c) 2022 Josef Wachtler
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+This module provides a command to compute the PolicyUptake rollup.
+"""
+import time
+
+from django.core.management.base import BaseCommand
+
+from privacy_policy_tools.rollups import compute_policy_uptake
+
+
+class Command(BaseCommand):
+    help = 'Computes the uptake of the active policies for the admin ' \
+           'dashboard. Run it periodically, e.g. from cron.'
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        uptake = compute_policy_uptake()
+        self.stdout.write(self.style.SUCCESS(
+            'Computed %d rows in %.1f s.'
+            % (len(uptake), time.monotonic() - started)))
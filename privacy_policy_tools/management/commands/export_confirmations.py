@@ -0,0 +1,71 @@
+
+# Copyright (c) 2022 Josef Wachtler
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+This module provides a command to export the confirmations for audits.
+"""
+import sys
+
+from django.core.management.base import BaseCommand
+
+from privacy_policy_tools.exports import CHUNK_SIZE, FORMATS, export, \
+    get_confirmations, parse_moment
+
+
+class Command(BaseCommand):
+    help = 'Streams the policy confirmations as CSV or JSON Lines.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=FORMATS, default='csv')
+        parser.add_argument('--output', '-o',
+                            help='File to write, default is stdout.')
+        parser.add_argument('--gzip', action='store_true',
+                            help='Compress the output with gzip.')
+        parser.add_argument('--policy', type=int, action='append',
+                            help='Id of a confirmed policy, repeatable.')
+        parser.add_argument('--group', type=int, action='append',
+                            help='Id of the group of the policies, '
+                                 'repeatable.')
+        parser.add_argument('--since', type=parse_moment,
+                            help='Confirmed at or after this date.')
+        parser.add_argument('--until', type=parse_moment,
+                            help='Confirmed before this date.')
+        parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        confirmations = get_confirmations(
+            policies=options['policy'], groups=options['group'],
+            since=options['since'], until=options['until'])
+        chunks = export(confirmations, options['format'], options['gzip'],
+                        options['chunk_size'])
+        if options['output']:
+            if options['gzip']:
+                output = open(options['output'], 'wb')
+            else:
+                output = open(options['output'], 'w', newline='')
+            with output:
+                output.writelines(chunks)
+        elif options['gzip']:
+            sys.stdout.buffer.writelines(chunks)
+            sys.stdout.buffer.flush()
+        else:
+            for chunk in chunks:
+                self.stdout.write(chunk, ending='')
@@ -0,0 +1,125 @@
+
+# Copyright (c) 2022 Josef Wachtler
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+This module provides a command to import historical confirmations.
+"""
+import gzip
+import io
+import os
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from privacy_policy_tools.exports import FORMATS
+from privacy_policy_tools.imports import BATCH_SIZE, USER_FIELDS, \
+    import_confirmations, iter_records
+
+
+class Command(BaseCommand):
+    help = 'Imports policy confirmations from CSV or JSON Lines.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('input',
+                            help='File to read, - for stdin. Files ending '
+                                 'with .gz are decompressed.')
+        parser.add_argument('--format', choices=FORMATS,
+                            help='Default is jsonl for .jsonl files and '
+                                 'csv otherwise.')
+        parser.add_argument('--user-field', choices=USER_FIELDS,
+                            default='username',
+                            help='Field to find the users by.')
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE,
+                            help='Number of records per transaction.')
+        parser.add_argument('--resume-file',
+                            help='File to store the number of imported '
+                                 'records. An interrupted import continues '
+                                 'after them.')
+
+    def handle(self, *args, **options):
+        path = options['input']
+        name = path[:-3] if path.endswith('.gz') else path
+        file_format = options['format'] or \
+            ('jsonl' if name.endswith(('.jsonl', '.ndjson')) else 'csv')
+        resume_file = options['resume_file']
+        skip = self._read_resume_file(resume_file)
+        if skip:
+            self.stdout.write('Resuming after %d records.' % skip)
+
+        def progress(processed, skipped):
+            if resume_file:
+                self._write_resume_file(resume_file, processed)
+            self.stdout.write('%d records processed, %d skipped'
+                              % (processed, skipped))
+
+        with self._open(path) as lines:
+            processed, skipped = import_confirmations(
+                iter_records(lines, file_format),
+                user_field=options['user_field'],
+                batch_size=options['batch_size'],
+                skip=skip,
+                progress=progress)
+        self.stdout.write(self.style.SUCCESS(
+            'Imported %d records, %d skipped.' % (processed - skip, skipped)))
+
+    def _open(self, path):
+        """
+        Opens the input as text.
+
+        Keyword arguments:
+            - path -- path of the file or -
+        """
+        if path == '-':
+            return io.TextIOWrapper(sys.stdin.buffer, newline='')
+        try:
+            if path.endswith('.gz'):
+                return gzip.open(path, 'rt', newline='')
+            return open(path, newline='')
+        except OSError as e:
+            raise CommandError(e)
+
+    def _read_resume_file(self, path):
+        """
+        Returns the number of records imported before or 0.
+
+        Keyword arguments:
+            - path -- path of the resume file or None
+        """
+        if not path or not os.path.exists(path):
+            return 0
+        with open(path) as f:
+            try:
+                return int(f.read().strip() or 0)
+            except ValueError:
+                raise CommandError('Invalid resume file: %s' % path)
+
+    def _write_resume_file(self, path, processed):
+        """
+        Stores the number of imported records atomically.
+
+        Keyword arguments:
+            - path -- path of the resume file
+            - processed -- number of imported records
+        """
+        tmp = path + '.tmp'
+        with open(tmp, 'w') as f:
+            f.write(str(processed))
+        os.replace(tmp, path)
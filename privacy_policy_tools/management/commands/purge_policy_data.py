@@ -0,0 +1,98 @@
+
+# Copyright (c) 2022 Josef Wachtler
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+This module provides a command to purge expired one time tokens,
+superseded confirmations and unused policy texts.
+"""
+import gzip
+
+from django.core.management.base import BaseCommand, CommandError
+
+from privacy_policy_tools.exports import iter_jsonl, iter_rows
+from privacy_policy_tools.models import PrivacyPolicyConfirmation
+from privacy_policy_tools.retention import BATCH_SIZE, expired_tokens, \
+    purge, superseded_confirmations, unused_texts
+
+
+class Command(BaseCommand):
+    help = 'Deletes expired one time tokens and optionally the ' \
+           'confirmations of superseded policy versions and unused ' \
+           'policy texts.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--superseded', action='store_true',
+                            help='Also delete the confirmations of inactive '
+                                 'policies whose users confirmed a newer '
+                                 'version.')
+        parser.add_argument('--unused-texts', action='store_true',
+                            help='Also delete the policy texts which are '
+                                 'not referenced by any policy.')
+        parser.add_argument('--archive',
+                            help='gzip JSON Lines file to append the '
+                                 'deleted confirmations to.')
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+        parser.add_argument('--pause', type=float, default=0,
+                            help='Seconds to sleep between the batches.')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Only report the number of rows.')
+
+    def handle(self, *args, **options):
+        if options['archive'] and not options['superseded']:
+            raise CommandError('--archive requires --superseded.')
+        targets = [('expired tokens', expired_tokens())]
+        if options['superseded']:
+            targets.append(('superseded confirmations',
+                            superseded_confirmations()))
+        if options['unused_texts']:
+            targets.append(('unused texts', unused_texts()))
+
+        if options['dry_run']:
+            for name, queryset in targets:
+                self.stdout.write('%d %s' % (queryset.count(), name))
+            return
+
+        archive = None
+        if options['archive']:
+            archive = gzip.open(options['archive'], 'at')
+        try:
+            for name, queryset in targets:
+                before_delete = None
+                if archive is not None and \
+                        queryset.model is PrivacyPolicyConfirmation:
+                    def before_delete(ids):
+                        archive.writelines(iter_jsonl(iter_rows(
+                            PrivacyPolicyConfirmation.objects.filter(
+                                pk__in=ids))))
+                deleted = purge(
+                    queryset, options['batch_size'], before_delete,
+                    options['pause'],
+                    lambda count, name=name: self._progress(name, count,
+                                                            options))
+                self.stdout.write(self.style.SUCCESS(
+                    'Deleted %d %s.' % (deleted, name)))
+        finally:
+            if archive is not None:
+                archive.close()
+
+    def _progress(self, name, count, options):
+        if options['verbosity'] > 1:
+            self.stdout.write('%d %s deleted' % (count, name))
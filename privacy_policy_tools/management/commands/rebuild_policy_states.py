@@ -0,0 +1,47 @@
+
+# Copyright (c) 2022 Josef Wachtler
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+This module provides a command to rebuild the UserPolicyState table.
+"""
+from django.core.management.base import BaseCommand
+
+from privacy_policy_tools.states import iter_user_ids, \
+    refresh_policy_states
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the policy states of all users from the confirmations.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size', type=int, default=1000,
+            help='Number of users per transaction (default: 1000).')
+
+    def handle(self, *args, **options):
+        users = states = 0
+        for user_ids in iter_user_ids(options['chunk_size']):
+            states += refresh_policy_states(user_ids)
+            users += len(user_ids)
+            if options['verbosity'] > 1:
+                self.stdout.write('%d users, %d states' % (users, states))
+        self.stdout.write(self.style.SUCCESS(
+            'Rebuilt %d states of %d users.' % (states, users)))
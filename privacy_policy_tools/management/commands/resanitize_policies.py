@@ -0,0 +1,171 @@
+
+# Copyright (c) 2022 Josef Wachtler
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+This module provides a command to sanitize the texts of all policies
+again, e.g. after the allowlists were tightened.
+"""
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from privacy_policy_tools.models import PolicyLineage, PolicyText, \
+    PrivacyPolicy
+from privacy_policy_tools.registry import policies_changed
+from privacy_policy_tools.sanitizer import get_allowlists, sanitize_rows
+
+
+def iter_chunks(chunk_size):
+    """
+    Yields lists of (hash, text) tuples of all policy texts using keyset
+    pagination. Policies with the same text share one tuple.
+
+    Keyword arguments:
+        - chunk_size -- maximum number of texts per list
+    """
+    texts = PolicyText.objects.order_by('pk').only('text', 'compressed')
+    last_hash = None
+    while True:
+        chunk = texts if last_hash is None \
+            else texts.filter(pk__gt=last_hash)
+        rows = [(content.pk, content.get_text())
+                for content in chunk[:chunk_size]]
+        if not rows:
+            return
+        yield rows
+        last_hash = rows[-1][0]
+
+
+class Command(BaseCommand):
+    help = 'Sanitizes the texts of all policies with the current ' \
+           'allowlists in a process pool, stores the changed texts and ' \
+           'points the policies to them.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size', type=int, default=100,
+            help='Number of texts per worker task (default: 100).')
+        parser.add_argument(
+            '--workers', type=int, default=os.cpu_count() or 1,
+            help='Number of worker processes, 1 sanitizes in this '
+                 'process (default: number of CPUs).')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Only report the number of changed texts.')
+
+    def handle(self, *args, **options):
+        self.timings = {'read': 0.0, 'sanitize': 0.0, 'write': 0.0}
+        self.total = self.changed = self.policies = 0
+        self.dry_run = options['dry_run']
+        self.verbosity = options['verbosity']
+        allowlists = get_allowlists()
+        started = time.monotonic()
+
+        if options['workers'] > 1:
+            self._run_pool(allowlists, options)
+        else:
+            for rows in self._read(options['chunk_size']):
+                sanitize_started = time.monotonic()
+                changed = sanitize_rows(allowlists, rows)
+                self.timings['sanitize'] += \
+                    time.monotonic() - sanitize_started
+                self._write(changed)
+
+        if self.changed and not self.dry_run:
+            policies_changed()
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            '%s %d of %d texts (%d policies) in %.2fs (read %.2fs, '
+            'sanitize %.2fs, write %.2fs).' % (
+                'Would change' if self.dry_run else 'Changed',
+                self.changed, self.total, self.policies, elapsed,
+                self.timings['read'], self.timings['sanitize'],
+                self.timings['write'])))
+
+    def _run_pool(self, allowlists, options):
+        """
+        Sanitizes the chunks in worker processes. At most two chunks per
+        worker are in flight, so the memory usage stays bounded. The
+        sanitize timing is the time spent waiting for the workers.
+        """
+        workers = options['workers']
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            pending = deque()
+            for rows in self._read(options['chunk_size']):
+                pending.append(executor.submit(sanitize_rows, allowlists,
+                                               rows))
+                if len(pending) >= workers * 2:
+                    self._collect(pending.popleft())
+            while pending:
+                self._collect(pending.popleft())
+
+    def _read(self, chunk_size):
+        chunks = iter_chunks(chunk_size)
+        while True:
+            read_started = time.monotonic()
+            rows = next(chunks, None)
+            self.timings['read'] += time.monotonic() - read_started
+            if rows is None:
+                return
+            self.total += len(rows)
+            yield rows
+
+    def _collect(self, future):
+        wait_started = time.monotonic()
+        changed = future.result()
+        self.timings['sanitize'] += time.monotonic() - wait_started
+        self._write(changed)
+
+    def _write(self, changed):
+        """
+        Stores the sanitized texts and points the policies of the replaced
+        texts to them with bulk_update. The replaced texts are deleted
+        unless another policy still references them. The changes between
+        the versions of the affected lineages are computed again.
+        """
+        self.changed += len(changed)
+        if changed:
+            write_started = time.monotonic()
+            replaced = {old: rendered.hash for old, text, rendered in changed}
+            policies = list(PrivacyPolicy.objects.filter(
+                content__in=replaced).only('pk', 'content', 'lineage'))
+            self.policies += len(policies)
+            if not self.dry_run:
+                for policy in policies:
+                    policy.content_id = replaced[policy.content_id]
+                with transaction.atomic():
+                    PolicyText.objects.bulk_create(
+                        [PolicyText.build(text, rendered)
+                         for old, text, rendered in changed],
+                        ignore_conflicts=True)
+                    PrivacyPolicy.objects.bulk_update(policies, ['content'])
+                    PolicyText.objects.filter(
+                        pk__in=replaced, policies=None).delete()
+                    PolicyLineage.update_diffs(
+                        {policy.lineage_id for policy in policies
+                         if policy.lineage_id is not None})
+            self.timings['write'] += time.monotonic() - write_started
+        if self.verbosity > 1:
+            self.stdout.write('%d texts, %d changed'
+                              % (self.total, self.changed))
@@ -22,102 +22,291 @@
 """
 This module provides some middleware for the package privacy_policy_tools.
 """
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, \
+    sync_to_async
 from django.http import HttpResponseRedirect
 from django.urls import reverse
 from django.conf import settings
-from privacy_policy_tools.utils import get_setting, get_active_policies, get_by_py_path
-from privacy_policy_tools.models import PrivacyPolicyConfirmation
+from privacy_policy_tools.conf import get_app_settings
+from privacy_policy_tools.utils import get_hook, \
+    get_confirmations, get_group_ids, policy_applies, aget_confirmations, \
+    aget_group_ids
+from privacy_policy_tools.registry import registry
+from privacy_policy_tools.exemptions import get_matcher
+from privacy_policy_tools.cache import compliance_enabled, get_compliance, \
+    set_compliant, aget_compliance, aset_compliant, memoize_hook, \
+    amemoize_hook
 
 class PrivacyPolicyMiddleware:
     """
     This middleware class forces the user to confirm the privacy policies.
+
+    It runs natively in sync and async stacks. In an async stack the
+    methods prefixed with a are used.
     """
+    sync_capable = True
+    async_capable = True
 
     def __init__(self, get_response):
         """
-        Constructor: sets get_response
+        Constructor: sets get_response and switches to the async methods
+        if get_response is async
         """
         self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+            self.process_view = self.aprocess_view
 
     def __call__(self, request):
         """
         Processes the request and redirects to the privacy policy if
         the user has not confirmed the latest version yet.
 
+        If ENFORCE_BEFORE_VIEW is set the check is done in process_view
+        instead, so the view of a blocked request is never executed.
+
         Keyword arguments:
             - request -- calling HttpRequest
         """
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
         response = self.get_response(request)
-        enabled = get_setting('ENABLED')
-        if not enabled:
+        if self._checked_before_view(request):
             return response
+        redirect = self._check(request)
+        if redirect:
+            return redirect
+        return response
 
-        url = get_setting('POLICY_PAGE_URL', 'terms/and/conditions')
-        ignore_urls = get_setting('IGNORE_URLS', [])
-
-        if not request.user.is_authenticated or \
-        url in request.path_info or \
-        any(ignore in request.path_info for ignore in ignore_urls):
+    async def __acall__(self, request):
+        """
+        Async version of __call__.
+        """
+        response = await self.get_response(request)
+        if self._checked_before_view(request):
             return response
+        redirect = await self._acheck(request)
+        if redirect:
+            return redirect
+        return response
+
+    def _checked_before_view(self, request):
+        """
+        Returns True if the request must not be checked after the response
+        was created.
+
+        Keyword arguments:
+            - request -- calling HttpRequest
+        """
+        return get_app_settings().enforce_before_view or \
+            getattr(request, '_privacy_policy_exempt', False)
+
+    def _check_in_view(self, request, view_func):
+        """
+        Returns True if the request has to be checked in process_view and
+        marks requests to exempt views.
+
+        Keyword arguments:
+            - request -- calling HttpRequest
+            - view_func -- view to call
+        """
+        if getattr(view_func, 'privacy_policy_exempt', False):
+            request._privacy_policy_exempt = True
+            return False
+        return get_app_settings().enforce_before_view
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        """
+        Checks the policies before the view is called if
+        ENFORCE_BEFORE_VIEW is set. Views marked with the decorator
+        privacy_policy_exempt are never checked.
+
+        Keyword arguments:
+            - request -- calling HttpRequest
+            - view_func -- view to call
+            - view_args -- positional arguments of the view
+            - view_kwargs -- keyword arguments of the view
+        """
+        if self._check_in_view(request, view_func):
+            return self._check(request)
+        return None
 
-        start_hook = get_setting('START_HOOK')
+    async def aprocess_view(self, request, view_func, view_args,
+                            view_kwargs):
+        """
+        Async version of process_view.
+        """
+        if self._check_in_view(request, view_func):
+            return await self._acheck(request)
+        return None
+
+    def _check(self, request):
+        """
+        Returns a redirect to the page the user has to visit next or None
+        if the user may access the requested page.
+
+        Keyword arguments:
+            - request -- calling HttpRequest
+        """
+        if not get_app_settings().enabled:
+            return None
+
+        if get_matcher().matches(request) or \
+                not request.user.is_authenticated:
+            return None
+
+        start_hook = get_hook('START_HOOK')
         if start_hook:
-            start_hook = get_by_py_path(start_hook)
-            if start_hook(request) is False:
-                return response
+            if memoize_hook('START_HOOK', request.user.pk, None,
+                            lambda: start_hook(request)) is False:
+                return None
 
-        policies = get_active_policies()
-        if not policies:
-            return response
+        use_cache = compliance_enabled()
+        if use_cache:
+            generation, compliant = get_compliance(request.user)
+            if compliant:
+                return None
+            started = time.monotonic()
 
+        policies = registry.applicable(get_group_ids(request.user))
+        confirmations = get_confirmations(request.user, policies)
         for policy in policies:
-            if self._policy_applies_to_user(request.user, policy):
-                # Check for confirmation with matching version
-                confirmation = PrivacyPolicyConfirmation.objects.filter(
-                    privacy_policy__id=policy.id,
-                    privacy_policy__version=policy.version,  # Added version check
-                    user=request.user
-                ).first()
-
-                if not confirmation:
-                    next_view = self._generate_next(request)
-                    return HttpResponseRedirect(reverse(
-                        'privacy_policy_tools.views.confirm',
-                        args=(policy.id, next_view,)
-                    ))
-                else:
-                    second_confirmation = self._second_confirmation(request, confirmation)
-                    if second_confirmation:
-                        return second_confirmation
+            confirmation = confirmations.get(policy.id)
+            if not confirmation:
+                next_view = self._generate_next(request)
+                return HttpResponseRedirect(reverse(
+                    'privacy_policy_tools.views.confirm',
+                    args=(policy.id, next_view,)
+                ))
+            second_confirmation = self._second_confirmation(request, confirmation)
+            if second_confirmation:
+                return second_confirmation
 
-        return response
+        if use_cache:
+            set_compliant(request.user, generation,
+                          time.monotonic() - started)
+        return None
+
+    async def _acheck(self, request):
+        """
+        Async version of _check. It uses the async ORM and cache methods
+        and calls sync hooks in a thread.
+        """
+        if not get_app_settings().enabled:
+            return None
+
+        if get_matcher().matches(request):
+            return None
+        user = await self._aget_user(request)
+        if not user.is_authenticated:
+            return None
+
+        start_hook = get_hook('START_HOOK')
+        if start_hook:
+            if await amemoize_hook(
+                    'START_HOOK', user.pk, None,
+                    lambda: self._acall_hook(start_hook, request)) is False:
+                return None
+
+        use_cache = compliance_enabled()
+        if use_cache:
+            generation, compliant = await aget_compliance(user)
+            if compliant:
+                return None
+            started = time.monotonic()
+
+        policies = await registry.aapplicable(await aget_group_ids(user))
+        confirmations = await aget_confirmations(user, policies)
+        for policy in policies:
+            confirmation = confirmations.get(policy.id)
+            if not confirmation:
+                next_view = self._generate_next(request)
+                return HttpResponseRedirect(reverse(
+                    'privacy_policy_tools.views.confirm',
+                    args=(policy.id, next_view,)
+                ))
+            second_confirmation = await self._asecond_confirmation(
+                request, confirmation)
+            if second_confirmation:
+                return second_confirmation
+
+        if use_cache:
+            await aset_compliant(user, generation,
+                                 time.monotonic() - started)
+        return None
+
+    async def _aget_user(self, request):
+        """
+        Returns the user of the request without blocking the event loop.
+
+        Keyword arguments:
+            - request -- calling HttpRequest
+        """
+        auser = getattr(request, 'auser', None)
+        if auser is not None:
+            return await auser()
+        return await sync_to_async(_load_user)(request)
+
+    async def _acall_hook(self, hook, *args):
+        """
+        Calls a hook. Sync hooks are called in a thread.
+
+        Keyword arguments:
+            - hook -- the hook to call
+            - args -- arguments of the hook
+        """
+        if iscoroutinefunction(hook):
+            return await hook(*args)
+        return await sync_to_async(hook)(*args)
 
     def _policy_applies_to_user(self, user, policy):
         """
         Determines if a policy applies to a user based on group membership.
         """
-        default_policy = get_setting('DEFAULT_POLICY', True)
-        if default_policy:
-            return policy.for_group is None or policy.for_group in user.groups.all()
-        else:
-            return (policy.for_group is None and not user.groups.exists()) or \
-                   policy.for_group in user.groups.all()
+        return policy_applies(policy, get_group_ids(user))
 
     def _second_confirmation(self, request, confirmation):
         """
         Checks if a second confirmation is required and returns a redirect if so.
+        The hook is not called if the second confirmation is already done.
         """
-        required_hook = get_setting('SECOND_CONFIRMATION_REQUIRED_HOOK')
+        if confirmation.second_confirmed_at is not None:
+            return None
+
+        required_hook = get_hook('SECOND_CONFIRMATION_REQUIRED_HOOK')
         if not required_hook:
             return None
 
-        required_hook = get_by_py_path(required_hook)
-        if required_hook(request, confirmation) is False:
+        if memoize_hook('SECOND_CONFIRMATION_REQUIRED_HOOK',
+                        confirmation.user_id, confirmation.id,
+                        lambda: required_hook(request, confirmation)) is False:
             return None
 
+        return HttpResponseRedirect(reverse(
+            'privacy_policy_tools.views.second_confirm_required',
+            args=(confirmation.id,)
+        ))
+
+    async def _asecond_confirmation(self, request, confirmation):
+        """
+        Async version of _second_confirmation.
+        """
         if confirmation.second_confirmed_at is not None:
             return None
 
+        required_hook = get_hook('SECOND_CONFIRMATION_REQUIRED_HOOK')
+        if not required_hook:
+            return None
+
+        if await amemoize_hook(
+                'SECOND_CONFIRMATION_REQUIRED_HOOK', confirmation.user_id,
+                confirmation.id,
+                lambda: self._acall_hook(
+                    required_hook, request, confirmation)) is False:
+            return None
+
         return HttpResponseRedirect(reverse(
             'privacy_policy_tools.views.second_confirm_required',
             args=(confirmation.id,)
@@ -128,3 +317,15 @@ class PrivacyPolicyMiddleware:
         Generates the 'next' URL for redirecting after policy confirmation.
         """
         return request.path_info
+
+
+def _load_user(request):
+    """
+    Evaluates the lazy user of a request and returns it.
+
+    Keyword arguments:
+        - request -- calling HttpRequest
+    """
+    user = request.user
+    user.is_authenticated
+    return user
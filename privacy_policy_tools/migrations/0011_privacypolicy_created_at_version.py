@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:40
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('privacy_policy_tools', '0010_alter_privacypolicy_text_alter_privacypolicy_text_de_and_more'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='privacypolicy',
+            options={'ordering': ['-published_at', '-version'], 'verbose_name': 'Privacy Policy', 'verbose_name_plural': 'Privacy Policies'},
+        ),
+        migrations.AddField(
+            model_name='privacypolicy',
+            name='created_at',
+            field=models.DateTimeField(auto_now_add=True, default=django.utils.timezone.now, verbose_name='Created at'),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='privacypolicy',
+            name='version',
+            field=models.PositiveIntegerField(default=1, verbose_name='Version'),
+        ),
+    ]
@@ -0,0 +1,79 @@
+"""
+Collapse duplicate confirmations before the unique constraint is added.
+
+Users are processed in keyset-paginated batches, each in its own
+transaction, so the migration can be interrupted and re-run safely on
+large tables.  For every (user, privacy policy) pair the earliest
+confirmation is kept, a second confirmation on any duplicate is merged
+into it and one time tokens are re-pointed before the duplicates are
+deleted.  Duplicate token values are reduced to the newest token.
+"""
+from django.db import migrations, transaction
+from django.db.models import Count, Max
+
+BATCH_SIZE = 1000
+
+
+def _merge(Confirmation, OneTimeToken, user_ids):
+    duplicates = Confirmation.objects.filter(user_id__in=user_ids) \
+        .values('user_id', 'privacy_policy_id') \
+        .annotate(count=Count('id')).filter(count__gt=1)
+    for duplicate in duplicates:
+        rows = list(Confirmation.objects.filter(
+            user_id=duplicate['user_id'],
+            privacy_policy_id=duplicate['privacy_policy_id'],
+        ).order_by('confirmed_at', 'id'))
+        keep, others = rows[0], rows[1:]
+        second_confirmed = [row.second_confirmed_at for row in rows
+                            if row.second_confirmed_at]
+        if second_confirmed and keep.second_confirmed_at is None:
+            keep.second_confirmed_at = min(second_confirmed)
+            keep.save(update_fields=['second_confirmed_at'])
+        other_ids = [row.id for row in others]
+        OneTimeToken.objects.filter(confirmation_id__in=other_ids) \
+            .update(confirmation=keep)
+        Confirmation.objects.filter(id__in=other_ids).delete()
+
+
+def deduplicate_confirmations(apps, schema_editor):
+    Confirmation = apps.get_model('privacy_policy_tools',
+                                  'PrivacyPolicyConfirmation')
+    OneTimeToken = apps.get_model('privacy_policy_tools', 'OneTimeToken')
+    last_user_id = None
+    while True:
+        users = Confirmation.objects.order_by('user_id') \
+            .values_list('user_id', flat=True).distinct()
+        if last_user_id is not None:
+            users = users.filter(user_id__gt=last_user_id)
+        user_ids = list(users[:BATCH_SIZE])
+        if not user_ids:
+            break
+        with transaction.atomic():
+            _merge(Confirmation, OneTimeToken, user_ids)
+        last_user_id = user_ids[-1]
+
+
+def deduplicate_tokens(apps, schema_editor):
+    OneTimeToken = apps.get_model('privacy_policy_tools', 'OneTimeToken')
+    duplicates = OneTimeToken.objects.values('token') \
+        .annotate(count=Count('id'), newest=Max('id')) \
+        .filter(count__gt=1)
+    for duplicate in duplicates.iterator():
+        with transaction.atomic():
+            OneTimeToken.objects.filter(token=duplicate['token']) \
+                .exclude(id=duplicate['newest']).delete()
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('privacy_policy_tools', '0011_privacypolicy_created_at_version'),
+    ]
+
+    operations = [
+        migrations.RunPython(deduplicate_confirmations,
+                             migrations.RunPython.noop),
+        migrations.RunPython(deduplicate_tokens,
+                             migrations.RunPython.noop),
+    ]
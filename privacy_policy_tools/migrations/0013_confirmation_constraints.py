@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:52
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('privacy_policy_tools', '0012_deduplicate_confirmations'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='onetimetoken',
+            name='token',
+            field=models.CharField(max_length=32, unique=True, verbose_name='Token'),
+        ),
+        migrations.AddIndex(
+            model_name='privacypolicy',
+            index=models.Index(fields=['active', 'for_group', 'published_at'], name='ppt_policy_active_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='privacypolicyconfirmation',
+            index=models.Index(fields=['privacy_policy', 'confirmed_at'], name='ppt_confirmation_policy_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='privacypolicyconfirmation',
+            constraint=models.UniqueConstraint(fields=('user', 'privacy_policy'), name='ppt_confirmation_unique'),
+        ),
+    ]
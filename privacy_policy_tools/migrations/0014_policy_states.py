@@ -0,0 +1,77 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:58
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def assign_lineages(apps, schema_editor):
+    PrivacyPolicy = apps.get_model('privacy_policy_tools', 'PrivacyPolicy')
+    PolicyLineage = apps.get_model('privacy_policy_tools', 'PolicyLineage')
+    for policy in PrivacyPolicy.objects.filter(lineage=None):
+        policy.lineage, _created = PolicyLineage.objects.get_or_create(
+            title=policy.title, for_group_id=policy.for_group_id)
+        policy.save(update_fields=['lineage'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('privacy_policy_tools', '0013_confirmation_constraints'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PolicyLineage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('title', models.CharField(max_length=128, verbose_name='Title')),
+                ('for_group', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='auth.group', verbose_name='For group')),
+            ],
+            options={
+                'verbose_name': 'Policy Lineage',
+                'verbose_name_plural': 'Policy Lineages',
+            },
+        ),
+        migrations.AddField(
+            model_name='privacypolicy',
+            name='lineage',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, to='privacy_policy_tools.policylineage', verbose_name='Lineage'),
+        ),
+        migrations.CreateModel(
+            name='UserPolicyState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('version', models.PositiveIntegerField(verbose_name='Version')),
+                ('confirmed_at', models.DateTimeField(verbose_name='Confirmed at')),
+                ('second_confirmed_at', models.DateTimeField(blank=True, null=True, verbose_name='Second confirmed at')),
+                ('confirmation', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='privacy_policy_tools.privacypolicyconfirmation', verbose_name='Confirmation')),
+                ('lineage', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='privacy_policy_tools.policylineage', verbose_name='Lineage')),
+                ('privacy_policy', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='privacy_policy_tools.privacypolicy', verbose_name='Privacy Policy')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL, verbose_name='User')),
+            ],
+            options={
+                'verbose_name': 'User Policy State',
+                'verbose_name_plural': 'User Policy States',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='policylineage',
+            constraint=models.UniqueConstraint(fields=('title', 'for_group'), name='ppt_lineage_unique'),
+        ),
+        migrations.AddConstraint(
+            model_name='policylineage',
+            constraint=models.UniqueConstraint(condition=models.Q(('for_group', None)), fields=('title',), name='ppt_lineage_unique_no_group'),
+        ),
+        migrations.AddIndex(
+            model_name='userpolicystate',
+            index=models.Index(fields=['lineage', 'version'], name='ppt_state_lineage_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='userpolicystate',
+            constraint=models.UniqueConstraint(fields=('user', 'lineage'), name='ppt_state_unique'),
+        ),
+        migrations.RunPython(assign_lineages, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:59
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def update_current_versions(apps, schema_editor):
+    PrivacyPolicy = apps.get_model('privacy_policy_tools', 'PrivacyPolicy')
+    PolicyLineage = apps.get_model('privacy_policy_tools', 'PolicyLineage')
+    current = PrivacyPolicy.objects.filter(
+        lineage=models.OuterRef('pk'), active=True,
+    ).order_by('-version', '-published_at').values('pk')[:1]
+    PolicyLineage.objects.update(current_version=models.Subquery(current))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('privacy_policy_tools', '0014_policy_states'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='policylineage',
+            name='current_version',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='privacy_policy_tools.privacypolicy', verbose_name='Current version'),
+        ),
+        migrations.RunPython(update_current_versions,
+                             migrations.RunPython.noop),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:08
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('privacy_policy_tools', '0015_lineage_current_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PolicyUptake',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('applicable', models.PositiveIntegerField(verbose_name='Applicable')),
+                ('confirmed', models.PositiveIntegerField(verbose_name='Confirmed')),
+                ('pending', models.PositiveIntegerField(verbose_name='Pending')),
+                ('second_pending', models.PositiveIntegerField(verbose_name='Second confirmation pending')),
+                ('computed_at', models.DateTimeField(verbose_name='Computed at')),
+                ('group', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='auth.group', verbose_name='Group')),
+                ('privacy_policy', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='privacy_policy_tools.privacypolicy', verbose_name='Privacy Policy')),
+            ],
+            options={
+                'verbose_name': 'Policy Uptake',
+                'verbose_name_plural': 'Policy Uptake',
+                'ordering': ['privacy_policy', 'group'],
+            },
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:10
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('privacy_policy_tools', '0016_policyuptake'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='onetimetoken',
+            name='created_at',
+            field=models.DateTimeField(db_index=True, default=django.utils.timezone.now, verbose_name='Created at'),
+        ),
+    ]
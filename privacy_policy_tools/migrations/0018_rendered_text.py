@@ -0,0 +1,174 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:15
+
+import hashlib
+from collections import namedtuple
+from html import escape
+from html.parser import HTMLParser
+
+from django.db import migrations, models
+from django.utils.text import slugify
+
+# Frozen copy of privacy_policy_tools.rendering, so later changes of the
+# renderer do not change what this migration stores.
+
+HEADINGS = ('h1', 'h2', 'h3', 'h4', 'h5', 'h6')
+BLOCKS = HEADINGS + ('p', 'div', 'li', 'tr', 'table', 'ul', 'ol')
+LINES = ('li', 'tr')
+CELLS = ('td', 'th')
+VOID = ('br', 'hr', 'img')
+
+RenderedText = namedtuple('RenderedText', ['html', 'plain', 'toc', 'hash'])
+
+
+class _Renderer(HTMLParser):
+    """
+    Writes the parsed HTML again and collects the plain text and the
+    headings. The content of a heading is buffered until its end tag, so
+    the anchor can be derived from its text.
+    """
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.html = []
+        self.plain = []
+        self.toc = []
+        self.anchors = set()
+        self.heading = None
+
+    def _out(self):
+        return self.heading[2] if self.heading else self.html
+
+    def _tag(self, tag, attrs, close=''):
+        attrs = ''.join(' %s="%s"' % (name, escape(value or ''))
+                        for name, value in attrs)
+        return '<%s%s%s>' % (tag, attrs, close)
+
+    def _anchor(self, title):
+        base = slugify(title) or 'section'
+        anchor, number = base, 1
+        while anchor in self.anchors:
+            number += 1
+            anchor = '%s-%d' % (base, number)
+        self.anchors.add(anchor)
+        return anchor
+
+    def handle_starttag(self, tag, attrs):
+        if tag in BLOCKS:
+            self.plain.append('\n')
+        elif tag in CELLS:
+            self.plain.append(' ')
+        if tag in HEADINGS and self.heading is None:
+            attrs = [(n, v) for n, v in attrs if n != 'id']
+            self.heading = (tag, attrs, [], [])
+            return
+        self._out().append(self._tag(tag, attrs))
+        if tag == 'br':
+            self.plain.append('\n')
+
+    def handle_startendtag(self, tag, attrs):
+        self._out().append(self._tag(tag, attrs, ' /'))
+        if tag == 'br':
+            self.plain.append('\n')
+
+    def handle_endtag(self, tag):
+        if self.heading is not None and tag == self.heading[0]:
+            tag, attrs, content, text = self.heading
+            self.heading = None
+            title = ' '.join(''.join(text).split())
+            anchor = self._anchor(title)
+            self.toc.append({'level': int(tag[1]), 'id': anchor,
+                             'title': title})
+            self.html.append(self._tag(tag, [('id', anchor)] + attrs))
+            self.html.extend(content)
+            self.html.append('</%s>' % tag)
+            self.plain.append('\n')
+            return
+        if tag not in VOID:
+            self._out().append('</%s>' % tag)
+        if tag in BLOCKS and tag not in LINES:
+            self.plain.append('\n')
+
+    def handle_data(self, data):
+        self._out().append(escape(data, quote=False))
+        if self.heading is not None:
+            self.heading[3].append(data)
+        self.plain.append(data)
+
+
+def _plain_text(parts):
+    """
+    Joins the text parts and normalizes the white space: one space
+    within lines and at most one empty line between blocks.
+    """
+    lines = [' '.join(line.split()) for line in ''.join(parts).split('\n')]
+    text = []
+    for line in lines:
+        if line or (text and text[-1]):
+            text.append(line)
+    return '\n'.join(text).strip()
+
+
+def render_text(text):
+    """
+    Returns the RenderedText of a sanitized policy text.
+
+    Keyword arguments:
+        - text -- sanitized HTML
+    """
+    renderer = _Renderer()
+    renderer.feed(text or '')
+    renderer.close()
+    return RenderedText(
+        html=''.join(renderer.html),
+        plain=_plain_text(renderer.plain),
+        toc=renderer.toc,
+        hash=hashlib.sha256((text or '').encode()).hexdigest())
+
+
+def render_texts(apps, schema_editor):
+    PrivacyPolicy = apps.get_model('privacy_policy_tools', 'PrivacyPolicy')
+    policies = []
+    for policy in PrivacyPolicy.objects.only('text').iterator(chunk_size=100):
+        rendered = render_text(policy.text)
+        policy.text_html = rendered.html
+        policy.text_plain = rendered.plain
+        policy.toc = rendered.toc
+        policy.text_hash = rendered.hash
+        policies.append(policy)
+        if len(policies) >= 100:
+            PrivacyPolicy.objects.bulk_update(
+                policies, ['text_html', 'text_plain', 'toc', 'text_hash'])
+            policies = []
+    PrivacyPolicy.objects.bulk_update(
+        policies, ['text_html', 'text_plain', 'toc', 'text_hash'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('privacy_policy_tools', '0017_onetimetoken_created_at_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='privacypolicy',
+            name='text_hash',
+            field=models.CharField(blank=True, editable=False, max_length=64, verbose_name='Text hash'),
+        ),
+        migrations.AddField(
+            model_name='privacypolicy',
+            name='text_html',
+            field=models.TextField(blank=True, editable=False, verbose_name='Rendered text'),
+        ),
+        migrations.AddField(
+            model_name='privacypolicy',
+            name='text_plain',
+            field=models.TextField(blank=True, editable=False, verbose_name='Plain text'),
+        ),
+        migrations.AddField(
+            model_name='privacypolicy',
+            name='toc',
+            field=models.JSONField(blank=True, default=list, editable=False, verbose_name='Table of contents'),
+        ),
+        migrations.RunPython(render_texts, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:20
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('privacy_policy_tools', '0018_rendered_text'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='privacypolicy',
+            name='diff_html',
+            field=models.TextField(blank=True, editable=False, verbose_name='Changes to the previous version'),
+        ),
+        migrations.AddField(
+            model_name='privacypolicy',
+            name='previous_version',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='privacy_policy_tools.privacypolicy', verbose_name='Previous version'),
+        ),
+    ]
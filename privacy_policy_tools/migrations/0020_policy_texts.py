@@ -0,0 +1,132 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:40
+
+import hashlib
+import zlib
+
+import django.db.models.deletion
+import django.utils.timezone
+import tinymce.models
+from django.db import migrations, models
+
+BATCH_SIZE = 100
+
+
+def store_texts(apps, schema_editor):
+    PrivacyPolicy = apps.get_model('privacy_policy_tools', 'PrivacyPolicy')
+    PolicyText = apps.get_model('privacy_policy_tools', 'PolicyText')
+    policies = []
+    texts = {}
+
+    def flush():
+        PolicyText.objects.bulk_create(texts.values(), ignore_conflicts=True)
+        PrivacyPolicy.objects.bulk_update(policies, ['content'])
+        policies.clear()
+        texts.clear()
+
+    # the rendered columns were filled by 0018 and at every save since
+    for policy in PrivacyPolicy.objects.only(
+            'text', 'text_html', 'text_plain', 'toc', 'text_hash') \
+            .iterator(chunk_size=BATCH_SIZE):
+        text = policy.text or ''
+        text_hash = policy.text_hash or \
+            hashlib.sha256(text.encode()).hexdigest()
+        texts[text_hash] = PolicyText(
+            hash=text_hash, text=text.encode('utf-8'),
+            html=policy.text_html.encode('utf-8'),
+            plain=policy.text_plain.encode('utf-8'), toc=policy.toc)
+        policy.content_id = text_hash
+        policies.append(policy)
+        if len(policies) >= BATCH_SIZE:
+            flush()
+    flush()
+
+
+def restore_texts(apps, schema_editor):
+    PrivacyPolicy = apps.get_model('privacy_policy_tools', 'PrivacyPolicy')
+
+    def decode(content, value):
+        value = bytes(value)
+        if content.compressed:
+            value = zlib.decompress(value)
+        return value.decode('utf-8')
+
+    policies = []
+    for policy in PrivacyPolicy.objects.select_related('content') \
+            .iterator(chunk_size=BATCH_SIZE):
+        content = policy.content
+        policy.text = decode(content, content.text)
+        policy.text_html = decode(content, content.html)
+        policy.text_plain = decode(content, content.plain)
+        policy.toc = content.toc
+        policy.text_hash = content.hash
+        policies.append(policy)
+        if len(policies) >= BATCH_SIZE:
+            PrivacyPolicy.objects.bulk_update(
+                policies,
+                ['text', 'text_html', 'text_plain', 'toc', 'text_hash'])
+            policies = []
+    PrivacyPolicy.objects.bulk_update(
+        policies, ['text', 'text_html', 'text_plain', 'toc', 'text_hash'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('privacy_policy_tools', '0019_policy_diffs'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PolicyText',
+            fields=[
+                ('hash', models.CharField(max_length=64, primary_key=True, serialize=False, verbose_name='Hash')),
+                ('compressed', models.BooleanField(default=False, verbose_name='Compressed')),
+                ('text', models.BinaryField(verbose_name='Text')),
+                ('html', models.BinaryField(verbose_name='Rendered text')),
+                ('plain', models.BinaryField(verbose_name='Plain text')),
+                ('toc', models.JSONField(blank=True, default=list, verbose_name='Table of contents')),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Created at')),
+            ],
+            options={
+                'verbose_name': 'Policy Text',
+                'verbose_name_plural': 'Policy Texts',
+            },
+        ),
+        migrations.AddField(
+            model_name='privacypolicy',
+            name='content',
+            field=models.ForeignKey(editable=False, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='policies', to='privacy_policy_tools.policytext', verbose_name='Text'),
+        ),
+        migrations.RunPython(store_texts, restore_texts),
+        migrations.AlterField(
+            model_name='privacypolicy',
+            name='content',
+            field=models.ForeignKey(editable=False, on_delete=django.db.models.deletion.PROTECT, related_name='policies', to='privacy_policy_tools.policytext', verbose_name='Text'),
+        ),
+        # lets the column be added again with the empty text on reversal
+        migrations.AlterField(
+            model_name='privacypolicy',
+            name='text',
+            field=tinymce.models.HTMLField(default='', verbose_name='Text'),
+        ),
+        migrations.RemoveField(
+            model_name='privacypolicy',
+            name='text',
+        ),
+        migrations.RemoveField(
+            model_name='privacypolicy',
+            name='text_hash',
+        ),
+        migrations.RemoveField(
+            model_name='privacypolicy',
+            name='text_html',
+        ),
+        migrations.RemoveField(
+            model_name='privacypolicy',
+            name='text_plain',
+        ),
+        migrations.RemoveField(
+            model_name='privacypolicy',
+            name='toc',
+        ),
+    ]
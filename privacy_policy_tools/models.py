@@ -25,19 +25,244 @@ This module provides the models of the privacy_policy_tools.
 import random
 import string
 import secrets
-from django.db import models
+import zlib
+from django.db import IntegrityError, models, transaction
 from django.contrib.auth.models import Group
 from django.conf import settings
 from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
-from tinymce.models import HTMLField
-from bleach import clean
 from django.db.models.signals import pre_save
 from django.dispatch import receiver
 
+from privacy_policy_tools.cache import get_cache
+from privacy_policy_tools.conf import get_app_settings
+from privacy_policy_tools.rendering import RenderedText, diff_text, \
+    render_text
+from privacy_policy_tools.sanitizer import sanitize
+
+TEXT_KEY = 'privacy_policy_tools:text:%s'
+
+
+class PolicyText(models.Model):
+    """
+    This model stores a sanitized policy text together with its rendered
+    forms. It is addressed by the hash of the text, so policies with the
+    same text share one row. With the setting COMPRESS_POLICY_TEXT the
+    texts are compressed with zlib.
+
+    Fields:
+        - hash -- SHA-256 hex digest of the sanitized text
+        - compressed -- True if text, html and plain are compressed
+        - text -- sanitized HTML as UTF-8
+        - html -- HTML served to the users as UTF-8
+        - plain -- plain text as UTF-8
+        - toc -- table of contents
+        - created_at -- date and time of creation
+    """
+    hash = models.CharField(max_length=64, primary_key=True,
+                            verbose_name=_('Hash'))
+    compressed = models.BooleanField(default=False,
+                                     verbose_name=_('Compressed'))
+    text = models.BinaryField(verbose_name=_('Text'))
+    html = models.BinaryField(verbose_name=_('Rendered text'))
+    plain = models.BinaryField(verbose_name=_('Plain text'))
+    toc = models.JSONField(default=list, blank=True,
+                           verbose_name=_('Table of contents'))
+    created_at = models.DateTimeField(default=timezone.now,
+                                      verbose_name=_('Created at'))
+
+    def __str__(self):
+        """
+        Unicode Representation
+        """
+        return str(self.hash)
+
+    def _decode(self, value):
+        value = bytes(value)
+        if self.compressed:
+            value = zlib.decompress(value)
+        return value.decode('utf-8')
+
+    def get_text(self):
+        """
+        Returns the sanitized HTML.
+        """
+        return self._decode(self.text)
+
+    def get_rendered(self):
+        """
+        Returns the RenderedText without the sanitized HTML.
+        """
+        return RenderedText(html=self._decode(self.html),
+                            plain=self._decode(self.plain),
+                            toc=self.toc, hash=self.hash)
+
+    @classmethod
+    def build(cls, text, rendered, compress=None):
+        """
+        Returns a new unsaved PolicyText. The values are only compressed
+        if this makes them smaller.
+
+        Args:
+            text: sanitized HTML
+            rendered: RenderedText of the text
+            compress: True to compress, None for COMPRESS_POLICY_TEXT
+        """
+        if compress is None:
+            compress = get_app_settings().compress_policy_text
+        values = [value.encode('utf-8')
+                  for value in (text, rendered.html, rendered.plain)]
+        if compress:
+            packed = [zlib.compress(value) for value in values]
+            compress = sum(map(len, packed)) < sum(map(len, values))
+            if compress:
+                values = packed
+        return cls(hash=rendered.hash, compressed=compress, text=values[0],
+                   html=values[1], plain=values[2], toc=rendered.toc)
+
+    @classmethod
+    def store(cls, text, rendered):
+        """
+        Stores a sanitized text unless it exists and returns its hash.
+
+        Args:
+            text: sanitized HTML
+            rendered: RenderedText of the text
+        """
+        if not cls.objects.filter(pk=rendered.hash).exists():
+            try:
+                with transaction.atomic():
+                    cls.build(text, rendered).save(force_insert=True)
+            except IntegrityError:
+                # stored concurrently
+                pass
+        return rendered.hash
+
+    @classmethod
+    def get_rendered_many(cls, hashes):
+        """
+        Returns a dict of the RenderedText of the hashes. The texts are
+        cached without timeout because a hash always addresses the same
+        text, so policies with the same text share the cache entry. This
+        needs one query for the texts which are not cached.
+
+        Args:
+            hashes: iterable of hashes
+        """
+        keys = {TEXT_KEY % value: value for value in set(hashes)}
+        cache = get_cache()
+        rendered = {keys[key]: value
+                    for key, value in cache.get_many(list(keys)).items()}
+        missing = [value for value in keys.values() if value not in rendered]
+        if missing:
+            loaded = {content.hash: content.get_rendered()
+                      for content in cls.objects.filter(pk__in=missing)
+                      .defer('text')}
+            cache.set_many({TEXT_KEY % value: item
+                            for value, item in loaded.items()}, None)
+            rendered.update(loaded)
+        return rendered
+
+    class Meta:
+        verbose_name = _('Policy Text')
+        verbose_name_plural = _('Policy Texts')
+
+class PolicyLineage(models.Model):
+    """
+    This model groups the versions of a policy. A new policy joins the
+    lineage of the policies with the same title and group.
+
+    Fields:
+        - title -- title of the policies
+        - for_group -- group of the policies
+        - current_version -- active policy with the highest version
+    """
+    title = models.CharField(max_length=128, verbose_name=_('Title'))
+    for_group = models.ForeignKey(Group,
+                                  on_delete=models.CASCADE,
+                                  blank=True,
+                                  null=True,
+                                  verbose_name=_('For group'))
+    current_version = models.ForeignKey('PrivacyPolicy',
+                                        on_delete=models.SET_NULL,
+                                        blank=True,
+                                        null=True,
+                                        related_name='+',
+                                        verbose_name=_('Current version'))
+
+    def __str__(self):
+        """
+        Unicode Representation
+        """
+        return str(self.title)
+
+    @classmethod
+    def update_current_versions(cls, lineage_ids=None):
+        """
+        Points the lineages to their active policy with the highest
+        version. This needs one query.
+
+        Args:
+            lineage_ids: ids of the lineages to update, None for all
+        """
+        current = PrivacyPolicy.objects.filter(
+            lineage=models.OuterRef('pk'), active=True,
+        ).order_by('-version', '-published_at').values('pk')[:1]
+        lineages = cls.objects.all()
+        if lineage_ids is not None:
+            lineages = lineages.filter(pk__in=lineage_ids)
+        lineages.update(current_version=models.Subquery(current))
+
+    @classmethod
+    def update_diffs(cls, lineage_ids=None):
+        """
+        Recomputes the changes of each policy to the previous version of
+        its lineage and stores the changed ones with bulk_update. Returns
+        the number of updated policies.
+
+        Args:
+            lineage_ids: ids of the lineages to update, None for all
+        """
+        policies = PrivacyPolicy.objects.exclude(lineage=None) \
+            .order_by('lineage', *PrivacyPolicy.VERSION_ORDER) \
+            .only('pk', 'lineage', 'content', 'previous_version',
+                  'diff_html')
+        if lineage_ids is not None:
+            policies = policies.filter(lineage__in=lineage_ids)
+        policies = PrivacyPolicy.load_rendered(list(policies))
+        changed = []
+        previous = None
+        for policy in policies:
+            if previous is not None and \
+                    previous.lineage_id != policy.lineage_id:
+                previous = None
+            previous_id = previous.pk if previous is not None else None
+            diff = diff_text(previous.text_plain, policy.text_plain) \
+                if previous is not None else ''
+            if policy.previous_version_id != previous_id or \
+                    policy.diff_html != diff:
+                policy.previous_version_id = previous_id
+                policy.diff_html = diff
+                changed.append(policy)
+            previous = policy
+        PrivacyPolicy.objects.bulk_update(
+            changed, ['previous_version', 'diff_html'], batch_size=100)
+        return len(changed)
+
+    class Meta:
+        verbose_name = _('Policy Lineage')
+        verbose_name_plural = _('Policy Lineages')
+        constraints = [
+            models.UniqueConstraint(fields=['title', 'for_group'],
+                                    name='ppt_lineage_unique'),
+            models.UniqueConstraint(fields=['title'],
+                                    condition=models.Q(for_group=None),
+                                    name='ppt_lineage_unique_no_group'),
+        ]
+
+
 class PrivacyPolicy(models.Model):
     title = models.CharField(max_length=128, verbose_name=_('Title'), default=_('Privacy Policy'))
-    text = HTMLField(verbose_name=_('Text'))
     confirm_checkbox = models.BooleanField(default=False, verbose_name=_('Confirm checkbox'))
     confirm_checkbox_text = models.CharField(max_length=128, verbose_name=_('Confirm checkbox text'))
     confirm_button_text = models.CharField(max_length=128, verbose_name=_('Confirm button text'))
@@ -46,14 +271,129 @@ class PrivacyPolicy(models.Model):
     published_at = models.DateTimeField(default=timezone.now, verbose_name=_('Published at'))
     for_group = models.ForeignKey(Group, on_delete=models.CASCADE, blank=True, null=True, verbose_name=_('For group'))
     version = models.PositiveIntegerField(default=1, verbose_name=_('Version'))
+    lineage = models.ForeignKey(PolicyLineage, on_delete=models.SET_NULL, null=True, blank=True, editable=False, verbose_name=_('Lineage'))
+    content = models.ForeignKey(PolicyText, on_delete=models.PROTECT, related_name='policies', editable=False, verbose_name=_('Text'))
+    previous_version = models.ForeignKey('self', on_delete=models.SET_NULL, null=True, blank=True, editable=False, related_name='+', verbose_name=_('Previous version'))
+    diff_html = models.TextField(blank=True, editable=False, verbose_name=_('Changes to the previous version'))
+
+    VERSION_ORDER = ('version', 'published_at', 'pk')
+
+    # sanitized HTML assigned since the last save, see the property text
+    _text = None
 
     def __str__(self):
         return f"Privacy Policy: {self.title} (v{self.version})"
 
+    @property
+    def text(self):
+        """
+        The sanitized HTML of the policy. An assigned text is sanitized
+        and stored in PolicyText when the policy is saved.
+        """
+        if self._text is not None:
+            return self._text
+        if self.content_id is None:
+            return ''
+        return self.content.get_text()
+
+    @text.setter
+    def text(self, value):
+        self._text = value
+
+    @property
+    def rendered(self):
+        """
+        The RenderedText of the stored text, read from the cache.
+        """
+        rendered = self.__dict__.get('_rendered')
+        if rendered is None or rendered.hash != self.content_id:
+            if self.content_id is None:
+                return render_text('')
+            self.load_rendered([self])
+            rendered = self._rendered
+        return rendered
+
+    @property
+    def text_html(self):
+        """
+        The HTML served to the users with anchors on the headings.
+        """
+        return self.rendered.html
+
+    @property
+    def text_plain(self):
+        """
+        The plain text of the policy.
+        """
+        return self.rendered.plain
+
+    @property
+    def toc(self):
+        """
+        The table of contents as a list of dicts with level, id and title.
+        """
+        return self.rendered.toc
+
+    @property
+    def text_hash(self):
+        """
+        The SHA-256 hex digest of the sanitized text.
+        """
+        return self.content_id or ''
+
+    @classmethod
+    def load_rendered(cls, policies):
+        """
+        Loads the RenderedText of all policies at once and returns the
+        policies.
+
+        Args:
+            policies: list of policies
+        """
+        rendered = PolicyText.get_rendered_many(
+            policy.content_id for policy in policies
+            if policy.content_id is not None)
+        for policy in policies:
+            if policy.content_id is not None:
+                policy._rendered = rendered[policy.content_id]
+        return policies
+
+    def update_diff(self):
+        """
+        Stores the changes of the text to the previous version.
+        """
+        previous = self.get_previous_version()
+        self.previous_version = previous
+        self.diff_html = diff_text(previous.text_plain, self.text_plain) \
+            if previous is not None else ''
+
+    def get_previous_version(self):
+        """
+        Returns the policy of the same lineage which precedes this one in
+        the order of version, publication date and id, or None.
+        """
+        if self.lineage_id is None:
+            return None
+        earlier = models.Q(version__lt=self.version) | models.Q(
+            version=self.version, published_at__lt=self.published_at)
+        policies = PrivacyPolicy.objects.filter(lineage_id=self.lineage_id)
+        if self.pk is not None:
+            earlier |= models.Q(version=self.version,
+                                published_at=self.published_at,
+                                pk__lt=self.pk)
+            policies = policies.exclude(pk=self.pk)
+        order = ['-' + field for field in self.VERSION_ORDER]
+        return policies.filter(earlier).order_by(*order) \
+            .only('pk', 'content').first()
+
     class Meta:
         verbose_name = _('Privacy Policy')
         verbose_name_plural = _('Privacy Policies')
         ordering = ['-published_at', '-version']
+        indexes = [
+            models.Index(fields=['active', 'for_group', 'published_at'],
+                         name='ppt_policy_active_idx'),
+        ]
 
 
 
@@ -92,6 +432,14 @@ class PrivacyPolicyConfirmation(models.Model):
     class Meta:
         verbose_name = _('Privacy Policy Confirmation')
         verbose_name_plural = _('Privacy Policy Confirmations')
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'privacy_policy'],
+                                    name='ppt_confirmation_unique'),
+        ]
+        indexes = [
+            models.Index(fields=['privacy_policy', 'confirmed_at'],
+                         name='ppt_confirmation_policy_idx'),
+        ]
 
 
 class OneTimeToken(models.Model):
@@ -106,9 +454,11 @@ class OneTimeToken(models.Model):
     LENGTH = 32
     token = models.CharField(
         max_length=LENGTH,
+        unique=True,
         verbose_name=_('Token')
     )
     created_at = models.DateTimeField(default=timezone.now,
+                                      db_index=True,
                                       verbose_name=_('Created at'))
     confirmation = models.ForeignKey(PrivacyPolicyConfirmation,
                                      on_delete=models.CASCADE,
@@ -132,8 +482,7 @@ class OneTimeToken(models.Model):
             the created token
         """
         token = cls._generat_token()
-        while cls.objects.filter(token=token,
-                                 confirmation=confirmation).exists():
+        while cls.objects.filter(token=token).exists():
             token = cls._generat_token()
         ott = cls(token=token, confirmation=confirmation)
         ott.save()
@@ -155,37 +504,135 @@ class OneTimeToken(models.Model):
     class Meta:
         verbose_name = _('One Time Token')
         verbose_name_plural = _('One Time Tokens')
+
+
+class UserPolicyState(models.Model):
+    """
+    This model holds the latest confirmation of a user per policy
+    lineage. It is derived from the confirmations and kept up to date by
+    privacy_policy_tools.states.
+
+    Fields:
+        - user -- confirming user
+        - lineage -- lineage of the confirmed policy
+        - privacy_policy -- latest confirmed version of the lineage
+        - confirmation -- the confirmation of that version
+        - version -- version number of that policy
+        - confirmed_at -- date and time of confirmation
+        - second_confirmed_at -- date and time of the second confirmation
+    """
+    user = models.ForeignKey(settings.AUTH_USER_MODEL,
+                             on_delete=models.CASCADE,
+                             verbose_name=_('User'))
+    lineage = models.ForeignKey(PolicyLineage,
+                                on_delete=models.CASCADE,
+                                verbose_name=_('Lineage'))
+    privacy_policy = models.ForeignKey(PrivacyPolicy,
+                                       on_delete=models.CASCADE,
+                                       verbose_name=_('Privacy Policy'))
+    confirmation = models.ForeignKey(PrivacyPolicyConfirmation,
+                                     on_delete=models.CASCADE,
+                                     verbose_name=_('Confirmation'))
+    version = models.PositiveIntegerField(verbose_name=_('Version'))
+    confirmed_at = models.DateTimeField(verbose_name=_('Confirmed at'))
+    second_confirmed_at = models.DateTimeField(
+        null=True,
+        blank=True,
+        verbose_name=_('Second confirmed at')
+    )
+
+    def __str__(self):
+        """
+        Unicode Representation
+        """
+        return '%s: %s (v%s)' % (self.user_id, self.lineage_id, self.version)
+
+    class Meta:
+        verbose_name = _('User Policy State')
+        verbose_name_plural = _('User Policy States')
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'lineage'],
+                                    name='ppt_state_unique'),
+        ]
+        indexes = [
+            models.Index(fields=['lineage', 'version'],
+                         name='ppt_state_lineage_idx'),
+        ]
+
+
+class PolicyUptake(models.Model):
+    """
+    This model holds precomputed numbers of the confirmations of an active
+    policy. The rows are replaced by the command compute_policy_uptake.
+
+    Fields:
+        - privacy_policy -- the policy
+        - group -- users of this group only, None for all users to whom
+          the policy applies
+        - applicable -- number of active users to whom the policy applies
+        - confirmed -- number of these users who confirmed the policy
+        - pending -- number of these users who did not confirm it yet
+        - second_pending -- number of confirmations which await a second
+          confirmation, i.e. a one time token was issued and not used
+        - computed_at -- date and time of the computation
+    """
+    privacy_policy = models.ForeignKey(PrivacyPolicy,
+                                       on_delete=models.CASCADE,
+                                       verbose_name=_('Privacy Policy'))
+    group = models.ForeignKey(Group,
+                              on_delete=models.CASCADE,
+                              blank=True,
+                              null=True,
+                              verbose_name=_('Group'))
+    applicable = models.PositiveIntegerField(verbose_name=_('Applicable'))
+    confirmed = models.PositiveIntegerField(verbose_name=_('Confirmed'))
+    pending = models.PositiveIntegerField(verbose_name=_('Pending'))
+    second_pending = models.PositiveIntegerField(
+        verbose_name=_('Second confirmation pending'))
+    computed_at = models.DateTimeField(verbose_name=_('Computed at'))
+
+    def __str__(self):
+        """
+        Unicode Representation
+        """
+        return '%s: %s/%s' % (self.privacy_policy_id, self.confirmed,
+                              self.applicable)
+
+    class Meta:
+        verbose_name = _('Policy Uptake')
+        verbose_name_plural = _('Policy Uptake')
+        ordering = ['privacy_policy', 'group']
 @receiver(pre_save, sender=PrivacyPolicy)
 def sanitize_html(sender, instance, **kwargs):
     """
     Sanitize HTML content before saving to prevent XSS attacks
     """
-    # Define allowed HTML tags and attributes
-    allowed_tags = [
-        'p', 'br', 'strong', 'em', 'u', 'h1', 'h2', 'h3', 'h4', 'h5', 
-        'ul', 'ol', 'li', 'a', 'span', 'div', 'table', 'thead', 'tbody', 
-        'tr', 'th', 'td'
-    ]
-    allowed_attributes = {
-        'a': ['href', 'title', 'target'],
-        'span': ['style'],
-        'div': ['style'],
-        'table': ['border', 'cellpadding', 'cellspacing', 'style'],
-        'th': ['scope', 'style'],
-        'td': ['style'],
-    }
-    allowed_styles = [
-        'color', 'font-weight', 'text-align', 'margin', 'padding',
-        'border', 'border-width', 'border-style', 'border-color',
-        'background-color', 'width', 'height'
-    ]
-    
-    if instance.text:
-        # Clean the HTML content
-        instance.text = clean(
-            instance.text,
-            tags=allowed_tags,
-            attributes=allowed_attributes,
-            styles=allowed_styles,
-            strip=True
-        )
\ No newline at end of file
+    if instance._text is not None:
+        instance.text = sanitize(instance._text)
+
+
+@receiver(pre_save, sender=PrivacyPolicy)
+def assign_lineage(sender, instance, **kwargs):
+    """
+    Assigns a new policy to the lineage of its title and group. The
+    lineage of an existing policy is kept if its title is changed.
+    """
+    if instance.lineage_id is None:
+        instance.lineage, _created = PolicyLineage.objects.get_or_create(
+            title=str(instance.title), for_group=instance.for_group)
+
+
+@receiver(pre_save, sender=PrivacyPolicy)
+def store_policy_text(sender, instance, **kwargs):
+    """
+    Stores an assigned text in PolicyText and the changes to the
+    previous version. It runs after sanitize_html and assign_lineage. The
+    following versions are updated by the post_save receiver.
+    """
+    if instance._text is not None or instance.content_id is None:
+        text = instance._text or ''
+        rendered = render_text(text)
+        instance.content_id = PolicyText.store(text, rendered)
+        instance._text = None
+        instance._rendered = rendered
+    instance.update_diff()
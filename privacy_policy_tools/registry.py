@@ -0,0 +1,263 @@
+
+# Copyright (c) 2022 Josef Wachtler
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+This module provides an in-memory registry of the active policies. It is
+built with one query and shared by all threads of a process.
+"""
+import hashlib
+import threading
+import time
+from collections import namedtuple
+from types import MappingProxyType
+
+from asgiref.sync import sync_to_async
+from django.db import transaction
+from django.db.models import F
+
+from privacy_policy_tools.cache import acurrent_generation, \
+    bump_generation, current_generation, get_cache
+from privacy_policy_tools.models import PrivacyPolicy
+from privacy_policy_tools.conf import get_app_settings
+from privacy_policy_tools.utils import policy_applies
+
+PolicyRecord = namedtuple(
+    'PolicyRecord',
+    ['id', 'version', 'for_group_id', 'published_at', 'lineage_id'])
+PolicyRecord.__doc__ = """
+Lightweight and immutable representation of an active policy.
+"""
+
+Snapshot = namedtuple(
+    'Snapshot', ['generation', 'built_at', 'policies', 'by_group'])
+
+# the number changes with the fields of PolicyRecord
+SNAPSHOT_KEY = 'privacy_policy_tools:registry:2:%s'
+LOCK_KEY = 'privacy_policy_tools:registry-lock:%s'
+
+
+class PolicyRegistry:
+    """
+    This class holds a snapshot of the active policies indexed by the id
+    of their group. Policies without a group are indexed by None.
+
+    The snapshot is rebuilt lazily after it was invalidated, after the
+    policy generation changed or after REGISTRY_TIMEOUT seconds. Only one
+    process loads a generation from the database and shares it in the
+    cache. The others keep serving their previous snapshot meanwhile.
+    """
+
+    def __init__(self):
+        """
+        Constructor: starts with an empty registry
+        """
+        self._lock = threading.Lock()
+        self._snapshot = None
+        self._fingerprint = (None, None)
+
+    def invalidate(self):
+        """
+        Drops the snapshot. The next access rebuilds it.
+        """
+        self._snapshot = None
+
+    def _load(self):
+        """
+        Loads the active policies with one query and returns them as a
+        list of plain tuples.
+        """
+        return list(PrivacyPolicy.objects.filter(active=True).order_by(
+            F('for_group__name').asc(nulls_first=True),
+            '-published_at').values_list(*PolicyRecord._fields))
+
+    def _make_snapshot(self, generation, rows):
+        """
+        Returns a new snapshot of the given policies.
+
+        Keyword arguments:
+            - generation -- generation the policies belong to
+            - rows -- tuples of the policy fields
+        """
+        policies = tuple(PolicyRecord(*row) for row in rows)
+        by_group = {}
+        for policy in policies:
+            by_group.setdefault(policy.for_group_id, []).append(policy)
+        by_group = {k: tuple(v) for k, v in by_group.items()}
+        return Snapshot(generation, time.monotonic(), policies,
+                        MappingProxyType(by_group))
+
+    def _build(self, previous):
+        """
+        Returns a new snapshot. The generation is read first, so a change
+        during the query makes the snapshot stale.
+
+        The snapshot shared by another process is used if there is one.
+        Otherwise the process which gets the lock loads the policies and
+        shares them. The other processes return the previous snapshot
+        until the shared one is available. Without a previous snapshot
+        they load the policies on their own.
+
+        Keyword arguments:
+            - previous -- the stale snapshot or None
+        """
+        generation = current_generation()
+        if generation is None:
+            return self._make_snapshot(generation, self._load())
+        cache = get_cache()
+        key = SNAPSHOT_KEY % generation
+        rows = cache.get(key)
+        if rows is None:
+            lock = LOCK_KEY % generation
+            if cache.add(lock, True,
+                         get_app_settings().rebuild_lock_timeout):
+                try:
+                    rows = self._load()
+                    cache.set(key, rows, get_app_settings().registry_timeout)
+                finally:
+                    cache.delete(lock)
+            elif previous is not None:
+                return previous
+            else:
+                rows = self._load()
+        return self._make_snapshot(generation, rows)
+
+    def _is_fresh(self, snapshot):
+        """
+        Returns True if the given snapshot may still be used.
+
+        Keyword arguments:
+            - snapshot -- snapshot to check
+        """
+        return self._is_current(snapshot, current_generation())
+
+    def _is_current(self, snapshot, generation):
+        """
+        Returns True if the given snapshot belongs to the generation and is
+        not older than REGISTRY_TIMEOUT.
+
+        Keyword arguments:
+            - snapshot -- snapshot to check
+            - generation -- the current generation
+        """
+        if snapshot is None or snapshot.generation != generation:
+            return False
+        timeout = get_app_settings().registry_timeout
+        return time.monotonic() - snapshot.built_at < timeout
+
+    def get_snapshot(self):
+        """
+        Returns the current snapshot and rebuilds it if required.
+        """
+        snapshot = self._snapshot
+        if self._is_fresh(snapshot):
+            return snapshot
+        with self._lock:
+            previous = self._snapshot
+            if self._is_fresh(previous):
+                return previous
+            snapshot = self._build(previous)
+            if snapshot is not previous:
+                self._snapshot = snapshot
+        return snapshot
+
+    async def aget_snapshot(self):
+        """
+        Async version of get_snapshot. The database is only accessed, in a
+        thread, if the snapshot has to be rebuilt.
+        """
+        snapshot = self._snapshot
+        if self._is_current(snapshot, await acurrent_generation()):
+            return snapshot
+        return await sync_to_async(self.get_snapshot)()
+
+    def policies(self):
+        """
+        Returns a tuple of all active policies in the order of
+        get_active_policies.
+        """
+        return self.get_snapshot().policies
+
+    def fingerprint(self):
+        """
+        Returns a digest of the generation and the ids, versions and
+        publication dates of the active policies together with the
+        latest publication date. It is computed once per snapshot.
+        """
+        snapshot = self.get_snapshot()
+        cached_snapshot, fingerprint = self._fingerprint
+        if cached_snapshot is snapshot:
+            return fingerprint
+        key = repr((snapshot.generation, [
+            (p.id, p.version, p.published_at.isoformat())
+            for p in snapshot.policies]))
+        last_modified = max(
+            (p.published_at for p in snapshot.policies), default=None)
+        fingerprint = (hashlib.md5(key.encode()).hexdigest(), last_modified)
+        self._fingerprint = (snapshot, fingerprint)
+        return fingerprint
+
+    def for_group(self, group_id=None):
+        """
+        Returns a tuple of the active policies of a group.
+
+        Keyword arguments:
+            - group_id -- id of the group or None for no group
+        """
+        return self.get_snapshot().by_group.get(group_id, ())
+
+    def applicable(self, group_ids):
+        """
+        Returns a list of the active policies which apply to a member of
+        the given groups.
+
+        Keyword arguments:
+            - group_ids -- set of group ids of the user
+        """
+        return [p for p in self.policies() if policy_applies(p, group_ids)]
+
+    async def aapplicable(self, group_ids):
+        """
+        Async version of applicable.
+        """
+        snapshot = await self.aget_snapshot()
+        return [p for p in snapshot.policies if policy_applies(p, group_ids)]
+
+
+registry = PolicyRegistry()
+
+
+def policies_changed():
+    """
+    Announces that policies were changed. The registry is invalidated and
+    a new policy generation is started immediately and again after the
+    transaction is committed. Otherwise another process could share a
+    snapshot of the uncommitted state under the new generation.
+    """
+    _announce()
+    transaction.on_commit(_announce)
+
+
+def _announce():
+    """
+    Invalidates the registry and starts a new policy generation.
+    """
+    registry.invalidate()
+    bump_generation()
@@ -0,0 +1,227 @@
+
+# Copyright (c) 2022 Josef Wachtler
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+This module derives the artifacts of a policy text which are stored at
+save time: the HTML served to the users with anchors on the headings,
+the plain text, the table of contents, a content hash and the changes
+to the previous version.
+
+The text has to be sanitized before. The HTML is parsed once with the
+HTMLParser of the standard library and written again.
+"""
+import difflib
+import hashlib
+import re
+from collections import namedtuple
+from html import escape
+from html.parser import HTMLParser
+
+from django.utils.text import slugify
+
+HEADINGS = ('h1', 'h2', 'h3', 'h4', 'h5', 'h6')
+BLOCKS = HEADINGS + ('p', 'div', 'li', 'tr', 'table', 'ul', 'ol')
+LINES = ('li', 'tr')
+CELLS = ('td', 'th')
+VOID = ('br', 'hr', 'img')
+
+DIFF_CONTEXT = 1
+INLINE_RATIO = 0.5
+
+RenderedText = namedtuple('RenderedText', ['html', 'plain', 'toc', 'hash'])
+RenderedText.__doc__ = """
+Derived artifacts of a sanitized policy text.
+"""
+
+
+class _Renderer(HTMLParser):
+    """
+    Writes the parsed HTML again and collects the plain text and the
+    headings. The content of a heading is buffered until its end tag, so
+    the anchor can be derived from its text.
+    """
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.html = []
+        self.plain = []
+        self.toc = []
+        self.anchors = set()
+        self.heading = None
+
+    def _out(self):
+        return self.heading[2] if self.heading else self.html
+
+    def _tag(self, tag, attrs, close=''):
+        attrs = ''.join(' %s="%s"' % (name, escape(value or ''))
+                        for name, value in attrs)
+        return '<%s%s%s>' % (tag, attrs, close)
+
+    def _anchor(self, title):
+        base = slugify(title) or 'section'
+        anchor, number = base, 1
+        while anchor in self.anchors:
+            number += 1
+            anchor = '%s-%d' % (base, number)
+        self.anchors.add(anchor)
+        return anchor
+
+    def handle_starttag(self, tag, attrs):
+        if tag in BLOCKS:
+            self.plain.append('\n')
+        elif tag in CELLS:
+            self.plain.append(' ')
+        if tag in HEADINGS and self.heading is None:
+            attrs = [(n, v) for n, v in attrs if n != 'id']
+            self.heading = (tag, attrs, [], [])
+            return
+        self._out().append(self._tag(tag, attrs))
+        if tag == 'br':
+            self.plain.append('\n')
+
+    def handle_startendtag(self, tag, attrs):
+        self._out().append(self._tag(tag, attrs, ' /'))
+        if tag == 'br':
+            self.plain.append('\n')
+
+    def handle_endtag(self, tag):
+        if self.heading is not None and tag == self.heading[0]:
+            tag, attrs, content, text = self.heading
+            self.heading = None
+            title = ' '.join(''.join(text).split())
+            anchor = self._anchor(title)
+            self.toc.append({'level': int(tag[1]), 'id': anchor,
+                             'title': title})
+            self.html.append(self._tag(tag, [('id', anchor)] + attrs))
+            self.html.extend(content)
+            self.html.append('</%s>' % tag)
+            self.plain.append('\n')
+            return
+        if tag not in VOID:
+            self._out().append('</%s>' % tag)
+        if tag in BLOCKS and tag not in LINES:
+            self.plain.append('\n')
+
+    def handle_data(self, data):
+        self._out().append(escape(data, quote=False))
+        if self.heading is not None:
+            self.heading[3].append(data)
+        self.plain.append(data)
+
+
+def _plain_text(parts):
+    """
+    Joins the text parts and normalizes the white space: one space
+    within lines and at most one empty line between blocks.
+    """
+    lines = [' '.join(line.split()) for line in ''.join(parts).split('\n')]
+    text = []
+    for line in lines:
+        if line or (text and text[-1]):
+            text.append(line)
+    return '\n'.join(text).strip()
+
+
+def render_text(text):
+    """
+    Returns the RenderedText of a sanitized policy text.
+
+    Keyword arguments:
+        - text -- sanitized HTML
+    """
+    renderer = _Renderer()
+    renderer.feed(text or '')
+    renderer.close()
+    return RenderedText(
+        html=''.join(renderer.html),
+        plain=_plain_text(renderer.plain),
+        toc=renderer.toc,
+        hash=hashlib.sha256((text or '').encode()).hexdigest())
+
+
+def _inline_diff(old, new):
+    """
+    Returns the HTML of a changed line with the removed and added words
+    marked.
+    """
+    old_words = re.split(r'(\s+)', old)
+    new_words = re.split(r'(\s+)', new)
+    html = []
+    matcher = difflib.SequenceMatcher(None, old_words, new_words)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        removed = escape(''.join(old_words[i1:i2]), quote=False)
+        added = escape(''.join(new_words[j1:j2]), quote=False)
+        if tag == 'equal':
+            html.append(added)
+            continue
+        if removed:
+            html.append('<del>%s</del>' % removed)
+        if added:
+            html.append('<ins>%s</ins>' % added)
+    return '<p>%s</p>' % ''.join(html)
+
+
+def _changed_lines(old_lines, new_lines):
+    """
+    Yields the HTML of replaced lines. Similar lines are paired and
+    diffed word by word.
+    """
+    if len(old_lines) == len(new_lines):
+        pairs = list(zip(old_lines, new_lines))
+        if all(difflib.SequenceMatcher(None, old, new).ratio() >=
+               INLINE_RATIO for old, new in pairs):
+            for old, new in pairs:
+                yield _inline_diff(old, new)
+            return
+    for line in old_lines:
+        yield '<p><del>%s</del></p>' % escape(line, quote=False)
+    for line in new_lines:
+        yield '<p><ins>%s</ins></p>' % escape(line, quote=False)
+
+
+def diff_text(old, new):
+    """
+    Returns the changes between two plain texts as HTML or an empty
+    string if they are equal. Removed text is marked with del, added text
+    with ins. Unchanged lines are only kept around the changes, the
+    omitted ones are replaced by hr.
+
+    Keyword arguments:
+        - old -- plain text of the previous version
+        - new -- plain text of the new version
+    """
+    old_lines = [line for line in (old or '').splitlines() if line]
+    new_lines = [line for line in (new or '').splitlines() if line]
+    matcher = difflib.SequenceMatcher(None, old_lines, new_lines)
+    groups = []
+    for group in matcher.get_grouped_opcodes(DIFF_CONTEXT):
+        html = []
+        for tag, i1, i2, j1, j2 in group:
+            if tag == 'equal':
+                html.extend('<p>%s</p>' % escape(line, quote=False)
+                            for line in new_lines[j1:j2])
+            else:
+                html.extend(_changed_lines(old_lines[i1:i2],
+                                           new_lines[j1:j2]))
+        groups.append(''.join(html))
+    if not groups:
+        return ''
+    return '<div class="policy-diff">%s</div>' % '<hr>'.join(groups)
@@ -0,0 +1,108 @@
+
+# Copyright (c) 2022 Josef Wachtler
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+This module purges data of the privacy_policy_tools which is no longer
+needed.
+
+Rows are deleted in batches of ids, each in its own short transaction,
+so no long locks are held on large tables.
+"""
+import time
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+
+from privacy_policy_tools.conf import get_app_settings
+from privacy_policy_tools.models import OneTimeToken, PolicyText, \
+    PrivacyPolicyConfirmation, UserPolicyState
+
+BATCH_SIZE = 1000
+
+
+def expired_tokens(now=None):
+    """
+    Returns a queryset of the one time tokens which are older than
+    SECOND_CONFIRM_VALID_FOR_MINUTES.
+
+    Keyword arguments:
+        - now -- the current datetime
+    """
+    valid_for = get_app_settings().second_confirm_valid_for_minutes
+    cutoff = (now or timezone.now()) - timedelta(minutes=valid_for)
+    return OneTimeToken.objects.filter(created_at__lt=cutoff)
+
+
+def superseded_confirmations():
+    """
+    Returns a queryset of the confirmations of inactive policies whose
+    user confirmed a newer version of the same lineage since.
+    """
+    newer = UserPolicyState.objects.filter(
+        user=OuterRef('user'),
+        lineage=OuterRef('privacy_policy__lineage'),
+        version__gt=OuterRef('privacy_policy__version'))
+    return PrivacyPolicyConfirmation.objects.filter(
+        privacy_policy__active=False).filter(Exists(newer))
+
+
+def unused_texts():
+    """
+    Returns a queryset of the policy texts which are not referenced by any
+    policy, e.g. because the text of the policy was changed.
+    """
+    return PolicyText.objects.filter(policies=None)
+
+
+def purge(queryset, batch_size=BATCH_SIZE, before_delete=None, pause=0,
+          progress=None):
+    """
+    Deletes the rows of a queryset in batches and returns their number.
+    The one time tokens and policy states of deleted confirmations are
+    deleted with them and the states of their users are updated once per
+    batch.
+
+    Keyword arguments:
+        - queryset -- rows to delete
+        - batch_size -- number of rows per transaction
+        - before_delete -- called with the ids of each batch before it is
+          deleted, e.g. to archive the rows
+        - pause -- seconds to sleep between the batches
+        - progress -- called with the number of deleted rows after every
+          batch
+    """
+    ids = queryset.order_by('pk').values_list('pk', flat=True)
+    deleted = 0
+    while True:
+        batch = list(ids[:batch_size])
+        if not batch:
+            return deleted
+        with transaction.atomic():
+            if before_delete is not None:
+                before_delete(batch)
+            queryset.model.objects.filter(pk__in=batch).delete()
+        deleted += len(batch)
+        if progress is not None:
+            progress(deleted)
+        if pause:
+            time.sleep(pause)
@@ -0,0 +1,132 @@
+
+# Copyright (c) 2022 Josef Wachtler
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+This module computes the PolicyUptake rollup of the privacy_policy_tools.
+
+The numbers are computed with aggregate queries, a constant number per
+active policy, and replace the previous rollup in one transaction. Only
+active users are counted.
+"""
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import Count, Exists, OuterRef, Q
+from django.utils import timezone
+
+from privacy_policy_tools.conf import get_app_settings
+from privacy_policy_tools.models import OneTimeToken, PolicyUptake, \
+    PrivacyPolicy, PrivacyPolicyConfirmation
+
+
+def _second_pending():
+    """
+    Returns the condition of the confirmations which await a second
+    confirmation: a one time token was issued and it was not used yet.
+    """
+    tokens = OneTimeToken.objects.filter(confirmation=OuterRef('pk'))
+    return Q(Exists(tokens), second_confirmed_at=None)
+
+
+def _users_per_group():
+    """
+    Returns a dict of the number of active users keyed by the group id.
+    This needs one query.
+    """
+    memberships = get_user_model().groups.through.objects.filter(
+        user__is_active=True)
+    return dict(memberships.values('group_id').annotate(
+        count=Count('user_id')).values_list('group_id', 'count'))
+
+
+def _confirmations_per_group(policy):
+    """
+    Returns a dict of (confirmed, second_pending) of the active users
+    keyed by the group id of the users, None for users without group.
+    This needs one query.
+
+    Keyword arguments:
+        - policy -- a PrivacyPolicy
+    """
+    user_groups = 'user__groups'
+    confirmations = PrivacyPolicyConfirmation.objects.filter(
+        privacy_policy=policy, user__is_active=True)
+    rows = confirmations.values(user_groups).annotate(
+        confirmed=Count('id'),
+        second_pending=Count('id', filter=_second_pending()),
+    ).values_list(user_groups, 'confirmed', 'second_pending')
+    return {group_id: (confirmed, second_pending)
+            for group_id, confirmed, second_pending in rows}
+
+
+def _uptake(policy, group_id, applicable, confirmed, second_pending, now):
+    """
+    Returns a new PolicyUptake.
+    """
+    return PolicyUptake(
+        privacy_policy=policy, group_id=group_id, applicable=applicable,
+        confirmed=confirmed, pending=max(applicable - confirmed, 0),
+        second_pending=second_pending, computed_at=now)
+
+
+def compute_policy_uptake():
+    """
+    Recomputes the uptake of all active policies and returns the new
+    PolicyUptake rows. A policy without group gets a row per group of
+    users besides the total if it applies to all users.
+    """
+    users = get_user_model().objects.filter(is_active=True)
+    default_policy = get_app_settings().default_policy
+    per_group = _users_per_group()
+    all_users = users.count()
+    users_without_group = users.filter(groups=None).count()
+    now = timezone.now()
+
+    uptake = []
+    for policy in PrivacyPolicy.objects.filter(active=True):
+        confirmations = _confirmations_per_group(policy)
+        if policy.for_group_id is not None:
+            confirmed, second_pending = confirmations.get(
+                policy.for_group_id, (0, 0))
+            uptake.append(_uptake(policy, None,
+                                  per_group.get(policy.for_group_id, 0),
+                                  confirmed, second_pending, now))
+            continue
+        if not default_policy:
+            confirmed, second_pending = confirmations.get(None, (0, 0))
+            uptake.append(_uptake(policy, None, users_without_group,
+                                  confirmed, second_pending, now))
+            continue
+        # users with several groups appear in several rows
+        total = PrivacyPolicyConfirmation.objects.filter(
+            privacy_policy=policy, user__is_active=True).aggregate(
+            confirmed=Count('id'),
+            second_pending=Count('id', filter=_second_pending()))
+        uptake.append(_uptake(policy, None, all_users, total['confirmed'],
+                              total['second_pending'], now))
+        for group_id, applicable in per_group.items():
+            confirmed, second_pending = confirmations.get(group_id, (0, 0))
+            uptake.append(_uptake(policy, group_id, applicable, confirmed,
+                                  second_pending, now))
+
+    with transaction.atomic():
+        PolicyUptake.objects.all().delete()
+        PolicyUptake.objects.bulk_create(uptake)
+    return uptake
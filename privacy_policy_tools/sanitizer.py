@@ -0,0 +1,179 @@
+
+# Copyright (c) 2022 Josef Wachtler
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+This module provides the sanitization of the policy texts.
+
+The allowlists are read from the settings once and compiled into a bleach
+Cleaner. A Cleaner is not thread safe, so every thread builds its own
+one from the shared allowlists. They are rebuilt if the settings change.
+"""
+import inspect
+import threading
+
+from bleach.sanitizer import Cleaner
+
+from privacy_policy_tools.conf import get_app_settings
+from privacy_policy_tools.rendering import render_text
+
+try:
+    from bleach.css_sanitizer import CSSSanitizer
+except ImportError:  # bleach < 5 or tinycss2 is missing
+    CSSSanitizer = None
+
+DEFAULT_TAGS = (
+    'p', 'br', 'strong', 'em', 'u', 'h1', 'h2', 'h3', 'h4', 'h5',
+    'ul', 'ol', 'li', 'a', 'span', 'div', 'table', 'thead', 'tbody',
+    'tr', 'th', 'td',
+)
+DEFAULT_ATTRIBUTES = {
+    'a': ['href', 'title', 'target'],
+    'span': ['style'],
+    'div': ['style'],
+    'table': ['border', 'cellpadding', 'cellspacing', 'style'],
+    'th': ['scope', 'style'],
+    'td': ['style'],
+}
+DEFAULT_STYLES = (
+    'color', 'font-weight', 'text-align', 'margin', 'padding',
+    'border', 'border-width', 'border-style', 'border-color',
+    'background-color', 'width', 'height',
+)
+
+# bleach < 5 filters the styles itself, later versions need a CSSSanitizer
+LEGACY_STYLES = 'styles' in inspect.signature(Cleaner).parameters
+
+
+def get_allowlists():
+    """
+    Returns the allowlists of the settings as a dict with the keys tags,
+    attributes and styles. The dict can be passed to other processes.
+
+    Settings:
+        - SANITIZE_TAGS -- allowed tags
+        - SANITIZE_ATTRIBUTES -- dict of the allowed attributes per tag
+        - SANITIZE_STYLES -- allowed CSS properties
+    """
+    app_settings = get_app_settings()
+    tags = app_settings.sanitize_tags
+    attributes = app_settings.sanitize_attributes
+    styles = app_settings.sanitize_styles
+    if tags is None:
+        tags = DEFAULT_TAGS
+    if attributes is None:
+        attributes = DEFAULT_ATTRIBUTES
+    if styles is None:
+        styles = DEFAULT_STYLES
+    return {
+        'tags': list(tags),
+        'attributes': {tag: list(names) for tag, names in attributes.items()},
+        'styles': list(styles),
+    }
+
+
+def build_cleaner(allowlists):
+    """
+    Returns a new Cleaner for the allowlists. Without a CSSSanitizer the
+    style attributes are not allowed at all.
+
+    Keyword arguments:
+        - allowlists -- dict as returned by get_allowlists
+    """
+    kwargs = {
+        'tags': allowlists['tags'],
+        'attributes': allowlists['attributes'],
+        'strip': True,
+    }
+    if LEGACY_STYLES:
+        kwargs['styles'] = allowlists['styles']
+    elif CSSSanitizer is not None:
+        kwargs['css_sanitizer'] = CSSSanitizer(
+            allowed_css_properties=allowlists['styles'])
+    else:
+        kwargs['attributes'] = {
+            tag: [name for name in names if name != 'style']
+            for tag, names in allowlists['attributes'].items()}
+    return Cleaner(**kwargs)
+
+
+_allowlists = None
+_local = threading.local()
+
+
+def get_cleaner():
+    """
+    Returns the Cleaner of the current thread and builds it on first use.
+    """
+    global _allowlists
+    allowlists = _allowlists
+    if allowlists is None:
+        allowlists = _allowlists = get_allowlists()
+    if getattr(_local, 'allowlists', None) is not allowlists:
+        _local.cleaner = build_cleaner(allowlists)
+        _local.allowlists = allowlists
+    return _local.cleaner
+
+
+def reset_cleaner():
+    """
+    Drops the allowlists. The next call of get_cleaner rebuilds the
+    Cleaner of each thread.
+    """
+    global _allowlists
+    _allowlists = None
+
+
+def sanitize(text):
+    """
+    Returns the sanitized HTML of a text.
+
+    Keyword arguments:
+        - text -- HTML text, may be empty
+    """
+    if not text:
+        return text
+    return get_cleaner().clean(text)
+
+
+_worker = (None, None)
+
+
+def sanitize_rows(allowlists, rows):
+    """
+    Sanitizes the texts of policies, usually in a worker process without
+    access to the settings. Returns a list of (id, text, RenderedText)
+    tuples for the texts which were changed.
+
+    Keyword arguments:
+        - allowlists -- dict as returned by get_allowlists
+        - rows -- list of (id, text) tuples
+    """
+    global _worker
+    cached_allowlists, cleaner = _worker
+    if cached_allowlists != allowlists:
+        cleaner = build_cleaner(allowlists)
+        _worker = (allowlists, cleaner)
+    changed = []
+    for pk, text in rows:
+        cleaned = cleaner.clean(text) if text else text
+        if cleaned != text:
+            changed.append((pk, cleaned, render_text(cleaned)))
+    return changed
@@ -1,7 +1,19 @@
 from rest_framework import serializers
 from .models import PrivacyPolicy
 
+class PrivacyPolicyListSerializer(serializers.ListSerializer):
+    def to_representation(self, data):
+        # loads the rendered texts of all policies at once
+        policies = list(data.all() if hasattr(data, 'all') else data)
+        return super().to_representation(
+            PrivacyPolicy.load_rendered(policies))
+
+
 class PrivacyPolicySerializer(serializers.ModelSerializer):
+    text = serializers.CharField(source='text_html', read_only=True)
+
     class Meta:
         model = PrivacyPolicy
-        fields = ['id', 'title', 'text', 'version', 'published_at']
\ No newline at end of file
+        list_serializer_class = PrivacyPolicyListSerializer
+        fields = ['id', 'title', 'text', 'text_plain', 'toc', 'text_hash',
+                  'version', 'published_at']
@@ -0,0 +1,161 @@
+
+# Copyright (c) 2022 Josef Wachtler
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+This module provides the signal receivers which keep the caches of the
+privacy_policy_tools up to date.
+"""
+import importlib
+import sys
+from collections import Counter
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.signals import setting_changed
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+from django.urls import clear_url_caches
+
+from privacy_policy_tools.cache import bump_generation, \
+    invalidate_compliance, invalidate_hook_results
+from privacy_policy_tools.models import PolicyLineage, PrivacyPolicy, \
+    PrivacyPolicyConfirmation
+from privacy_policy_tools.conf import get_app_settings, reset_app_settings
+from privacy_policy_tools.exemptions import reset_matcher
+from privacy_policy_tools.registry import policies_changed
+from privacy_policy_tools.sanitizer import reset_cleaner
+from privacy_policy_tools.states import refresh_policy_states
+from privacy_policy_tools.utils import reset_hooks
+
+
+@receiver(post_save, sender=PrivacyPolicy)
+@receiver(post_delete, sender=PrivacyPolicy)
+def policy_changed(sender, instance, **kwargs):
+    """
+    Invalidates the policy registry, updates the current version and the
+    changes between the versions of the lineage and starts a new policy
+    generation if a policy is changed.
+    """
+    if instance.lineage_id is not None:
+        PolicyLineage.update_current_versions([instance.lineage_id])
+        PolicyLineage.update_diffs([instance.lineage_id])
+    policies_changed()
+
+
+# attribute of the object which started a deletion, counts the deleted
+# confirmations per user
+DELETED_CONFIRMATIONS = '_privacy_policy_tools_deleted_confirmations'
+
+
+@receiver(pre_delete, sender=PrivacyPolicyConfirmation)
+def confirmation_deleting(sender, instance, origin=None, **kwargs):
+    """
+    Counts the confirmations which are deleted together, e.g. by deleting
+    a policy, a user or a queryset. The counter is kept on the object which
+    started the deletion, so confirmation_changed updates the users once
+    after the last of them.
+    """
+    if origin is None or origin is instance:
+        return
+    deleted = origin.__dict__.setdefault(DELETED_CONFIRMATIONS, Counter())
+    deleted[instance.user_id] += 1
+
+
+@receiver(post_save, sender=PrivacyPolicyConfirmation)
+@receiver(post_delete, sender=PrivacyPolicyConfirmation)
+def confirmation_changed(sender, instance, origin=None, **kwargs):
+    """
+    Recomputes the policy states and invalidates the compliance entry and
+    the memoized hook results of the confirming user. Confirmations which
+    are deleted together are handled at once.
+    """
+    user_ids = [instance.user_id]
+    deleted = getattr(origin, DELETED_CONFIRMATIONS, None)
+    if deleted is not None:
+        deleted[instance.user_id] -= 1
+        if +deleted:
+            return
+        delattr(origin, DELETED_CONFIRMATIONS)
+        user_ids = list(deleted)
+    refresh_policy_states(user_ids)
+    invalidate_compliance(user_ids)
+    invalidate_hook_results(user_ids)
+
+
+def user_groups_changed(sender, instance, action, reverse, pk_set,
+                        **kwargs):
+    """
+    Invalidates the compliance entries of users whose groups changed.
+    It is connected to m2m_changed of the user groups in the app config.
+    """
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        invalidate_compliance([instance.pk])
+    elif pk_set:
+        invalidate_compliance(pk_set)
+    else:
+        # a group was cleared, the affected users are unknown
+        bump_generation()
+
+
+URL_SETTINGS = ('policy_page_url', 'policy_confirm_url',
+                'second_confirm_required_url', 'second_confirm_url',
+                'export_url')
+
+
+def reload_urls():
+    """
+    Reloads the URLconf of the app and the ROOT_URLCONF which includes it
+    if the URL settings differ from the ones the URL patterns were built
+    with.
+    """
+    urls = sys.modules.get('privacy_policy_tools.urls')
+    if urls is None:
+        return
+    try:
+        app_settings = get_app_settings()
+    except ImproperlyConfigured:
+        # reported by the system check privacy_policy_tools.E003
+        return
+    if all(getattr(app_settings, name) == getattr(urls.app_settings, name)
+           for name in URL_SETTINGS):
+        return
+    importlib.reload(urls)
+    root = sys.modules.get(getattr(settings, 'ROOT_URLCONF', None))
+    if root is not None and root is not urls:
+        importlib.reload(root)
+    clear_url_caches()
+
+
+@receiver(setting_changed)
+def settings_changed(sender, setting, **kwargs):
+    """
+    Drops the state derived from settings if they are changed.
+    """
+    if setting == 'PRIVACY_POLICY_TOOLS':
+        reset_app_settings()
+        reset_hooks()
+        reset_cleaner()
+        reload_urls()
+    if setting in ('PRIVACY_POLICY_TOOLS', 'STATIC_URL', 'MEDIA_URL',
+                   'ROOT_URLCONF'):
+        reset_matcher()
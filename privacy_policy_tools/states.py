@@ -0,0 +1,153 @@
+
+# Copyright (c) 2022 Josef Wachtler
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+This module maintains the UserPolicyState table of the
+privacy_policy_tools.
+
+A state holds the latest confirmation of a user per policy lineage. The
+states of a user are recomputed from the confirmations whenever they
+change. Publishing a policy or changing the groups of a user does not
+change the states: a user is compliant to an applicable policy if the
+state of its lineage points to that policy.
+"""
+from django.contrib.auth import get_user_model
+from django.db import transaction
+
+from privacy_policy_tools.models import PrivacyPolicyConfirmation, \
+    UserPolicyState
+
+
+def _latest_states(user_ids):
+    """
+    Returns new states of the given users built from their latest
+    confirmation per lineage. This needs one query.
+
+    Keyword arguments:
+        - user_ids -- list of user ids
+    """
+    confirmations = PrivacyPolicyConfirmation.objects.filter(
+        user_id__in=user_ids,
+        privacy_policy__lineage__isnull=False,
+    ).order_by(
+        'user_id', 'privacy_policy__lineage_id', '-privacy_policy__version',
+        '-privacy_policy__published_at', '-confirmed_at', '-id',
+    ).values_list(
+        'id', 'user_id', 'privacy_policy_id', 'privacy_policy__lineage_id',
+        'privacy_policy__version', 'confirmed_at', 'second_confirmed_at')
+    states = {}
+    for (confirmation_id, user_id, policy_id, lineage_id, version,
+         confirmed_at, second_confirmed_at) in confirmations:
+        if (user_id, lineage_id) in states:
+            continue
+        states[(user_id, lineage_id)] = UserPolicyState(
+            user_id=user_id,
+            lineage_id=lineage_id,
+            privacy_policy_id=policy_id,
+            confirmation_id=confirmation_id,
+            version=version,
+            confirmed_at=confirmed_at,
+            second_confirmed_at=second_confirmed_at)
+    return list(states.values())
+
+
+def refresh_policy_states(user_ids):
+    """
+    Recomputes the states of the given users in one transaction and
+    returns the number of states.
+
+    Keyword arguments:
+        - user_ids -- list of user ids
+    """
+    user_ids = list(user_ids)
+    if not user_ids:
+        return 0
+    with transaction.atomic(savepoint=False):
+        UserPolicyState.objects.filter(user_id__in=user_ids).delete()
+        states = UserPolicyState.objects.bulk_create(
+            _latest_states(user_ids))
+    return len(states)
+
+
+def iter_user_ids(chunk_size=1000):
+    """
+    Yields lists of user ids using keyset pagination, so the memory
+    usage does not depend on the number of users.
+
+    Keyword arguments:
+        - chunk_size -- maximum number of ids per list
+    """
+    users = get_user_model().objects.order_by('pk')
+    last_id = None
+    while True:
+        chunk = users if last_id is None else users.filter(pk__gt=last_id)
+        user_ids = list(chunk.values_list('pk', flat=True)[:chunk_size])
+        if not user_ids:
+            return
+        yield user_ids
+        last_id = user_ids[-1]
+
+
+def get_policy_states(user):
+    """
+    Returns a dict of the states of a user keyed by the lineage id. This
+    needs one query.
+
+    Keyword arguments:
+        - user -- user object
+    """
+    states = UserPolicyState.objects.filter(user=user)
+    return {s.lineage_id: s for s in states}
+
+
+def get_unconfirmed_policies(user, policies):
+    """
+    Returns the policies of the given list which are not the latest
+    confirmed version of their lineage. The second confirmation is not
+    taken into account because it depends on the hooks. This needs one
+    query.
+
+    Keyword arguments:
+        - user -- user object
+        - policies -- list of policies or PolicyRecords
+    """
+    states = get_policy_states(user)
+    unconfirmed = []
+    for policy in policies:
+        state = states.get(policy.lineage_id)
+        if state is None or state.privacy_policy_id != policy.id:
+            unconfirmed.append(policy)
+    return unconfirmed
+
+
+def get_outdated_users(policy):
+    """
+    Returns a queryset of the users who confirmed an older version of the
+    lineage of the given policy, e.g. the current version of a lineage,
+    but not the policy itself. The states are looked up by the index on
+    lineage and version.
+
+    Keyword arguments:
+        - policy -- a PrivacyPolicy
+    """
+    return get_user_model().objects.filter(
+        userpolicystate__lineage=policy.lineage_id,
+        userpolicystate__version__lt=policy.version)
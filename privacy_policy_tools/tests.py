@@ -1,15 +1,53 @@
 from django.test import TestCase
 from django.contrib.auth.models import User
 from .models import PrivacyPolicy, PrivacyPolicyConfirmation
-from django.test import TestCase, Client, RequestFactory
+from django.test import TestCase, Client, RequestFactory, override_settings
+from django.http import HttpResponse
 from django.contrib.auth.models import User, Group
 from django.urls import reverse
-from django.utils import timezone
+from django.utils import timezone, translation
 from datetime import timedelta
+import shutil
+import tempfile
+from unittest import mock
+from dataclasses import FrozenInstanceError
+from types import SimpleNamespace
 
-from .models import PrivacyPolicy, PrivacyPolicyConfirmation, OneTimeToken
+from asgiref.sync import iscoroutinefunction
+
+from .models import PrivacyPolicy, PrivacyPolicyConfirmation, OneTimeToken, \
+    UserPolicyState, PolicyUptake, PolicyLineage, PolicyText
+from .rollups import compute_policy_uptake
+from .rendering import render_text
+from .sanitizer import get_cleaner, sanitize
+from .serializers import PrivacyPolicySerializer
+from .states import get_outdated_users, get_unconfirmed_policies
+from django.core.management import call_command
+from io import StringIO
 from .middleware import PrivacyPolicyMiddleware
-from . import utils
+from .decorators import privacy_policy_exempt
+from .exemptions import build_matcher
+from .checks import check_hooks, check_settings
+from .conf import get_app_settings
+from .context_processors import privacy_tools
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management.base import SystemCheckError
+from django.db import IntegrityError, connection, transaction
+from django.test.utils import CaptureQueriesContext
+from .registry import registry, LOCK_KEY, SNAPSHOT_KEY
+from .admin import PrivacyPolicyAdmin, PrivacyPolicyConfirmationAdmin, \
+    LargeTableChangeList
+from .paginators import EstimatedCountPaginator
+from django.contrib.admin.sites import AdminSite
+from django.contrib import messages
+from django.contrib.auth.models import AnonymousUser
+from django.contrib.messages.storage.fallback import FallbackStorage
+from django.contrib.sessions.middleware import SessionMiddleware
+from django.middleware.csrf import get_token
+from . import cache, exports, imports, retention, utils, views
+import gzip
+import json
+import os
 
 class PrivacyPolicyModelTest(TestCase):
     def setUp(self):
@@ -163,4 +201,1227 @@ class MiddlewareTest(TestCase):
         self.user.groups.add(self.group)
         self.assertTrue(
             self.middleware._policy_applies_to_user(self.user, self.group_policy)
-        )
\ No newline at end of file
+        )
+
+@override_settings(PRIVACY_POLICY_TOOLS={
+    'ENABLED': True,
+    'POLICY_PAGE_URL': 'terms/and/conditions',
+    'COMPLIANCE_CACHE_TIMEOUT': 60,
+})
+class ComplianceCacheTest(TestCase):
+    def setUp(self):
+        cache.get_cache().clear()
+        self.factory = RequestFactory()
+        self.middleware = PrivacyPolicyMiddleware(lambda r: HttpResponse())
+        self.user = User.objects.create_user('cache_user', 'cache@example.com', 'password')
+        self.group = Group.objects.create(name='CacheGroup')
+        self.policy = PrivacyPolicy.objects.create(
+            title="General Policy", text="General", active=True)
+        PrivacyPolicyConfirmation.objects.create(
+            user=self.user, privacy_policy=self.policy)
+
+    def _get(self):
+        request = self.factory.get('/dashboard/')
+        request.user = self.user
+        return self.middleware(request)
+
+    def test_compliant_user_skips_database(self):
+        self.assertEqual(self._get().status_code, 200)
+        with self.assertNumQueries(0):
+            self.assertEqual(self._get().status_code, 200)
+
+    def test_new_policy_invalidates(self):
+        self._get()
+        PrivacyPolicy.objects.create(title="New", text="New", active=True)
+        self.assertEqual(self._get().status_code, 302)
+
+    def test_group_change_invalidates(self):
+        PrivacyPolicy.objects.create(
+            title="Group", text="Group", active=True, for_group=self.group)
+        self._get()
+        self.user.groups.add(self.group)
+        self.assertEqual(self._get().status_code, 302)
+
+
+class EnforceBeforeViewTest(TestCase):
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.user = User.objects.create_user('view_user', 'view@example.com', 'password')
+        PrivacyPolicy.objects.create(title="Policy", text="Policy", active=True)
+        self.calls = []
+
+        def view(request):
+            self.calls.append(request)
+            return HttpResponse()
+        self.view = view
+
+    def _request(self):
+        request = self.factory.get('/dashboard/')
+        request.user = self.user
+        return request
+
+    def _middleware(self, view):
+        def get_response(request):
+            middleware.process_view(request, view, (), {})
+            return view(request)
+        middleware = PrivacyPolicyMiddleware(get_response)
+        return middleware
+
+    @override_settings(PRIVACY_POLICY_TOOLS={
+        'ENABLED': True, 'ENFORCE_BEFORE_VIEW': True})
+    def test_blocked_request_does_not_call_view(self):
+        middleware = PrivacyPolicyMiddleware(self.view)
+        response = middleware.process_view(self._request(), self.view, (), {})
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(self.calls, [])
+
+    @override_settings(PRIVACY_POLICY_TOOLS={
+        'ENABLED': True, 'ENFORCE_BEFORE_VIEW': True})
+    def test_exempt_view_before_view(self):
+        view = privacy_policy_exempt(self.view)
+        middleware = PrivacyPolicyMiddleware(view)
+        self.assertIsNone(
+            middleware.process_view(self._request(), view, (), {}))
+
+    @override_settings(PRIVACY_POLICY_TOOLS={'ENABLED': True})
+    def test_exempt_view_after_response(self):
+        response = self._middleware(self.view)(self._request())
+        self.assertEqual(response.status_code, 302)
+        view = privacy_policy_exempt(self.view)
+        response = self._middleware(view)(self._request())
+        self.assertEqual(response.status_code, 200)
+
+
+class PendingPoliciesTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('pending_user', 'pending@example.com', 'password')
+        self.groups = [Group.objects.create(name='Group %d' % i) for i in range(3)]
+        self.general = PrivacyPolicy.objects.create(
+            title="General", text="General", active=True)
+        self.group_policies = [
+            PrivacyPolicy.objects.create(
+                title=g.name, text=g.name, active=True, for_group=g)
+            for g in self.groups
+        ]
+        self.user.groups.add(self.groups[0], self.groups[1])
+
+    def test_pending_policies_single_query(self):
+        PrivacyPolicyConfirmation.objects.create(
+            user=self.user, privacy_policy=self.group_policies[0])
+        with self.assertNumQueries(1):
+            pending = utils.get_pending_policies(self.user)
+        self.assertEqual(pending, [self.general, self.group_policies[1]])
+
+    @override_settings(PRIVACY_POLICY_TOOLS={'DEFAULT_POLICY': False})
+    def test_default_policy_only_for_users_without_group(self):
+        self.assertNotIn(self.general, utils.get_pending_policies(self.user))
+        other = User.objects.create_user('nogroup', 'nogroup@example.com', 'password')
+        self.assertEqual(utils.get_pending_policies(other), [self.general])
+
+    def test_save_confirmation(self):
+        utils.save_confirmation(self.user)
+        self.assertEqual(utils.get_pending_policies(self.user), [])
+        self.assertEqual(
+            PrivacyPolicyConfirmation.objects.filter(user=self.user).count(), 3)
+
+    def test_save_confirmation_queries(self):
+        PrivacyPolicyConfirmation.objects.create(
+            user=self.user, privacy_policy=self.general)
+        with self.assertNumQueries(8):
+            # exists, savepoint, pending, insert,
+            # delete, select and insert of the states, release
+            utils.save_confirmation(self.user)
+        self.assertEqual(utils.get_pending_policies(self.user), [])
+
+    def test_save_confirmations(self):
+        other = User.objects.create_user('bulk', 'bulk@example.com', 'password')
+        PrivacyPolicyConfirmation.objects.create(
+            user=self.user, privacy_policy=self.general)
+        utils.save_confirmations(
+            [self.user, other.pk], [self.general] + self.group_policies,
+            batch_size=1)
+        self.assertEqual(PrivacyPolicyConfirmation.objects.count(), 8)
+        self.assertEqual(utils.get_pending_policies(self.user), [])
+
+
+class PolicyRegistryTest(TestCase):
+    def setUp(self):
+        registry.invalidate()
+        self.groups = [Group.objects.create(name='Group %d' % i) for i in range(5)]
+        self.general = PrivacyPolicy.objects.create(
+            title="General", text="General", active=True)
+        self.group_policy = PrivacyPolicy.objects.create(
+            title="Group", text="Group", active=True, for_group=self.groups[2])
+
+    def test_built_with_one_query(self):
+        with self.assertNumQueries(1):
+            policies = registry.policies()
+        self.assertEqual([p.id for p in policies],
+                         [self.general.id, self.group_policy.id])
+        with self.assertNumQueries(0):
+            self.assertEqual(registry.for_group(self.groups[2].id)[0].id,
+                             self.group_policy.id)
+            self.assertEqual(registry.for_group(self.groups[0].id), ())
+
+    def test_rebuilt_after_change(self):
+        registry.policies()
+        self.group_policy.active = False
+        self.group_policy.save()
+        self.assertEqual([p.id for p in registry.policies()], [self.general.id])
+
+    def test_admin_actions_invalidate(self):
+        registry.policies()
+        admin = PrivacyPolicyAdmin(PrivacyPolicy, AdminSite())
+        admin.make_inactive(None, PrivacyPolicy.objects.all())
+        self.assertEqual(registry.policies(), ())
+
+
+class PolicyGenerationTest(TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+
+    def _check_worker_sees_bump(self):
+        cache.get_cache().clear()
+        registry.invalidate()
+        cache.reset_local_generation()
+        PrivacyPolicy.objects.create(title="First", text="First", active=True)
+        self.assertEqual(len(registry.policies()), 1)
+        # another worker activates a policy without touching this process
+        PrivacyPolicy.objects.filter(pk__gt=0).update(active=False)
+        cache.get_cache().incr(cache.GENERATION_KEY)
+        self.assertEqual(len(registry.policies()), 1)
+        cache.reset_local_generation()
+        self.assertEqual(len(registry.policies()), 0)
+
+    @override_settings(PRIVACY_POLICY_TOOLS={'GENERATION_CHECK_INTERVAL': 60})
+    def test_locmem_cache(self):
+        self._check_worker_sees_bump()
+
+    def test_file_based_cache(self):
+        caches = {
+            'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+            'policies': {
+                'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+                'LOCATION': self.tmpdir,
+            },
+        }
+        with self.settings(CACHES=caches,
+                           PRIVACY_POLICY_TOOLS={
+                               'CACHE_ALIAS': 'policies',
+                               'GENERATION_CHECK_INTERVAL': 60}):
+            self._check_worker_sees_bump()
+
+    def test_generation_survives_eviction(self):
+        cache.get_cache().clear()
+        first = cache.get_generation()
+        cache.get_cache().clear()
+        self.assertNotEqual(cache.get_generation(), first)
+
+
+@override_settings(PRIVACY_POLICY_TOOLS={'GENERATION_CHECK_INTERVAL': 60})
+class StampedeProtectionTest(TestCase):
+    def setUp(self):
+        cache.get_cache().clear()
+        registry.invalidate()
+        cache.reset_local_generation()
+        self.policy = PrivacyPolicy.objects.create(
+            title="Policy", text="Policy", active=True)
+        registry.policies()
+
+    def _bump_elsewhere(self):
+        generation = cache.get_cache().incr(cache.GENERATION_KEY)
+        cache.reset_local_generation()
+        return generation
+
+    def test_previous_snapshot_served_while_locked(self):
+        generation = self._bump_elsewhere()
+        cache.get_cache().add(LOCK_KEY % generation, True)
+        with self.assertNumQueries(0):
+            self.assertEqual(registry.policies()[0].id, self.policy.id)
+
+    def test_shared_snapshot_used(self):
+        generation = self._bump_elsewhere()
+        cache.get_cache().set(SNAPSHOT_KEY % generation, [])
+        with self.assertNumQueries(0):
+            self.assertEqual(registry.policies(), ())
+
+    def test_early_refresh(self):
+        user = User.objects.create_user('early', 'early@example.com', 'password')
+        with self.settings(PRIVACY_POLICY_TOOLS={
+                'GENERATION_CHECK_INTERVAL': 60,
+                'COMPLIANCE_CACHE_TIMEOUT': 60}):
+            generation = cache.current_generation()
+            cache.set_compliant(user, generation, delta=10 ** 6)
+            self.assertTrue(cache.get_compliance(user)[1])
+        with self.settings(PRIVACY_POLICY_TOOLS={
+                'GENERATION_CHECK_INTERVAL': 60,
+                'COMPLIANCE_CACHE_TIMEOUT': 60,
+                'COMPLIANCE_EARLY_REFRESH': 1000}):
+            self.assertFalse(cache.get_compliance(user)[1])
+
+
+class ExemptionMatcherTest(TestCase):
+    def setUp(self):
+        self.factory = RequestFactory()
+
+    def _matches(self, path, resolver_match=None):
+        request = self.factory.get(path)
+        request.resolver_match = resolver_match
+        return build_matcher().matches(request)
+
+    @override_settings(PRIVACY_POLICY_TOOLS={
+        'IGNORE_URLS': ['admin'],
+        'IGNORE_PREFIXES': ['/api/'],
+        'IGNORE_REGEXES': [r'^/health/\d+$'],
+    })
+    def test_paths(self):
+        self.assertTrue(self._matches('/django/admin/'))
+        self.assertTrue(self._matches('/api/policies/'))
+        self.assertFalse(self._matches('/v1/api/policies/'))
+        self.assertTrue(self._matches('/health/1'))
+        self.assertFalse(self._matches('/health/x'))
+        self.assertTrue(self._matches('/static/css/base.css'))
+        self.assertFalse(self._matches('/dashboard/'))
+
+    @override_settings(PRIVACY_POLICY_TOOLS={
+        'POLICY_PAGE_URL': 'unused/page',
+        'IGNORE_URL_NAMES': ['privacy_policy_tools.views.show'],
+        'IGNORE_NAMESPACES': ['admin'],
+    })
+    def test_names_and_namespaces(self):
+        self.assertTrue(self._matches(reverse('privacy_policy_tools.views.show')))
+        admin_match = SimpleNamespace(
+            url_name='index', view_name='admin:index', namespaces=['admin'])
+        self.assertTrue(self._matches('/manage/', admin_match))
+        other_match = SimpleNamespace(
+            url_name='index', view_name='index', namespaces=[])
+        self.assertFalse(self._matches('/manage/', other_match))
+
+    @override_settings(PRIVACY_POLICY_TOOLS={'ENABLED': True})
+    def test_static_files_skip_user(self):
+        class Unloadable:
+            @property
+            def is_authenticated(self):
+                raise AssertionError('user loaded')
+        request = self.factory.get('/static/js/app.js')
+        request.user = Unloadable()
+        with self.assertNumQueries(0):
+            self.assertIsNone(PrivacyPolicyMiddleware(None)._check(request))
+
+
+@override_settings(PRIVACY_POLICY_TOOLS={'ENABLED': True})
+class AsyncMiddlewareTest(TestCase):
+    def setUp(self):
+        registry.invalidate()
+        self.factory = RequestFactory()
+        self.user = User.objects.create_user('async_user', 'async@example.com', 'password')
+        self.policy = PrivacyPolicy.objects.create(
+            title="Policy", text="Policy", active=True)
+
+        async def get_response(request):
+            return HttpResponse()
+        self.middleware = PrivacyPolicyMiddleware(get_response)
+
+    def _request(self):
+        request = self.factory.get('/dashboard/')
+        request.user = self.user
+        return request
+
+    def test_async_capable(self):
+        self.assertTrue(PrivacyPolicyMiddleware.async_capable)
+        self.assertTrue(iscoroutinefunction(self.middleware))
+        self.assertTrue(iscoroutinefunction(self.middleware.process_view))
+
+    async def test_redirects_unconfirmed_user(self):
+        response = await self.middleware(self._request())
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(
+            response.url,
+            reverse('privacy_policy_tools.views.confirm',
+                    args=(self.policy.id, '/dashboard/')))
+
+    async def test_confirmed_user_passes(self):
+        await PrivacyPolicyConfirmation.objects.acreate(
+            user=self.user, privacy_policy=self.policy)
+        response = await self.middleware(self._request())
+        self.assertEqual(response.status_code, 200)
+
+    @override_settings(PRIVACY_POLICY_TOOLS={
+        'ENABLED': True, 'ENFORCE_BEFORE_VIEW': True})
+    async def test_process_view(self):
+        async def view(request):
+            return HttpResponse()
+        response = await self.middleware.process_view(
+            self._request(), view, (), {})
+        self.assertEqual(response.status_code, 302)
+
+
+def skip_policies_hook(request):
+    return False
+
+
+class HookTest(TestCase):
+    @override_settings(PRIVACY_POLICY_TOOLS={
+        'START_HOOK': 'privacy_policy_tools.tests.skip_policies_hook'})
+    def test_hook_resolved_once(self):
+        self.assertIs(utils.get_hook('START_HOOK'), skip_policies_hook)
+        with mock.patch.object(utils, 'get_by_py_path') as get_by_py_path:
+            self.assertIs(utils.get_hook('START_HOOK'), skip_policies_hook)
+        get_by_py_path.assert_not_called()
+        self.assertIsNone(utils.get_hook('SECOND_CONFIRMATION_REQUIRED_HOOK'))
+
+    def test_hook_refreshed_on_setting_changed(self):
+        self.assertIsNone(utils.get_hook('START_HOOK'))
+        with self.settings(PRIVACY_POLICY_TOOLS={
+                'START_HOOK': 'privacy_policy_tools.tests.skip_policies_hook'}):
+            self.assertIs(utils.get_hook('START_HOOK'), skip_policies_hook)
+        self.assertIsNone(utils.get_hook('START_HOOK'))
+
+    @override_settings(PRIVACY_POLICY_TOOLS={
+        'START_HOOK': 'privacy_policy_tools.tests.missing_hook',
+        'SECOND_CONFIRMATION_GET_EMAIL_HOOK': 'privacy_policy_tools.utils.HOOK_SETTINGS',
+        'SECOND_CONFIRMATION_SAVE_EMAIL_HOOK': 'privacy_policy_tools.tests.skip_policies_hook',
+    })
+    def test_system_checks(self):
+        errors = check_hooks(None)
+        self.assertEqual([e.id for e in errors], [
+            'privacy_policy_tools.E001', 'privacy_policy_tools.E002'])
+
+
+second_confirmation_hook_calls = []
+
+
+def second_confirmation_not_required_hook(request, confirmation):
+    second_confirmation_hook_calls.append(confirmation.id)
+    return False
+
+
+class HookMemoizationTest(TestCase):
+    def setUp(self):
+        cache.get_cache().clear()
+        registry.invalidate()
+        second_confirmation_hook_calls.clear()
+        self.factory = RequestFactory()
+        self.middleware = PrivacyPolicyMiddleware(lambda r: HttpResponse())
+        self.user = User.objects.create_user('hook_user', 'hook@example.com', 'password')
+        policy = PrivacyPolicy.objects.create(
+            title="Policy", text="Policy", active=True)
+        self.confirmation = PrivacyPolicyConfirmation.objects.create(
+            user=self.user, privacy_policy=policy)
+
+    def _get(self):
+        request = self.factory.get('/dashboard/')
+        request.user = self.user
+        return self.middleware(request)
+
+    @override_settings(PRIVACY_POLICY_TOOLS={
+        'ENABLED': True,
+        'SECOND_CONFIRMATION_REQUIRED_HOOK':
+            'privacy_policy_tools.tests.second_confirmation_not_required_hook',
+        'MEMOIZE_HOOKS': {'SECOND_CONFIRMATION_REQUIRED_HOOK': 60},
+    })
+    def test_result_memoized(self):
+        self._get()
+        self._get()
+        self.assertEqual(second_confirmation_hook_calls, [self.confirmation.id])
+        cache.invalidate_hook_results([self.user.pk])
+        self._get()
+        self.assertEqual(len(second_confirmation_hook_calls), 2)
+
+    @override_settings(PRIVACY_POLICY_TOOLS={
+        'ENABLED': True,
+        'SECOND_CONFIRMATION_REQUIRED_HOOK':
+            'privacy_policy_tools.tests.second_confirmation_not_required_hook',
+    })
+    def test_hook_skipped_after_second_confirmation(self):
+        self.confirmation.second_confirmed_at = timezone.now()
+        self.confirmation.save()
+        self.assertEqual(self._get().status_code, 200)
+        self.assertEqual(second_confirmation_hook_calls, [])
+
+
+class AppSettingsTest(TestCase):
+    @override_settings(PRIVACY_POLICY_TOOLS={
+        'ENABLED': True, 'IGNORE_URLS': ['admin'],
+        'MEMOIZE_HOOKS': {'START_HOOK': 5}})
+    def test_snapshot(self):
+        app_settings = get_app_settings()
+        self.assertIs(app_settings, get_app_settings())
+        self.assertTrue(app_settings.enabled)
+        self.assertEqual(app_settings.ignore_urls, ('admin',))
+        self.assertEqual(app_settings.policy_page_url, 'terms/and/conditions')
+        with self.assertRaises(FrozenInstanceError):
+            app_settings.enabled = False
+        with self.assertRaises(TypeError):
+            app_settings.memoize_hooks['START_HOOK'] = 10
+
+    def test_rebuilt_on_setting_changed(self):
+        with self.settings(PRIVACY_POLICY_TOOLS={'ENABLED': True}):
+            self.assertTrue(get_app_settings().enabled)
+            self.assertTrue(privacy_tools(None)['privacy_enabled'])
+        with self.settings(PRIVACY_POLICY_TOOLS={}):
+            self.assertFalse(get_app_settings().enabled)
+            self.assertFalse(privacy_tools(None)['privacy_enabled'])
+
+    def test_url_settings_changed(self):
+        with self.settings(PRIVACY_POLICY_TOOLS={'POLICY_PAGE_URL': 'policy/page'}):
+            self.assertEqual(reverse('privacy_policy_tools.views.show'),
+                             '/privacy/policy/page')
+            self.assertEqual(self.client.get('/privacy/policy/page').status_code, 200)
+            self.assertEqual(self.client.get('/privacy/terms/and/conditions').status_code, 404)
+        self.assertEqual(reverse('privacy_policy_tools.views.show'),
+                         '/privacy/terms/and/conditions')
+
+    @override_settings(PRIVACY_POLICY_TOOLS={'IGNORE_URLS': 'admin'})
+    def test_invalid_value(self):
+        with self.assertRaises(ImproperlyConfigured):
+            get_app_settings()
+        self.assertEqual([e.id for e in check_settings(None)],
+                         ['privacy_policy_tools.E003'])
+
+    @override_settings(PRIVACY_POLICY_TOOLS={
+        'IGNORE_REGEXES': ['^/static/', '(', '(?i)^/media/']})
+    def test_invalid_regex(self):
+        errors = check_settings(None)
+        self.assertEqual([e.id for e in errors],
+                         ['privacy_policy_tools.E003'])
+        self.assertIn("'('", errors[0].msg)
+
+    @override_settings(PRIVACY_POLICY_TOOLS={'IGNORE_URLS': 'admin'})
+    def test_check_command_reports_invalid_value(self):
+        utils.resolve_hooks()
+        with self.assertRaisesRegex(SystemCheckError,
+                                    'privacy_policy_tools.E003'):
+            call_command('check', stdout=StringIO(), stderr=StringIO())
+
+
+class ConfirmationConstraintTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('unique_user', 'unique@example.com', 'password')
+        self.policy = PrivacyPolicy.objects.create(
+            title="Policy", text="Policy", active=True)
+
+    def test_duplicate_confirmation_rejected(self):
+        PrivacyPolicyConfirmation.objects.create(
+            user=self.user, privacy_policy=self.policy)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            PrivacyPolicyConfirmation.objects.create(
+                user=self.user, privacy_policy=self.policy)
+
+    def test_confirm_post_idempotent(self):
+        self.client.force_login(self.user)
+        url = reverse('privacy_policy_tools.views.confirm',
+                      args=(self.policy.id, '/dashboard/'))
+        self.client.post(url)
+        first = PrivacyPolicyConfirmation.objects.get(user=self.user)
+        self.assertEqual(views._save_confirmation(self.user, self.policy), first)
+        self.assertEqual(PrivacyPolicyConfirmation.objects.filter(
+            user=self.user, privacy_policy=self.policy).count(), 1)
+
+
+class UserPolicyStateTest(TestCase):
+    def setUp(self):
+        registry.invalidate()
+        self.user = User.objects.create_user('state_user', 'state@example.com', 'password')
+        self.group = Group.objects.create(name='State group')
+        self.v1 = PrivacyPolicy.objects.create(
+            title="Terms", text="v1", active=True, version=1)
+        self.v2 = PrivacyPolicy.objects.create(
+            title="Terms", text="v2", active=False, version=2)
+
+    def _state(self):
+        return UserPolicyState.objects.get(user=self.user)
+
+    def test_lineage_assigned(self):
+        self.assertIsNotNone(self.v1.lineage_id)
+        self.assertEqual(self.v1.lineage_id, self.v2.lineage_id)
+        other = PrivacyPolicy.objects.create(
+            title="Terms", text="group", for_group=self.group)
+        self.assertNotEqual(other.lineage_id, self.v1.lineage_id)
+
+    def test_state_follows_confirmations(self):
+        PrivacyPolicyConfirmation.objects.create(
+            user=self.user, privacy_policy=self.v1)
+        self.assertEqual(self._state().privacy_policy, self.v1)
+        confirmation = PrivacyPolicyConfirmation.objects.create(
+            user=self.user, privacy_policy=self.v2)
+        self.assertEqual(self._state().version, 2)
+        confirmation.second_confirmed_at = timezone.now()
+        confirmation.save()
+        self.assertIsNotNone(self._state().second_confirmed_at)
+        confirmation.delete()
+        self.assertEqual(self._state().privacy_policy, self.v1)
+
+    def test_unconfirmed_policies(self):
+        policies = registry.applicable(set())
+        self.assertEqual(get_unconfirmed_policies(self.user, policies), policies)
+        utils.save_confirmation(self.user)
+        with self.assertNumQueries(1):
+            self.assertEqual(get_unconfirmed_policies(self.user, policies), [])
+
+    def test_cascade_refreshes_once(self):
+        def delete_policy(count):
+            policy = PrivacyPolicy.objects.create(
+                title="Cascade %d" % count, text="cascade")
+            users = [User.objects.create_user('cascade%d_%d' % (count, i))
+                     for i in range(count)]
+            utils.save_confirmations(users, [policy])
+            with CaptureQueriesContext(connection) as queries:
+                policy.delete()
+            self.assertFalse(UserPolicyState.objects.filter(user__in=users).exists())
+            return len(queries)
+        self.assertEqual(delete_policy(2), delete_policy(20))
+
+        utils.save_confirmations([self.user], [self.v1, self.v2])
+        self.v2.delete()
+        self.assertEqual(self._state().privacy_policy, self.v1)
+        PrivacyPolicyConfirmation.objects.filter(user=self.user).delete()
+        self.assertFalse(UserPolicyState.objects.exists())
+
+    def test_rebuild_command(self):
+        other = User.objects.create_user('state_other', 'other@example.com', 'password')
+        utils.save_confirmations([self.user, other], [self.v1, self.v2])
+        UserPolicyState.objects.all().delete()
+        out = StringIO()
+        call_command('rebuild_policy_states', chunk_size=1, stdout=out)
+        self.assertIn('Rebuilt 2 states of 2 users.', out.getvalue())
+        self.assertEqual(
+            set(UserPolicyState.objects.values_list('version', flat=True)), {2})
+
+
+class PolicyLineageTest(TestCase):
+    def setUp(self):
+        self.v1 = PrivacyPolicy.objects.create(
+            title="Terms", text="v1", active=True, version=1)
+        self.lineage = self.v1.lineage
+
+    def test_current_version(self):
+        self.lineage.refresh_from_db()
+        self.assertEqual(self.lineage.current_version, self.v1)
+        v2 = PrivacyPolicy.objects.create(
+            title="Terms", text="v2", active=True, version=2)
+        self.lineage.refresh_from_db()
+        self.assertEqual(self.lineage.current_version, v2)
+        PrivacyPolicyAdmin(PrivacyPolicy, AdminSite()).make_inactive(
+            None, PrivacyPolicy.objects.filter(pk=v2.pk))
+        self.lineage.refresh_from_db()
+        self.assertEqual(self.lineage.current_version, self.v1)
+        self.v1.delete()
+        self.lineage.refresh_from_db()
+        self.assertIsNone(self.lineage.current_version)
+
+    def test_outdated_users(self):
+        old = User.objects.create_user('old', 'old@example.com', 'password')
+        new = User.objects.create_user('new', 'new@example.com', 'password')
+        User.objects.create_user('none', 'none@example.com', 'password')
+        PrivacyPolicyConfirmation.objects.create(user=old, privacy_policy=self.v1)
+        PrivacyPolicyConfirmation.objects.create(user=new, privacy_policy=self.v1)
+        v2 = PrivacyPolicy.objects.create(
+            title="Terms", text="v2", active=True, version=2)
+        PrivacyPolicyConfirmation.objects.create(user=new, privacy_policy=v2)
+        self.lineage.refresh_from_db()
+        current = self.lineage.current_version
+        with self.assertNumQueries(1):
+            outdated = list(get_outdated_users(current))
+        self.assertEqual(outdated, [old])
+
+
+class ExportTest(TestCase):
+    def setUp(self):
+        self.group = Group.objects.create(name='Export group')
+        self.general = PrivacyPolicy.objects.create(
+            title="General", text="General", active=True)
+        self.grouped = PrivacyPolicy.objects.create(
+            title="Grouped", text="Grouped", active=True, for_group=self.group)
+        self.users = [
+            User.objects.create_user('export%d' % i, 'export%d@example.com' % i, 'password')
+            for i in range(3)]
+        utils.save_confirmations(self.users, [self.general])
+        utils.save_confirmations(self.users[:1], [self.grouped])
+
+    def _export(self, **kwargs):
+        return ''.join(exports.export(exports.get_confirmations(), **kwargs))
+
+    def test_keyset_chunks(self):
+        with self.assertNumQueries(3):
+            rows = list(exports.iter_rows(
+                exports.get_confirmations(), chunk_size=2))
+        self.assertEqual([r[0] for r in rows],
+                         sorted(PrivacyPolicyConfirmation.objects.values_list('id', flat=True)))
+        self.assertEqual(rows[0][2], 'export0')
+
+    def test_formats(self):
+        lines = self._export().splitlines()
+        self.assertEqual(lines[0], ','.join(exports.FIELDS))
+        self.assertEqual(len(lines), 5)
+        records = [json.loads(l) for l in self._export(file_format='jsonl').splitlines()]
+        self.assertEqual(records[-1]['for_group'], 'Export group')
+        compressed = b''.join(exports.export(
+            exports.get_confirmations(), compress=True))
+        self.assertEqual(gzip.decompress(compressed).decode(), self._export())
+
+    def test_filters(self):
+        self.assertEqual(exports.get_confirmations(groups=[self.group.id]).count(), 1)
+        self.assertEqual(exports.get_confirmations(policies=[self.general.id]).count(), 3)
+        tomorrow = timezone.now() + timedelta(days=1)
+        self.assertEqual(exports.get_confirmations(since=tomorrow).count(), 0)
+        self.assertEqual(exports.get_confirmations(until=tomorrow).count(), 4)
+        self.assertEqual(exports.parse_moment('2024-01-02').day, 2)
+        with self.assertRaises(ValueError):
+            exports.parse_moment('yesterday')
+
+    def test_view_staff_only(self):
+        url = reverse('privacy_policy_tools.views.export_confirmations')
+        self.client.force_login(self.users[0])
+        self.assertEqual(self.client.get(url).status_code, 302)
+        User.objects.filter(pk=self.users[0].pk).update(is_staff=True)
+        response = self.client.get(url, {'format': 'jsonl', 'gzip': '1',
+                                         'group': self.group.id})
+        self.assertEqual(response['Content-Type'], 'application/gzip')
+        content = gzip.decompress(b''.join(response.streaming_content))
+        self.assertEqual(len(content.splitlines()), 1)
+        self.assertEqual(self.client.get(url, {'since': 'never'}).status_code, 400)
+
+    def test_command(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'export.csv.gz')
+        call_command('export_confirmations', '--gzip', '--output', path,
+                     '--policy', str(self.general.id))
+        with gzip.open(path, 'rt') as f:
+            self.assertEqual(len(f.read().splitlines()), 4)
+        out = StringIO()
+        call_command('export_confirmations', '--format', 'jsonl', stdout=out)
+        self.assertEqual(len(out.getvalue().splitlines()), 4)
+
+
+class ImportTest(TestCase):
+    def setUp(self):
+        self.policy = PrivacyPolicy.objects.create(
+            title="Imported", text="Imported", active=True)
+        self.users = [
+            User.objects.create_user('import%d' % i, 'import%d@example.com' % i, 'password')
+            for i in range(4)]
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def _records(self, field='username'):
+        return [{field: getattr(user, field),
+                 'privacy_policy_id': str(self.policy.id),
+                 'confirmed_at': '2020-01-0%dT10:00:00+00:00' % (i + 1)}
+                for i, user in enumerate(self.users)]
+
+    def test_roundtrip(self):
+        utils.save_confirmations(self.users, [self.policy])
+        path = os.path.join(self.directory, 'export.csv.gz')
+        call_command('export_confirmations', '--gzip', '--output', path)
+        PrivacyPolicyConfirmation.objects.all().delete()
+        call_command('import_confirmations', path, '--batch-size', '3',
+                     stdout=StringIO())
+        self.assertEqual(PrivacyPolicyConfirmation.objects.count(), 4)
+        self.assertEqual(UserPolicyState.objects.count(), 4)
+
+    def test_skipped_records(self):
+        records = self._records('email')
+        records[0]['email'] = 'unknown@example.com'
+        records[1]['privacy_policy_id'] = '0'
+        records[2]['confirmed_at'] = 'yesterday'
+        PrivacyPolicyConfirmation.objects.create(
+            user=self.users[3], privacy_policy=self.policy)
+        with self.assertNumQueries(8):
+            # policies, users, savepoint, insert,
+            # delete, select and insert of the states, release
+            self.assertEqual(imports.import_confirmations(
+                records, user_field='email'), (4, 3))
+        confirmation = PrivacyPolicyConfirmation.objects.get()
+        self.assertNotEqual(confirmation.confirmed_at.year, 2020)
+
+    def test_malformed_lines(self):
+        path = os.path.join(self.directory, 'import.jsonl')
+        records = [json.dumps(record) for record in self._records()]
+        records[1] = records[1][:-1]
+        records[2] = '[1, 2]'
+        with open(path, 'w') as f:
+            f.write('\n'.join(records) + '\n')
+        out = StringIO()
+        call_command('import_confirmations', path, '--batch-size', '2', stdout=out)
+        self.assertEqual(out.getvalue().splitlines(),
+                         ['2 records processed, 1 skipped',
+                          '4 records processed, 2 skipped',
+                          'Imported 4 records, 2 skipped.'])
+        self.assertEqual(
+            set(PrivacyPolicyConfirmation.objects.values_list('user__username', flat=True)),
+            {'import0', 'import3'})
+
+    def test_resume(self):
+        path = os.path.join(self.directory, 'import.jsonl')
+        with open(path, 'w') as f:
+            for record in self._records():
+                f.write(json.dumps(record) + '\n')
+        resume_file = os.path.join(self.directory, 'resume')
+        with open(resume_file, 'w') as f:
+            f.write('2')
+        call_command('import_confirmations', path, '--resume-file',
+                     resume_file, '--batch-size', '1', stdout=StringIO())
+        self.assertEqual(
+            set(PrivacyPolicyConfirmation.objects.values_list('user__username', flat=True)),
+            {'import2', 'import3'})
+        with open(resume_file) as f:
+            self.assertEqual(f.read(), '4')
+
+
+class LargeTableAdminTest(TestCase):
+    def setUp(self):
+        self.admin = PrivacyPolicyConfirmationAdmin(
+            PrivacyPolicyConfirmation, AdminSite())
+        self.superuser = User.objects.create_superuser(
+            'admin', 'admin@example.com', 'password')
+        self.active = PrivacyPolicy.objects.create(
+            title="Active", text="Active", active=True)
+        self.inactive = PrivacyPolicy.objects.create(
+            title="Inactive", text="Inactive", active=False)
+        users = [User.objects.create_user('large%d' % i, 'large%d@example.com' % i, 'password')
+                 for i in range(5)]
+        utils.save_confirmations(users, [self.active, self.inactive])
+
+    def _changelist(self, **params):
+        request = RequestFactory().get('/', params)
+        request.user = self.superuser
+        return self.admin.get_changelist_instance(request)
+
+    def test_no_queries_per_row(self):
+        changelist = self._changelist()
+        with self.assertNumQueries(1):
+            [(str(c.user), str(c.privacy_policy)) for c in changelist.result_list]
+
+    @override_settings(PRIVACY_POLICY_TOOLS={'LARGE_TABLE_ADMIN': True})
+    def test_large_table_mode(self):
+        changelist = self._changelist()
+        self.assertIsInstance(changelist, LargeTableChangeList)
+        self.assertIsInstance(changelist.paginator, EstimatedCountPaginator)
+        self.assertIsNone(changelist.date_hierarchy)
+        self.assertIsNone(changelist.full_result_count)
+        self.assertEqual(self.admin.raw_id_fields, ('user', 'privacy_policy'))
+        confirmation = changelist.result_list[0]
+        self.assertIn('diff_html', confirmation.privacy_policy.get_deferred_fields())
+        with self.assertNumQueries(1):
+            [(str(c.user), str(c.privacy_policy)) for c in changelist.result_list]
+        policy_filter = changelist.filter_specs[0]
+        self.assertEqual([choice[0] for choice in policy_filter.lookup_choices],
+                         [self.active.id])
+        self.assertEqual(
+            self._changelist(privacy_policy__id__exact=self.active.id).result_count, 5)
+        self.assertEqual(self._changelist(q='large1').result_count, 2)
+        self.assertEqual(self._changelist(q='large').result_count, 0)
+
+    def test_estimated_count(self):
+        queryset = PrivacyPolicyConfirmation.objects.all()
+        self.assertEqual(EstimatedCountPaginator(queryset, 10).count, 10)
+        with mock.patch('privacy_policy_tools.paginators.estimate_count',
+                        return_value=50000):
+            self.assertEqual(EstimatedCountPaginator(queryset, 10).count, 50000)
+            self.assertEqual(EstimatedCountPaginator(
+                queryset.filter(privacy_policy=self.active), 10).count, 5)
+
+
+class PolicyUptakeTest(TestCase):
+    def setUp(self):
+        self.group = Group.objects.create(name='Uptake group')
+        self.member = User.objects.create_user('member', 'member@example.com', 'password')
+        self.member.groups.add(self.group)
+        self.loner = User.objects.create_user('loner', 'loner@example.com', 'password')
+        inactive = User.objects.create_user('inactive', 'inactive@example.com', 'password')
+        inactive.groups.add(self.group)
+        User.objects.filter(pk=inactive.pk).update(is_active=False)
+        self.general = PrivacyPolicy.objects.create(
+            title="General", text="General", active=True)
+        self.grouped = PrivacyPolicy.objects.create(
+            title="Grouped", text="Grouped", active=True, for_group=self.group)
+        utils.save_confirmations([self.member, inactive], [self.general, self.grouped])
+        PrivacyPolicyConfirmation.objects.filter(user=self.member, privacy_policy=self.general) \
+            .update(second_confirmed_at=timezone.now())
+
+    def _numbers(self, policy, group=None):
+        uptake = PolicyUptake.objects.get(privacy_policy=policy, group=group)
+        return uptake.applicable, uptake.confirmed, uptake.pending, uptake.second_pending
+
+    def test_compute(self):
+        compute_policy_uptake()
+        self.assertEqual(self._numbers(self.grouped), (1, 1, 0, 0))
+        OneTimeToken.create_token(PrivacyPolicyConfirmation.objects.get(
+            user=self.member, privacy_policy=self.grouped))
+        compute_policy_uptake()
+        self.assertEqual(self._numbers(self.general), (2, 1, 1, 0))
+        self.assertEqual(self._numbers(self.general, self.group), (1, 1, 0, 0))
+        self.assertEqual(self._numbers(self.grouped), (1, 1, 0, 1))
+        self.assertEqual(PolicyUptake.objects.count(), 3)
+
+    @override_settings(PRIVACY_POLICY_TOOLS={'DEFAULT_POLICY': False})
+    def test_default_policy_for_users_without_group(self):
+        compute_policy_uptake()
+        self.assertEqual(self._numbers(self.general), (1, 0, 1, 0))
+
+    def test_command_and_admin(self):
+        out = StringIO()
+        call_command('compute_policy_uptake', stdout=out)
+        self.assertIn('Computed 3 rows', out.getvalue())
+        call_command('compute_policy_uptake', stdout=out)
+        self.assertEqual(PolicyUptake.objects.count(), 3)
+        policy_admin = PrivacyPolicyAdmin(PrivacyPolicy, AdminSite())
+        with self.assertNumQueries(1):
+            policy = policy_admin.get_queryset(None).get(pk=self.general.pk)
+        self.assertEqual((policy_admin.confirmed(policy),
+                          policy_admin.pending(policy)), (1, 1))
+
+
+class RetentionTest(TestCase):
+    def setUp(self):
+        self.v1 = PrivacyPolicy.objects.create(
+            title="Retained", text="v1", active=False, version=1)
+        self.v2 = PrivacyPolicy.objects.create(
+            title="Retained", text="v2", active=True, version=2)
+        self.updated = User.objects.create_user('updated', 'updated@example.com', 'password')
+        self.outdated = User.objects.create_user('outdated', 'outdated@example.com', 'password')
+        utils.save_confirmations([self.updated, self.outdated], [self.v1])
+        utils.save_confirmations([self.updated], [self.v2])
+        confirmation = PrivacyPolicyConfirmation.objects.get(
+            user=self.updated, privacy_policy=self.v2)
+        self.expired = [OneTimeToken.create_token(confirmation) for _ in range(3)]
+        OneTimeToken.objects.update(created_at=timezone.now() - timedelta(hours=1))
+        self.valid = OneTimeToken.create_token(confirmation)
+
+    def test_expired_tokens(self):
+        batches = []
+        deleted = retention.purge(retention.expired_tokens(), batch_size=2,
+                                  progress=batches.append)
+        self.assertEqual((deleted, batches), (3, [2, 3]))
+        self.assertEqual(list(OneTimeToken.objects.all()), [self.valid])
+
+    def test_superseded_confirmations(self):
+        self.assertEqual(
+            list(retention.superseded_confirmations().values_list(
+                'user__username', 'privacy_policy__version')),
+            [('updated', 1)])
+
+    def test_dry_run(self):
+        out = StringIO()
+        call_command('purge_policy_data', '--superseded', '--dry-run', stdout=out)
+        self.assertEqual(out.getvalue().splitlines(),
+                         ['3 expired tokens', '1 superseded confirmations'])
+        self.assertEqual(OneTimeToken.objects.count(), 4)
+
+    def test_archive(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'archive.jsonl.gz')
+        call_command('purge_policy_data', '--superseded', '--archive', path,
+                     stdout=StringIO())
+        with gzip.open(path, 'rt') as f:
+            archived = [json.loads(line) for line in f]
+        self.assertEqual([(r['username'], r['policy_version']) for r in archived],
+                         [('updated', 1)])
+        self.assertEqual(PrivacyPolicyConfirmation.objects.count(), 2)
+        self.assertEqual(UserPolicyState.objects.get(user=self.updated).version, 2)
+
+    def _purge_queries(self, count):
+        users = [User.objects.create_user('purged%d_%d' % (count, i))
+                 for i in range(count)]
+        utils.save_confirmations(users, [self.v1, self.v2])
+        with CaptureQueriesContext(connection) as queries:
+            deleted = retention.purge(retention.superseded_confirmations(),
+                                      batch_size=100)
+        self.assertEqual(UserPolicyState.objects.filter(
+            user__in=users, version=2).count(), count)
+        return deleted, len(queries)
+
+    def test_purge_queries_per_batch(self):
+        OneTimeToken.create_token(PrivacyPolicyConfirmation.objects.get(
+            user=self.updated, privacy_policy=self.v1))
+        small = self._purge_queries(2)
+        large = self._purge_queries(30)
+        self.assertEqual((small[0], large[0]), (3, 30))
+        self.assertEqual(small[1], large[1])
+        self.assertFalse(OneTimeToken.objects.filter(
+            confirmation__privacy_policy=self.v1).exists())
+
+
+class ShowViewCacheTest(TestCase):
+    def setUp(self):
+        cache.get_cache().clear()
+        registry.invalidate()
+        self.policy = PrivacyPolicy.objects.create(
+            title="Public", text="Public text", active=True)
+        self.url = reverse('privacy_policy_tools.views.show')
+
+    def test_conditional_get(self):
+        response = self.client.get(self.url)
+        self.assertContains(response, 'Public text')
+        self.assertIn('Last-Modified', response)
+        etag = response['ETag']
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        with translation.override('de'):
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_rendered_page_cached(self):
+        content = self.client.get(self.url).content
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(self.url).content, content)
+        self.policy.text = 'Changed text'
+        self.policy.save()
+        self.assertContains(self.client.get(self.url), 'Changed text')
+
+    def _anonymous_request(self):
+        request = RequestFactory().get(self.url)
+        request.user = AnonymousUser()
+        SessionMiddleware(lambda r: None).process_request(request)
+        request._messages = FallbackStorage(request)
+        return request
+
+    def _is_cached(self, request):
+        return cache.get_cache().get(views.SHOW_KEY % views._show_etag(request)) is not None
+
+    def test_visitor_specific_pages_not_cached(self):
+        request = self._anonymous_request()
+        messages.info(request, 'Only for visitor A')
+        views.show(request)
+        self.assertFalse(self._is_cached(request))
+        request = self._anonymous_request()
+        get_token(request)
+        views.show(request)
+        self.assertFalse(self._is_cached(request))
+        request = self._anonymous_request()
+        request.session['visited'] = True
+        views.show(request)
+        self.assertFalse(self._is_cached(request))
+        request = self._anonymous_request()
+        views.show(request)
+        self.assertTrue(self._is_cached(request))
+
+    def test_users_not_cached(self):
+        etag = self.client.get(self.url)['ETag']
+        user = User.objects.create_user('show_user', 'show@example.com', 'password')
+        self.client.force_login(user)
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+
+class RenderedTextTest(TestCase):
+    def test_render_text(self):
+        rendered = render_text(
+            '<h2>Scope &amp; Terms</h2><p>Hello <strong>you</strong> &lt;3<br>bye</p>'
+            '<h2 id="old">Scope &amp; Terms</h2><ul><li>a</li><li>b</li></ul>')
+        self.assertEqual(
+            rendered.html,
+            '<h2 id="scope-terms">Scope &amp; Terms</h2><p>Hello <strong>you</strong> &lt;3<br>bye</p>'
+            '<h2 id="scope-terms-2">Scope &amp; Terms</h2><ul><li>a</li><li>b</li></ul>')
+        self.assertEqual(rendered.plain,
+                         'Scope & Terms\n\nHello you <3\nbye\n\nScope & Terms\n\na\nb')
+        self.assertEqual([entry['id'] for entry in rendered.toc],
+                         ['scope-terms', 'scope-terms-2'])
+        self.assertEqual(len(rendered.hash), 64)
+
+    def test_stored_at_save(self):
+        policy = PrivacyPolicy.objects.create(
+            title="Rendered", active=True,
+            text='<h1>Title</h1><p onclick="x()">Body</p><script>bad()</script>')
+        policy.refresh_from_db()
+        self.assertEqual(policy.text_html, '<h1 id="title">Title</h1><p>Body</p>bad()')
+        self.assertEqual(policy.toc, [{'level': 1, 'id': 'title', 'title': 'Title'}])
+        self.assertEqual(policy.text_hash, render_text(policy.text).hash)
+        data = PrivacyPolicySerializer(policy).data
+        self.assertEqual(data['text'], policy.text_html)
+        self.assertEqual(data['text_plain'], 'Title\n\nBody\nbad()')
+        response = self.client.get(reverse('privacy_policy_tools.views.show'))
+        self.assertContains(response, '<h1 id="title">Title</h1>')
+
+
+class SanitizerTest(TestCase):
+    def test_cleaner_is_reused(self):
+        self.assertIs(get_cleaner(), get_cleaner())
+        self.assertEqual(sanitize('<p style="color: red; position: fixed">x</p>'
+                                  '<span style="color: red">y</span>'),
+                         '<p>x</p><span style="color: red;">y</span>')
+
+    def test_allowlists_from_settings(self):
+        cleaner = get_cleaner()
+        with self.settings(PRIVACY_POLICY_TOOLS={
+                'SANITIZE_TAGS': ['p'], 'SANITIZE_ATTRIBUTES': {}}):
+            self.assertIsNot(get_cleaner(), cleaner)
+            self.assertEqual(sanitize('<p><a href="/x">link</a></p>'),
+                             '<p>link</p>')
+            policy = PrivacyPolicy.objects.create(
+                title="Strict", text='<h1>Title</h1><p>Body</p>')
+        self.assertEqual(policy.text, 'Title<p>Body</p>')
+
+    def test_resanitize_policies(self):
+        PrivacyPolicy.objects.create(title="Clean", text='<p>Clean</p>')
+        policy = PrivacyPolicy.objects.create(
+            title="Old", text='<h1>Title</h1><ul><li>A</li><li>B</li></ul>')
+        successor = PrivacyPolicy.objects.create(
+            title="Old", version=2, text='Title<p>AB</p>')
+        self.assertNotEqual(successor.diff_html, '')
+        with self.settings(PRIVACY_POLICY_TOOLS={'SANITIZE_TAGS': ['p']}):
+            out = StringIO()
+            call_command('resanitize_policies', '--workers', '1',
+                         '--dry-run', stdout=out)
+            self.assertIn('Would change 1 of 3 texts (1 policies)', out.getvalue())
+            out = StringIO()
+            call_command('resanitize_policies', '--workers', '2',
+                         '--chunk-size', '1', stdout=out)
+            self.assertIn('Changed 1 of 3 texts (1 policies)', out.getvalue())
+        self.assertFalse(PolicyText.objects.filter(pk=policy.text_hash).exists())
+        successor.refresh_from_db()
+        self.assertEqual(successor.previous_version_id, policy.pk)
+        self.assertEqual(successor.diff_html,
+                         '<div class="policy-diff"><p><del>TitleAB</del></p>'
+                         '<p><ins>Title</ins></p><p><ins>AB</ins></p></div>')
+        policy.refresh_from_db()
+        self.assertEqual(policy.text, 'TitleAB')
+        self.assertEqual(policy.text_html, 'TitleAB')
+        self.assertEqual(policy.toc, [])
+        self.assertEqual(policy.text_hash, render_text(policy.text).hash)
+
+
+class PolicyDiffTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='differ', password='pw')
+        self.v1 = PrivacyPolicy.objects.create(
+            title="Terms", active=True, version=1,
+            text='<p>We store your name.</p><p>Contact us.</p>')
+
+    def test_diff_at_publish(self):
+        self.assertIsNone(self.v1.previous_version)
+        self.assertEqual(self.v1.diff_html, '')
+        v2 = PrivacyPolicy.objects.create(
+            title="Terms", active=True, version=2,
+            text='<p>We store your name and email.</p><p>Contact us.</p>')
+        v2.refresh_from_db()
+        self.assertEqual(v2.previous_version_id, self.v1.pk)
+        self.assertEqual(
+            v2.diff_html,
+            '<div class="policy-diff"><p>We store your <del>name.</del>'
+            '<ins>name and email.</ins></p><p>Contact us.</p></div>')
+        self.client.force_login(self.user)
+        response = self.client.get(
+            reverse('privacy_policy_tools.views.confirm', args=(v2.pk,)))
+        self.assertContains(response, '<ins>name and email.</ins>')
+        PrivacyPolicyConfirmation.objects.create(privacy_policy=v2,
+                                                 user=self.user)
+        response = self.client.get(
+            reverse('privacy_policy_tools.views.confirm', args=(v2.pk,)))
+        self.assertNotContains(response, 'policy-diff')
+
+    def test_edit_previous_version(self):
+        v2 = PrivacyPolicy.objects.create(
+            title="Terms", version=2, text='<p>We store your name.</p>')
+        self.v1.text = '<p>We store your email.</p>'
+        self.v1.save()
+        v2.refresh_from_db()
+        self.assertEqual(
+            v2.diff_html,
+            '<div class="policy-diff"><p>We store your <del>email.</del>'
+            '<ins>name.</ins></p></div>')
+        self.v1.version = 3
+        self.v1.save()
+        v2.refresh_from_db()
+        self.assertIsNone(v2.previous_version_id)
+        self.assertEqual(v2.diff_html, '')
+        self.assertEqual(self.v1.previous_version_id, v2.pk)
+
+    def test_delete_previous_version(self):
+        v2 = PrivacyPolicy.objects.create(
+            title="Terms", version=2, text='<p>Contact us.</p>')
+        v3 = PrivacyPolicy.objects.create(
+            title="Terms", version=3, text='<p>Write to us.</p>')
+        self.v1.delete()
+        v2.refresh_from_db()
+        self.assertIsNone(v2.previous_version_id)
+        self.assertEqual(v2.diff_html, '')
+        v2.delete()
+        v3.refresh_from_db()
+        self.assertIsNone(v3.previous_version_id)
+        self.assertEqual(v3.diff_html, '')
+
+    def test_compute_policy_diffs(self):
+        v2 = PrivacyPolicy.objects.create(
+            title="Terms", version=2, text='<p>Contact us.</p>')
+        PrivacyPolicy.objects.filter(pk=v2.pk).update(
+            previous_version=None, diff_html='')
+        out = StringIO()
+        call_command('compute_policy_diffs', '--chunk-size', '1', stdout=out)
+        self.assertIn('Updated 1 policies', out.getvalue())
+        v2.refresh_from_db()
+        self.assertEqual(v2.previous_version_id, self.v1.pk)
+        self.assertEqual(
+            v2.diff_html,
+            '<div class="policy-diff"><p><del>We store your name.</del></p>'
+            '<p>Contact us.</p></div>')
+        with self.assertNumQueries(1):
+            self.assertEqual(PolicyLineage.update_diffs(), 0)
+
+
+class PolicyTextTest(TestCase):
+    def setUp(self):
+        self.groups = [Group.objects.create(name='text%d' % i) for i in range(3)]
+        self.policies = [
+            PrivacyPolicy.objects.create(title="Shared", active=True, for_group=group,
+                                         text='<h2>Data</h2><p>Shared text</p>')
+            for group in self.groups]
+
+    def test_shared_content(self):
+        self.assertEqual(PolicyText.objects.count(), 1)
+        self.assertEqual(len({p.content_id for p in self.policies}), 1)
+        policy = PrivacyPolicy.objects.get(pk=self.policies[0].pk)
+        self.assertEqual(policy.text, '<h2>Data</h2><p>Shared text</p>')
+        policy.text = '<p>Changed</p>'
+        policy.save()
+        self.assertEqual(PolicyText.objects.count(), 2)
+        self.assertEqual(list(retention.unused_texts()), [])
+
+    def test_rendered_from_cache(self):
+        policies = list(PrivacyPolicy.objects.filter(pk__in=[p.pk for p in self.policies]))
+        cache.get_cache().clear()
+        with self.assertNumQueries(1):
+            PrivacyPolicy.load_rendered(policies)
+        policies = list(PrivacyPolicy.objects.filter(pk__in=[p.pk for p in self.policies]))
+        with self.assertNumQueries(0):
+            PrivacyPolicy.load_rendered(policies)
+            self.assertEqual({p.text_html for p in policies},
+                             {'<h2 id="data">Data</h2><p>Shared text</p>'})
+        self.assertEqual(policies[0].toc, [{'level': 2, 'id': 'data', 'title': 'Data'}])
+
+    def test_store_existing_text(self):
+        rendered = self.policies[0].rendered
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(PolicyText.store('<h2>Data</h2><p>Shared text</p>', rendered),
+                             rendered.hash)
+        self.assertEqual(len(queries), 1)
+        self.assertNotIn('"html"', queries[0]['sql'])
+
+    @override_settings(PRIVACY_POLICY_TOOLS={'COMPRESS_POLICY_TEXT': True})
+    def test_compressed(self):
+        text = '<p>%s</p>' % ('Compressible text. ' * 100)
+        policy = PrivacyPolicy.objects.create(title="Long", text=text)
+        content = PolicyText.objects.get(pk=policy.text_hash)
+        self.assertTrue(content.compressed)
+        self.assertLess(len(content.text), len(text))
+        self.assertEqual(content.get_text(), text)
+        self.assertEqual(content.get_rendered().plain, 'Compressible text. ' * 99 + 'Compressible text.')
+        short = PrivacyPolicy.objects.create(title="Short", text='<p>x</p>')
+        self.assertFalse(PolicyText.objects.get(pk=short.text_hash).compressed)
+
+    def test_purge_unused_texts(self):
+        old = self.policies[0].content_id
+        for policy in self.policies:
+            policy.text = '<p>New</p>'
+            policy.save()
+        self.assertEqual([t.pk for t in retention.unused_texts()], [old])
+        out = StringIO()
+        call_command('purge_policy_data', '--unused-texts', stdout=out)
+        self.assertIn('Deleted 1 unused texts.', out.getvalue())
+        self.assertEqual(PolicyText.objects.count(), 1)
@@ -22,17 +22,22 @@
 This module designs the urls of the package privacy_policy_tools.
 """
 
+from django.core.exceptions import ImproperlyConfigured
 from django.urls import re_path
-from privacy_policy_tools.utils import get_setting
+from privacy_policy_tools.conf import AppSettings, get_app_settings
 from privacy_policy_tools.views import confirm, show, \
-    second_confirm_required, second_confirm
+    second_confirm_required, second_confirm, export_confirmations
 
-confirm_url = get_setting('POLICY_CONFIRM_URL')
-page_url = get_setting('POLICY_PAGE_URL')
-second_confirm_required_url = get_setting('SECOND_CONFIRM_REQUIRED_URL',
-                                          'confirm/second/required')
-second_confirm_url = get_setting('SECOND_CONFIRM_URL',
-                                 'confirm/second')
+try:
+    app_settings = get_app_settings()
+except ImproperlyConfigured:
+    # reported by the system check privacy_policy_tools.E003
+    app_settings = AppSettings()
+confirm_url = app_settings.policy_confirm_url
+page_url = app_settings.policy_page_url
+second_confirm_required_url = app_settings.second_confirm_required_url
+second_confirm_url = app_settings.second_confirm_url
+export_url = app_settings.export_url
 
 urlpatterns = [
     re_path(r'^' + page_url + r'$',
@@ -47,4 +52,7 @@ urlpatterns = [
     re_path(r'^' + second_confirm_url + r'/(?P<confirm_id>[0-9]+)/next('
                                         r'?P<token>[a-z]+)$',
             second_confirm, name='privacy_policy_tools.views.second_confirm'),
+    re_path(r'^' + export_url + r'$',
+            export_confirmations,
+            name='privacy_policy_tools.views.export_confirmations'),
 ]
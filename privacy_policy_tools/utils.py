@@ -22,14 +22,30 @@
 """
 This module provides some helper functions of the privacy_policy_tools.
 """
+from itertools import islice
 
 from django.conf import settings
-from django.contrib.auth.models import Group
+from django.core.exceptions import ImproperlyConfigured
+from django.db import transaction
+from django.db.models import Exists, F, OuterRef, Q
 from django.http import Http404
 from django.utils import timezone
 
+from privacy_policy_tools.cache import invalidate_compliance, \
+    invalidate_hook_results
+from privacy_policy_tools.conf import get_app_settings
 from privacy_policy_tools.models import PrivacyPolicy, \
     PrivacyPolicyConfirmation
+from privacy_policy_tools.states import refresh_policy_states
+
+HOOK_SETTINGS = (
+    'START_HOOK',
+    'SECOND_CONFIRMATION_REQUIRED_HOOK',
+    'SECOND_CONFIRMATION_GET_EMAIL_HOOK',
+    'SECOND_CONFIRMATION_SAVE_EMAIL_HOOK',
+)
+
+_hooks = {}
 
 
 def get_by_py_path(py_path):
@@ -47,26 +63,55 @@ def get_by_py_path(py_path):
     return m
 
 
-def get_active_policies():
+def get_hook(name):
     """
-    Returns a list of active policies.
+    Returns the callable configured by a hook setting or None if the
+    hook is not set. The path is imported only once.
+
+    Keyword arguments:
+        name -- name of the setting, one of HOOK_SETTINGS
     """
-    policies = []
     try:
-        nogroup = PrivacyPolicy.objects.filter(
-            for_group=None, active=True).order_by('-published_at')
-        policies.extend(nogroup)
-    except PrivacyPolicy.DoesNotExist:
+        return _hooks[name]
+    except KeyError:
         pass
-    groups = Group.objects.all().order_by('name')
-    for group in groups:
+    py_path = getattr(get_app_settings(), name.lower())
+    hook = get_by_py_path(py_path) if py_path else None
+    _hooks[name] = hook
+    return hook
+
+
+def resolve_hooks():
+    """
+    Imports all configured hooks. Hooks which can not be imported and
+    invalid settings are skipped here; they are reported by the system
+    checks.
+    """
+    try:
+        get_app_settings()
+    except ImproperlyConfigured:
+        return
+    for name in HOOK_SETTINGS:
         try:
-            active = group.privacypolicy_set.filter(
-                active=True).order_by('-published_at')
-            policies.extend(active)
-        except PrivacyPolicy.DoesNotExist:
+            get_hook(name)
+        except (ImportError, AttributeError, ValueError):
             pass
-    return policies
+
+
+def reset_hooks():
+    """
+    Forgets the imported hooks.
+    """
+    _hooks.clear()
+
+
+def get_active_policies():
+    """
+    Returns a list of active policies. Policies without a group come first,
+    followed by the policies of the groups ordered by the group name.
+    """
+    return list(PrivacyPolicy.objects.filter(active=True).order_by(
+        F('for_group__name').asc(nulls_first=True), '-published_at'))
 
 
 def get_active_policies_for_group(group=None):
@@ -89,6 +134,91 @@ def get_active_policies_for_group(group=None):
             return []
 
 
+def get_group_ids(user):
+    """
+    Returns the set of ids of the groups of a user.
+
+    Keyword arguments:
+        - user -- user object
+    """
+    return set(user.groups.values_list('id', flat=True))
+
+
+async def aget_group_ids(user):
+    """
+    Async version of get_group_ids.
+    """
+    return {pk async for pk in user.groups.values_list('id', flat=True)}
+
+
+def policy_applies(policy, group_ids):
+    """
+    Returns True if a policy has to be confirmed by a member of the given
+    groups. The setting DEFAULT_POLICY is honored.
+
+    Keyword arguments:
+        - policy -- policy to check
+        - group_ids -- set of group ids of the user
+    """
+    if policy.for_group_id is None:
+        return get_app_settings().default_policy or not group_ids
+    return policy.for_group_id in group_ids
+
+
+def _applicable_policies(user):
+    """
+    Returns a queryset of the active policies which apply to a user. The
+    groups of the user are resolved in a subquery.
+
+    Keyword arguments:
+        - user -- user object
+    """
+    for_groups = Q(for_group__in=user.groups.all())
+    if get_app_settings().default_policy:
+        no_group = Q(for_group=None)
+    else:
+        no_group = Q(for_group=None) & ~Exists(user.groups.all())
+    return PrivacyPolicy.objects.filter(
+        no_group | for_groups, active=True).order_by(
+        F('for_group__name').asc(nulls_first=True), '-published_at')
+
+
+def get_confirmations(user, policies):
+    """
+    Returns a dict of the confirmations of a user to the given policies
+    keyed by the policy id. This needs one query.
+
+    Keyword arguments:
+        - user -- user object
+        - policies -- list of policies
+    """
+    confirmations = PrivacyPolicyConfirmation.objects.filter(
+        user=user, privacy_policy__in=[p.id for p in policies])
+    return {c.privacy_policy_id: c for c in confirmations}
+
+
+async def aget_confirmations(user, policies):
+    """
+    Async version of get_confirmations.
+    """
+    confirmations = PrivacyPolicyConfirmation.objects.filter(
+        user=user, privacy_policy__in=[p.id for p in policies])
+    return {c.privacy_policy_id: c async for c in confirmations}
+
+
+def get_pending_policies(user):
+    """
+    Returns a list of the active policies which apply to a user and are
+    not confirmed by the user yet. This needs one query.
+
+    Keyword arguments:
+        - user -- user object
+    """
+    confirmed = PrivacyPolicyConfirmation.objects.filter(
+        user=user, privacy_policy=OuterRef('pk'))
+    return list(_applicable_policies(user).exclude(Exists(confirmed)))
+
+
 def get_setting(key, default=None):
     """
     Returns a settings value.
@@ -108,26 +238,55 @@ def get_setting(key, default=None):
 
 def save_confirmation(user):
     """
-    Saves a confirmation to policies according to the given user.
+    Saves a confirmation to policies according to the given user. The
+    missing confirmations are computed in one query and inserted at once.
 
     Keyword arguments:
         - user -- user object
     """
-    policies = get_active_policies()
-    if len(policies) <= 0:
+    if not PrivacyPolicy.objects.filter(active=True).exists():
         raise Http404
-    for policy in policies:
-        if get_setting('DEFAULT_POLICY', True):
-            no = policy.for_group is None
-        else:
-            no = policy.for_group is None \
-                and len(user.groups.all()) <= 0
-        if policy.for_group in user.groups.all() or no:
-            confirms = PrivacyPolicyConfirmation.objects.filter(
-                privacy_policy=policy, user=user)
-            if len(confirms) <= 0:
-                confirmation = PrivacyPolicyConfirmation(
-                    user=user,
-                    confirmed_at=timezone.now(),
-                    privacy_policy=policy)
-                confirmation.save()
+    confirmed_at = timezone.now()
+    with transaction.atomic():
+        PrivacyPolicyConfirmation.objects.bulk_create(
+            [PrivacyPolicyConfirmation(user=user,
+                                       confirmed_at=confirmed_at,
+                                       privacy_policy=policy)
+             for policy in get_pending_policies(user)],
+            ignore_conflicts=True)
+        # bulk_create sends no signals
+        refresh_policy_states([user.pk])
+    invalidate_compliance([user.pk])
+    invalidate_hook_results([user.pk])
+
+
+def save_confirmations(users, policies, batch_size=1000):
+    """
+    Confirms the given policies for many users at once, e.g. when users
+    are migrated or provisioned by single sign-on. Existing confirmations
+    are kept. Every batch of users is inserted in its own transaction.
+
+    Keyword arguments:
+        - users -- iterable of users or user ids
+        - policies -- iterable of policies or policy ids
+        - batch_size -- number of users per batch
+    """
+    policy_ids = [getattr(p, 'pk', p) for p in policies]
+    if not policy_ids:
+        return
+    confirmed_at = timezone.now()
+    user_ids = (getattr(u, 'pk', u) for u in users)
+    while True:
+        batch = list(islice(user_ids, batch_size))
+        if not batch:
+            break
+        with transaction.atomic():
+            PrivacyPolicyConfirmation.objects.bulk_create(
+                [PrivacyPolicyConfirmation(user_id=user_id,
+                                           confirmed_at=confirmed_at,
+                                           privacy_policy_id=policy_id)
+                 for user_id in batch for policy_id in policy_ids],
+                ignore_conflicts=True)
+            refresh_policy_states(batch)
+        invalidate_compliance(batch)
+        invalidate_hook_results(batch)
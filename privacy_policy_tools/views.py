@@ -22,42 +22,131 @@
 """
 This module provides the views of the privacy_policy_tools.
 """
+import hashlib
 from smtplib import SMTPException
 
 from django.contrib import messages
 from django.contrib.auth import logout
-from django.contrib.auth.decorators import login_required
+from django.contrib.auth.decorators import login_required, \
+    user_passes_test
 from django.core.mail import send_mail
-from django.http import HttpResponseRedirect, Http404
+from django.http import HttpResponse, HttpResponseRedirect, Http404, \
+    HttpResponseBadRequest, StreamingHttpResponse
 from django.shortcuts import render, get_object_or_404
-from django.utils.translation import gettext_lazy as _
+from django.utils.translation import get_language, gettext_lazy as _
+from django.utils.cache import has_vary_header
+from django.views.decorators.http import condition
 from django.template.loader import render_to_string
 from django.urls import reverse
 from django.utils import timezone
 
 from privacy_policy_tools.models import PrivacyPolicy, \
     PrivacyPolicyConfirmation, OneTimeToken
-from privacy_policy_tools.utils import get_active_policies, get_setting, \
-    get_by_py_path
+from privacy_policy_tools.cache import get_cache
+from privacy_policy_tools.conf import get_app_settings
+from privacy_policy_tools.exports import CONTENT_TYPES, FORMATS, export, \
+    get_confirmations, parse_moment
+from privacy_policy_tools.registry import registry
+from privacy_policy_tools.utils import get_active_policies, get_hook
 from privacy_policy_tools.forms import ConfirmForm, SecondConfirmGetEmail
 
 
+SHOW_KEY = 'privacy_policy_tools:show:%s'
+
+
+def _show_etag(request):
+    """
+    Returns the ETag of the policy page. It changes with the active
+    policies, the language, the time zone and the user.
+
+    Keyword arguments:
+        - request -- the calling HttpRequest
+    """
+    fingerprint, _last_modified = registry.fingerprint()
+    user = request.user
+    key = '%s:%s:%s:%s' % (fingerprint, get_language(),
+                           timezone.get_current_timezone_name(),
+                           user.pk if user.is_authenticated else '')
+    return hashlib.md5(key.encode()).hexdigest()
+
+
+def _show_last_modified(request):
+    """
+    Returns the latest publication date of the active policies.
+
+    Keyword arguments:
+        - request -- the calling HttpRequest
+    """
+    return registry.fingerprint()[1]
+
+
+def _is_shareable(request, response):
+    """
+    Returns True if a rendered page does not depend on the visitor, so it
+    can be served to every anonymous user. This is not the case if
+    session data, messages or the CSRF token were used or if the response
+    sets or varies on cookies. Reading the user from the session alone
+    does not prevent sharing.
+
+    Keyword arguments:
+        - request -- the calling HttpRequest
+        - response -- the rendered HttpResponse
+    """
+    session = getattr(request, 'session', None)
+    if session is not None and (session.modified or session.keys()):
+        return False
+    storage = getattr(request, '_messages', None)
+    if storage is not None and len(storage):
+        return False
+    if request.META.get('CSRF_COOKIE_NEEDS_UPDATE'):
+        return False
+    return not response.cookies and not has_vary_header(response, 'Cookie')
+
+
+@condition(etag_func=_show_etag, last_modified_func=_show_last_modified)
 def show(request):
     """
-    Displays the Privacy Policies.
+    Displays the Privacy Policies. Conditional requests are answered from
+    the policy registry. The page rendered for anonymous users is cached
+    for SHOW_CACHE_TIMEOUT seconds per ETag if it does not depend on the
+    visitor.
 
     Keyword arguments:
         - request -- the calling HttpRequest
 
     Template: privacy_policy_tools/show.html
     """
-    policies = get_active_policies()
+    timeout = get_app_settings().show_cache_timeout
+    key = None
+    if timeout and not request.user.is_authenticated:
+        key = SHOW_KEY % _show_etag(request)
+        content = get_cache().get(key)
+        if content is not None:
+            return HttpResponse(content)
+
+    policies = PrivacyPolicy.load_rendered(get_active_policies())
     params = {
         'policies': policies
     }
 
-    return render(
+    response = render(
         request, 'privacy_policy_tools/show.html', params)
+    if key is not None and _is_shareable(request, response):
+        get_cache().set(key, response.content, timeout)
+    return response
+
+
+def _save_confirmation(user, policy):
+    """
+    Stores the confirmation of a policy, tolerating concurrent submits.
+
+    Keyword arguments:
+        - user -- the confirming user
+        - policy -- the confirmed PrivacyPolicy
+    """
+    return PrivacyPolicyConfirmation.objects.get_or_create(
+        user=user, privacy_policy=policy,
+        defaults={'confirmed_at': timezone.now()})[0]
 
 
 def confirm(request, policy_id, next='/terms/and/conditions'):
@@ -77,11 +166,9 @@ def confirm(request, policy_id, next='/terms/and/conditions'):
 
     is_confirmed = False
     if request.user.is_authenticated:
-        confirmations = PrivacyPolicyConfirmation.objects.filter(
-            privacy_policy=policy, user=request.user)
-        if len(confirmations) > 0:
-            is_confirmed = True
-        else:
+        is_confirmed = PrivacyPolicyConfirmation.objects.filter(
+            privacy_policy=policy, user=request.user).exists()
+        if not is_confirmed:
             url = reverse('privacy_policy_tools.views.confirm',
                           args=(policy_id, next,))
 
@@ -92,18 +179,10 @@ def confirm(request, policy_id, next='/terms/and/conditions'):
                 request.POST,
                 agree_label=policy.confirm_checkbox_text)
             if form.is_valid():
-                confirmation = PrivacyPolicyConfirmation(
-                    user=request.user,
-                    confirmed_at=timezone.now(),
-                    privacy_policy=policy)
-                confirmation.save()
+                _save_confirmation(request.user, policy)
                 return HttpResponseRedirect(next)
         else:
-            confirmation = PrivacyPolicyConfirmation(
-                user=request.user,
-                confirmed_at=timezone.now(),
-                privacy_policy=policy)
-            confirmation.save()
+            _save_confirmation(request.user, policy)
             return HttpResponseRedirect(next)
     else:
         if policy.confirm_checkbox is True:
@@ -137,12 +216,10 @@ def second_confirm_required(request, confirm_id):
                                      id=confirm_id)
     if confirmation.second_confirmed_at is not None:
         raise Http404
-    get_hook = get_setting(
-        'SECOND_CONFIRMATION_GET_EMAIL_HOOK', None)
+    get_email_hook = get_hook('SECOND_CONFIRMATION_GET_EMAIL_HOOK')
 
-    if get_hook is not None:
-        get_hook = get_by_py_path(get_hook)
-        parent_email = get_hook(request)
+    if get_email_hook is not None:
+        parent_email = get_email_hook(request)
     else:
         raise Http404
 
@@ -152,11 +229,9 @@ def second_confirm_required(request, confirm_id):
         form = SecondConfirmGetEmail(request.POST)
         if form.is_valid():
             email = form.cleaned_data['email']
-            save_hook = get_setting(
-                'SECOND_CONFIRMATION_SAVE_EMAIL_HOOK', None)
+            save_hook = get_hook('SECOND_CONFIRMATION_SAVE_EMAIL_HOOK')
 
             if save_hook is not None:
-                save_hook = get_by_py_path(save_hook)
                 save_hook(request, email)
             else:
                 raise Http404
@@ -174,8 +249,7 @@ def second_confirm_required(request, confirm_id):
             message = render_to_string(
                 'privacy_policy_tools/second_confirm_mail.txt',
                 context, request)
-            from_email = get_setting('SECOND_CONFIRM_FROM_EMAIL',
-                                     'no-reply@example.com')
+            from_email = get_app_settings().second_confirm_from_email
             try:
                 send_mail(
                     subject,
@@ -239,7 +313,7 @@ def second_confirm(request, confirm_id, token):
             request,
             'privacy_policy_tools/second_confirm_invalid.html', {})
     token = tokens.first()
-    valid_for = get_setting('SECOND_CONFIRM_VALID_FOR_MINUTES', 10)
+    valid_for = get_app_settings().second_confirm_valid_for_minutes
     now = timezone.now()
     delta = now - token.created_at
     delta_minutes = int(delta.total_seconds() / 60)
@@ -278,3 +352,40 @@ def second_confirm(request, confirm_id, token):
         request,
         'privacy_policy_tools/second_confirm.html',
         params)
+
+
+@user_passes_test(lambda user: user.is_active and user.is_staff)
+def export_confirmations(request):
+    """
+    Streams the confirmations as CSV or JSON Lines. The query parameters
+    format (csv or jsonl), gzip, policy, group, since and until
+    correspond to the options of the export_confirmations command.
+
+    Keyword arguments:
+        - request -- the calling HttpRequest
+    """
+    file_format = request.GET.get('format', 'csv')
+    compress = request.GET.get('gzip') in ('1', 'true')
+    try:
+        if file_format not in FORMATS:
+            raise ValueError(file_format)
+        since = request.GET.get('since')
+        until = request.GET.get('until')
+        confirmations = get_confirmations(
+            policies=[int(p) for p in request.GET.getlist('policy')],
+            groups=[int(g) for g in request.GET.getlist('group')],
+            since=parse_moment(since) if since else None,
+            until=parse_moment(until) if until else None)
+    except ValueError:
+        return HttpResponseBadRequest()
+
+    filename = 'confirmations.' + file_format
+    content_type = CONTENT_TYPES[file_format]
+    if compress:
+        filename += '.gz'
+        content_type = 'application/gzip'
+    response = StreamingHttpResponse(
+        export(confirmations, file_format, compress),
+        content_type=content_type)
+    response['Content-Disposition'] = 'attachment; filename="%s"' % filename
+    return response